@@ -1,14 +1,70 @@
 from fastapi import Path, Header, Query
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 PROVIDERS = ["KBase", "ESGF", "ARM"]
 
+MEDIA_TYPE_NDJSON = "application/x-ndjson"
+MEDIA_TYPE_OCTET_STREAM = "application/octet-stream"
+
 
 class RequestObject(BaseModel):
     object_id: str | None = None
     date_end: str | None = None
     date_start: str | None = None
     version: int | None = None
+    included: list[str] | None = Field(
+        example=["/samples/[*]/name"],
+        description="Paths into the object to return instead of the whole object"
+    )
+    no_data: bool = Field(default=False, description="Return the object metadata only")
+    limit: int | None = Field(
+        gt=0,
+        le=10000,
+        description="Page through listings, returning at most this many items per page"
+    )
+    after: int | None = Field(
+        description="The cursor returned as 'next' with the previous page of a listing"
+    )
+    facets: dict[str, str | list[str]] | None = Field(
+        example={"source_id": "CESM2", "experiment_id": "historical", "variable_id": "tas"},
+        description="Search facets the files must match, a list of values matches any of them"
+    )
+    variables: list[str] | None = Field(
+        example=["tas"],
+        description="The variables to read, instead of all of them"
+    )
+    time_start: str | None = Field(
+        example="2000-01-01",
+        description="The start of the time window to read, inclusive"
+    )
+    time_end: str | None = Field(
+        example="2009-12-31",
+        description="The end of the time window to read, inclusive"
+    )
+    bbox: list[float] | None = Field(
+        example=[30.0, 45.0, 250.0, 270.0],
+        min_items=4,
+        max_items=4,
+        description="The area to read as [lat_min, lat_max, lon_min, lon_max], in the coordinates of the data"
+    )
+
+
+class BatchObject(BaseModel):
+    # ints first so numeric IDs aren't coerced to names
+    object_id: int | str = Field(
+        example="35084/455",
+        description="An object reference, or an object ID or name if the workspace is provided"
+    )
+    workspace: int | str | None = Field(example=35084, description="A workspace ID or name")
+    version: int | None = Field(example=1, description="The object version, ignored for references")
+
+
+class BatchRequestObject(BaseModel):
+    objects: list[BatchObject]
+    chunk_size: int | None = Field(
+        gt=0,
+        description="The number of objects fetched per upstream call, capped by the service"
+    )
 
 
 PATH_PROVIDER = Path(
@@ -17,6 +73,17 @@ PATH_PROVIDER = Path(
     description=f"Data provider from one of the following options: {PROVIDERS}."
 )
 
+PATH_OBJECT_ID = Path(
+    example="455",
+    description="The ID or name of an object"
+)
+
+PATH_VERSION = Path(
+    example=1,
+    ge=1,
+    description="The version of an object"
+)
+
 HEADER_KBASE_AUTH_TOKEN = Header(
     default=None,
     description="KBase authentication token",
@@ -59,3 +126,55 @@ ARM_ACQ_DATE = Query(
     regex=r'^\d{4}-\d{2}-\d{2}$',
     description="The date of data to acquire from ARM"
 )
+
+ARM_END_DATE = Query(
+    default=None,
+    example="2017-01-20",
+    regex=r'^\d{4}-\d{2}-\d{2}$',
+    description="The last date of data to acquire from ARM, for multi-day ranges"
+)
+
+ARM_VARIABLES = Query(
+    default=None,
+    example=["temp_mean", "rh_mean"],
+    description="The variables to return from ARM, all of them if omitted"
+)
+
+ARM_TIME_START = Query(
+    default=None,
+    example="2017-01-14T06:00",
+    regex=r'^\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}(:\d{2})?)?$',
+    description="The start of the time window to return from ARM"
+)
+
+ARM_TIME_END = Query(
+    default=None,
+    example="2017-01-14T18:00",
+    regex=r'^\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}(:\d{2})?)?$',
+    description="The end of the time window to return from ARM, inclusive"
+)
+
+ARM_RESAMPLE_MINUTES = Query(
+    default=None,
+    example=60,
+    gt=0,
+    description="Resample the ARM data to one record per this many minutes"
+)
+
+ARM_AGGREGATE = Query(
+    default="mean",
+    regex=r'^(mean|min|max)$',
+    description="How the values in each resampled period are aggregated, one of mean, min or max"
+)
+
+FACET_NAMES = Query(
+    example=["source_id", "experiment_id"],
+    description="The names of the facets to count. Any other query parameters are facets the "
+                "counted datasets must match, repeat a parameter to match any of its values"
+)
+
+FACET_PROJECT = Query(
+    default="CMIP6",
+    example="CMIP6",
+    description="The project to count the datasets of"
+)
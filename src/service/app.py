@@ -19,10 +19,13 @@ from starlette.exceptions import HTTPException as StarletteHTTPException
 from src.common.version import VERSION
 from src.service import errors, app_state
 from src.service import models_errors
+from src.utils.arm_helpers.arm_helper import configure_session
+from src.utils.cache import FileCache
 from src.utils.config import DataverseServiceConfig
 from src.utils.timestamp import timestamp
 from src.service.dataverse import Dataverse
 from src.utils.data_handlers.arm_handler2 import ARMHandler2
+from src.utils.data_handlers.esgf_handler import ESGFHandler
 from src.utils.data_handlers.kbase_handler2 import KBaseHandler2
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -48,10 +51,36 @@ def create_app(noop=False):
     """
     cfg = DataverseServiceConfig(None, "", "https://ci.kbase.us/services/ws")
 
-    dataverse = Dataverse()
-    dataverse.register_handler('ARM', ARMHandler2)
-    dataverse.register_handler('KBase', KBaseHandler2)
+    # handlers are built once and shared by all requests, see app_state for startup / shutdown
+    dataverse = Dataverse(max_workers=cfg.handler_thread_pool_size)
+    arm_file_cache = None
+    if cfg.arm_file_cache_dir:
+        arm_file_cache = FileCache(cfg.arm_file_cache_dir, cfg.arm_file_cache_max_mb * 1024 * 1024)
+    configure_session(pool_maxsize=cfg.arm_max_concurrency * cfg.arm_download_parallelism)
+    arm_handler = ARMHandler2(
+        file_cache=arm_file_cache,
+        download_parallelism=cfg.arm_download_parallelism,
+        max_rows=cfg.arm_max_rows
+    )
+    dataverse.register_handler('ARM', arm_handler, max_concurrency=cfg.arm_max_concurrency)
+    kbase_handler = KBaseHandler2(
+        batch_chunk_size=cfg.kbase_batch_chunk_size,
+        read_batch_window_sec=cfg.kbase_read_batch_window_ms / 1000,
+        read_batch_max_size=cfg.kbase_read_batch_max_size,
+        object_cache_size=cfg.kbase_object_cache_size,
+        object_cache_dir=cfg.kbase_object_cache_dir,
+        object_cache_max_bytes=cfg.kbase_object_cache_max_mb * 1024 * 1024,
+        shared_cache_path=cfg.shared_cache_path,
+        shared_cache_size=cfg.shared_cache_size
+    )
+    dataverse.register_handler('KBase', kbase_handler, max_concurrency=cfg.kbase_max_concurrency)
+    esgf_handler = ESGFHandler(
+        index_url=cfg.esgf_index_url,
+        search_concurrency=cfg.esgf_search_concurrency
+    )
+    dataverse.register_handler('ESGF', esgf_handler, max_concurrency=cfg.esgf_max_concurrency)
     app_state.DATAVERSE = dataverse
+    app_state.ARM_FILE_CACHE = arm_file_cache
 
     app = FastAPI(
         title=SERVICE_NAME,
@@ -100,6 +129,8 @@ def _handle_app_exception(r: Request, exc: errors.DataverseError):
         status_code = status.HTTP_403_FORBIDDEN
     elif isinstance(exc, errors.NoDataException):
         status_code = status.HTTP_404_NOT_FOUND
+    elif isinstance(exc, errors.ServiceUnavailableError):
+        status_code = status.HTTP_503_SERVICE_UNAVAILABLE
     else:
         status_code = status.HTTP_400_BAD_REQUEST
     return _format_error(status_code, exc.message, exc.error_type)
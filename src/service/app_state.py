@@ -5,15 +5,33 @@ All functions assume that the application state has been appropriately initializ
 calling the build_app() method
 """
 
+import asyncio
+
 from fastapi import FastAPI, Request
+from starlette.concurrency import run_in_threadpool
 
+from src.service.errors import InvalidTokenError, ServiceUnavailableError
+from src.utils.arm_helpers.arm_helper import configure_query_cache, close_session
+from src.utils.cache import SQLiteCache
 from src.utils.config import DataverseServiceConfig
-from src.utils.kbase_helpers.workspaceClient import Workspace
+from src.utils.esgf_helpers.esgf_helper import (
+    close_sessions as close_esgf_sessions,
+    configure_search_cache
+)
+from src.utils.kbase_helpers.baseclient import (
+    set_pool_defaults,
+    close_pooled_sessions,
+    close_async_pooled_sessions
+)
+from src.utils.kbase_helpers.authclient import AuthServiceError, InvalidToken, KBaseAuth
+from src.utils.kbase_helpers.client_registry import configure_workspace_clients, get_workspace_client
 
 
 # The main point of this module is to handle all the stuff we add to app.state in one place
 # to keep it consistent and allow for refactoring without breaking other code
 DATAVERSE = None
+# downloaded ARM files shared by the ARM handlers, or None if not cached
+ARM_FILE_CACHE = None
 
 
 async def build_app(
@@ -21,7 +39,45 @@ async def build_app(
 ) -> None:
     """ Build the application state. """
     app.state._cfg = cfg
-    app.state._ws_url = await _get_workspace_url(cfg)
+    app.state._auth = KBaseAuth(
+        cfg.kbase_auth_url,
+        cache_maxsize=cfg.kbase_token_cache_size,
+        invalid_token_ttl=cfg.kbase_invalid_token_ttl_sec,
+        timeout=cfg.kbase_auth_timeout_sec,
+        shared_cache=SQLiteCache(cfg.shared_cache_path, 'kbase_tokens', cfg.shared_cache_size)
+        if cfg.shared_cache_path else None
+    )
+    set_pool_defaults(
+        pool_connections=cfg.kbase_pool_connections,
+        pool_maxsize=cfg.kbase_pool_maxsize,
+        max_retries=cfg.kbase_max_retries,
+        keep_alive=cfg.kbase_keep_alive
+    )
+    configure_workspace_clients(
+        maxsize=cfg.kbase_client_cache_size,
+        ttl=cfg.kbase_client_cache_ttl_sec
+    )
+    configure_query_cache(
+        maxsize=cfg.arm_query_cache_size,
+        closed_ttl=cfg.arm_query_closed_ttl_sec,
+        open_ttl=cfg.arm_query_open_ttl_sec
+    )
+    configure_search_cache(
+        maxsize=cfg.esgf_search_cache_size,
+        ttl=cfg.esgf_search_cache_ttl_sec,
+        directory=cfg.esgf_search_cache_dir,
+        max_bytes=cfg.esgf_search_cache_max_mb * 1024 * 1024
+    )
+    try:
+        app.state._ws_version = await _get_workspace_version(cfg.kbase_workspace_url)
+    except Exception as e:
+        raise ValueError(f"Could not connect to workspace at {cfg.kbase_workspace_url}: {str(e)}") from e
+    print("Workspace version: " + app.state._ws_version)
+    app.state._ws_url = cfg.kbase_workspace_url
+    app.state._ws_version_task = asyncio.create_task(
+        _refresh_workspace_version(app, cfg.kbase_version_refresh_sec))
+    if DATAVERSE:
+        await DATAVERSE.startup()
     # allow generating the workspace client to be mocked out in a request mock
     # app.state._get_ws = lambda token: Workspace(app.state._ws_url, token=token)
 
@@ -30,22 +86,62 @@ async def clean_app(app: FastAPI) -> None:
     """
     Clean up the application state, shutting down external connections and releasing resources.
     """
+    if DATAVERSE:
+        await DATAVERSE.shutdown()
+    app.state._ws_version_task.cancel()
+    close_pooled_sessions()
+    await close_async_pooled_sessions()
+    close_session()
+    await close_esgf_sessions()
     print("bye Dataverse")
 
 
-async def _get_workspace_url(cfg: DataverseServiceConfig) -> str:
+async def _get_workspace_version(ws_url: str) -> str:
+    # could check the version later if we add dependencies on newer versions
+    return await get_workspace_client(ws_url, async_client=True).ver()
+
+
+async def _refresh_workspace_version(app: FastAPI, interval_sec: int) -> None:
+    # keeps the version probe off the request path, failures leave the last known version
+    while True:
+        await asyncio.sleep(interval_sec)
+        try:
+            app.state._ws_version = await _get_workspace_version(app.state._ws_url)
+        except Exception as e:
+            print(f"Could not refresh workspace version: {str(e)}")
+
+
+def get_config(r: Request) -> DataverseServiceConfig:
+    return r.app.state._cfg
+
+
+async def get_user(r: Request, token: str) -> str:
+    """
+    Get the KBase user of a token, raising InvalidTokenError if the auth service rejects it, or
+    ServiceUnavailableError if the auth service can't be reached or fails.
+    Tokens cached in process are resolved without leaving the event loop, the shared cache and
+    the auth service are only called from the thread pool.
+    """
+    auth = r.app.state._auth
     try:
-        ws = Workspace(cfg.kbase_workspace_url)
-        # could check the version later if we add dependencies on newer versions
-        print("Workspace version: " + ws.ver())
-    except Exception as e:
-        raise ValueError(f"Could not connect to workspace at {cfg.kbase_workspace_url}: {str(e)}") from e
-    return cfg.kbase_workspace_url
+        user = auth.get_cached_user(token)
+        if not user:
+            user = await run_in_threadpool(auth.get_user, token)
+    except InvalidToken as e:
+        raise InvalidTokenError(str(e)) from e
+    except AuthServiceError as e:
+        raise ServiceUnavailableError(str(e)) from e
+    return user
 
 
 def get_workspace_url(r: Request) -> str:
     return r.app.state._ws_url
 
+
+def get_workspace_version(r: Request) -> str:
+    """ Get the workspace version from the most recent probe. """
+    return r.app.state._ws_version
+
 # def get_workspace(r: Request, token: str) -> Workspace:
 #     """
 #     Get a workspace client initialized for a user.
@@ -1,13 +1,60 @@
+import asyncio
+import functools
+import hashlib
+import inspect
+import itertools
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from src.service.errors import UnsupportedOperationError
 from src.utils.data_handlers.data_handler import DataHandler
 
+# the number of rows pulled from a handler per thread pool call when streaming
+_STREAM_BLOCK_ROWS = 1000
+
+
+def _take(rows, n):
+    return list(itertools.islice(rows, n))
+
 
 class Dataverse:
+    """
+    Manages the lifecycle of the data handlers. Handlers are constructed once, registered, then
+    started and shut down along with the service. Per request credentials are passed to the
+    handlers as call arguments.
 
-    def __init__(self):
+    Synchronous handler methods are run on a dedicated thread pool so they never block the event
+    loop, and each handler may be given a limit on how many of its calls run at once.
+
+    Identical concurrent fetches by users with the same permissions share one upstream call.
+    """
+
+    def __init__(self, max_workers: int = 32):
+        """
+        max_workers - the size of the thread pool running synchronous handler methods.
+        """
         self.handlers = {}
+        self._semaphores = {}
+        self._max_workers = max_workers
+        self._executor = None
+        # single flight key -> the task fetching the data
+        self._in_flight = {}
+        self._fetches = 0
+        self._collapsed = 0
 
-    def register_handler(self, handler_id: str, handler: DataHandler):
+    def register_handler(self, handler_id: str, handler: DataHandler, max_concurrency: int = None):
+        """
+        Register a handler.
+        handler_id - the provider name the handler is registered under.
+        handler - the handler.
+        max_concurrency - the maximum number of calls to the handler that may run at once, or
+            None for no limit other than the size of the thread pool.
+        """
         self.handlers[handler_id] = handler
+        if max_concurrency:
+            self._semaphores[handler_id] = asyncio.Semaphore(max_concurrency)
+        else:
+            self._semaphores.pop(handler_id, None)
 
     def handler(self, handler_id: str, handler: DataHandler):
 
@@ -16,13 +63,149 @@ class Dataverse:
     def list_handlers(self):
         return list(self.handlers)
 
-    def resolve_path(self, handler_id, **kwargs):
-        auth = {
-            'token': kwargs.get('token', None),
-            'user': kwargs.get('user', None)
-        }
-        if handler_id in self.handlers:
-            _h = self.handlers[handler_id](**auth)
-            return _h.fetch_data(**kwargs)
+    async def startup(self):
+        """ Start the thread pool and all the registered handlers. """
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._max_workers, thread_name_prefix='dataverse_handler')
+        for handler in self.handlers.values():
+            await handler.startup()
+
+    async def shutdown(self):
+        """ Shut down all the registered handlers and the thread pool, releasing resources. """
+        for handler in self.handlers.values():
+            await handler.shutdown()
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _call_handler(self, handler_id, method, *args, **kwargs):
+        semaphore = self._semaphores.get(handler_id)
+        if semaphore:
+            async with semaphore:
+                return await self._call(method, *args, **kwargs)
+        return await self._call(method, *args, **kwargs)
+
+    async def _call(self, method, *args, **kwargs):
+        if inspect.iscoroutinefunction(method):
+            return await method(*args, **kwargs)
+        # falls back on the loop's default executor if the service wasn't started
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(method, *args, **kwargs))
+
+    @staticmethod
+    def _flight_key(handler_id, kwargs):
+        # the user validated by the service, or else the token, bounds who may share a result
+        token = kwargs.get('token', None)
+        scope = kwargs.get('auth_user', None) or (
+            hashlib.sha256(token.encode('utf-8')).hexdigest() if token else None)
+        args = {k: v for k, v in kwargs.items() if k != 'token'}
+        return handler_id, scope, json.dumps(args, sort_keys=True, default=str)
+
+    async def resolve_path(self, handler_id, **kwargs):
+        """
+        Fetches data with the handler's fetch_data method. A fetch identical to one already in
+        flight for the same user or token waits for and shares that fetch's result, rather than
+        calling the handler again.
+        """
+        if handler_id not in self.handlers:
+            raise Exception(f'Error! {self.handlers.keys()}')
+        key = self._flight_key(handler_id, kwargs)
+        task = self._in_flight.get(key)
+        if task is None:
+            self._fetches += 1
+            task = asyncio.ensure_future(
+                self._call_handler(handler_id, self.handlers[handler_id].fetch_data, **kwargs))
+            self._in_flight[key] = task
+            task.add_done_callback(functools.partial(self._land, key))
         else:
+            self._collapsed += 1
+        # a caller going away mustn't cancel the fetch for the others
+        return await asyncio.shield(task)
+
+    def _land(self, key, task):
+        self._in_flight.pop(key, None)
+        if not task.cancelled():
+            # marks the error as retrieved if every caller went away
+            task.exception()
+
+    def flight_stats(self):
+        """ Returns the number of fetches made, and how many more were collapsed into them. """
+        return {
+            'fetches': self._fetches,
+            'collapsed': self._collapsed,
+            'in_flight': len(self._in_flight)
+        }
+
+    async def stream_path(self, handler_id, **kwargs):
+        """
+        Yields the rows of the data as the handler produces them. Rows are pulled from the handler
+        a block at a time on the thread pool, subject to the handler's concurrency limit. The
+        handler's rows are closed once read, or when the client goes away.
+        """
+        if handler_id not in self.handlers:
+            raise Exception(f'Error! {self.handlers.keys()}')
+        rows = self.handlers[handler_id].iter_data(**kwargs)
+        block = None
+        try:
+            while True:
+                # a client going away mustn't leave the block being read from the rows
+                block = asyncio.ensure_future(
+                    self._call_handler(handler_id, _take, rows, _STREAM_BLOCK_ROWS))
+                for row in await asyncio.shield(block):
+                    yield row
+                if len(block.result()) < _STREAM_BLOCK_ROWS:
+                    break
+        finally:
+            if block is not None:
+                # a generator still running on the thread pool can't be closed
+                await asyncio.wait([block])
+                if not block.cancelled():
+                    block.exception()
+            if hasattr(rows, 'close'):
+                await self._call(rows.close)
+
+    async def open_file(self, handler_id, **kwargs):
+        """
+        Opens a file for streaming with the handler's open_file method and returns the handler's
+        FileStream. Read the file with iter_file.
+        """
+        if handler_id not in self.handlers:
+            raise Exception(f'Error! {self.handlers.keys()}')
+        handler = self.handlers[handler_id]
+        if not hasattr(handler, 'open_file'):
+            raise UnsupportedOperationError(f'{handler_id} does not support file downloads')
+        return await self._call_handler(handler_id, handler.open_file, **kwargs)
+
+    async def iter_file(self, file_stream):
+        """
+        Yields the chunks of a file opened with open_file, reading each one on the thread pool.
+        The file is closed once read, or when the client goes away.
+        """
+        done = object()
+        try:
+            while True:
+                chunk = await self._call(next, file_stream.chunks, done)
+                if chunk is done:
+                    break
+                yield chunk
+        finally:
+            file_stream.close()
+
+    def is_immutable(self, handler_id, **kwargs):
+        return handler_id in self.handlers and self.handlers[handler_id].is_immutable(**kwargs)
+
+    async def resolve_facets(self, handler_id, **kwargs):
+        if handler_id not in self.handlers:
+            raise Exception(f'Error! {self.handlers.keys()}')
+        handler = self.handlers[handler_id]
+        if not hasattr(handler, 'fetch_facets'):
+            raise UnsupportedOperationError(f'{handler_id} does not support facet listings')
+        return await self._call_handler(handler_id, handler.fetch_facets, **kwargs)
+
+    async def resolve_batch(self, handler_id, **kwargs):
+        if handler_id not in self.handlers:
             raise Exception(f'Error! {self.handlers.keys()}')
+        handler = self.handlers[handler_id]
+        if not hasattr(handler, 'fetch_batch'):
+            raise UnsupportedOperationError(f'{handler_id} does not support batch retrieval')
+        return await self._call_handler(handler_id, handler.fetch_batch, **kwargs)
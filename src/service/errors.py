@@ -45,6 +45,9 @@ class ErrorType(Enum):
     UNSUPPORTED_OP = (100000, "Unsupported operation")  # noqa: E222 @IgnorePep8
     """ The requested operation is not supported. """
 
+    SERVICE_UNAVAILABLE = (110000, "Upstream service unavailable")  # noqa: E222 @IgnorePep8
+    """ A service Dataverse depends on could not be reached or failed. """
+
     def __init__(self, error_code, error_type):
         self.error_code = error_code
         self.error_type = error_type
@@ -151,3 +154,21 @@ class IllegalParameterError(DataverseError):
 
     def __init__(self, message: str = None):
         super().__init__(ErrorType.ILLEGAL_PARAMETER, message)
+
+
+class UnsupportedOperationError(DataverseError):
+    """
+    An error thrown when a requested operation is not supported.
+    """
+
+    def __init__(self, message: str = None):
+        super().__init__(ErrorType.UNSUPPORTED_OP, message)
+
+
+class ServiceUnavailableError(DataverseError):
+    """
+    An error thrown when a service Dataverse depends on could not be reached or failed.
+    """
+
+    def __init__(self, message: str = None):
+        super().__init__(ErrorType.SERVICE_UNAVAILABLE, message)
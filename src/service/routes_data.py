@@ -1,17 +1,32 @@
 """
 Routes for general dataverse endpoints
 """
+import hashlib
+import json
 from typing import Any, Optional
 
-from fastapi import APIRouter, Request, Body
+from fastapi import APIRouter, Depends, Request, Body, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 
 import src.common.common_params as common_params
+import src.utils.data_formats as data_formats
 from src.common.version import VERSION
 from src.service import app_state
-from src.service.errors import MissingTokenError, IllegalParameterError, MissingParameterError
+from src.service.errors import (
+    MissingTokenError,
+    IllegalParameterError,
+    MissingParameterError,
+    UnsupportedOperationError
+)
+from src.utils.arm_helpers.arm_helper import query_cache_stats
 from src.utils.data_handlers.arm_handler import ARMHandler
 from src.utils.data_handlers.kbase_handler import KBaseHandler
+from src.utils.esgf_helpers.esgf_helper import search_cache_stats
+from src.utils.kbase_helpers.baseclient import get_pool_stats
+from src.utils.tar_stream import MEDIA_TYPE_TAR
 from src.utils.timestamp import timestamp
 
 SERVICE_NAME = "ESS Dataverse"
@@ -48,6 +63,10 @@ class SavedData(BaseModel):
     kbase_obj_info: Optional[list[Any]] = Field(example=["object_name", "object_version"])
 
 
+class BatchSavedData(SavedData):
+    error: Optional[str] = Field(example="Could not save objects to workspace: ...")
+
+
 @ROUTER_DATA.get("/", response_model=Root, include_in_schema=False)
 async def root():
     return {
@@ -57,42 +76,252 @@ async def root():
     }
 
 
+@ROUTER_DATA.get("/stats")
+def service_stats():
+    return {
+        "kbase_http_pools": get_pool_stats(),
+        "arm_query_cache": query_cache_stats(),
+        "esgf_search_cache": search_cache_stats(),
+        "single_flight": app_state.DATAVERSE.flight_stats() if app_state.DATAVERSE else None
+    }
+
+
+async def _kbase_user(r: Request,
+                      provider: str = common_params.PATH_PROVIDER,
+                      auth_token: Optional[str] = common_params.HEADER_AUTH_TOKEN
+                      ) -> Optional[str]:
+    """
+    Resolves the KBase user of the request's token before any upstream data call, so bad tokens
+    are turned away without touching the Workspace. Requests without a token may still read
+    public data. Other providers' tokens aren't KBase tokens and are left to their handlers.
+    """
+    if provider != 'KBase' or not auth_token:
+        return None
+    return await app_state.get_user(r, auth_token)
+
+
+async def _kbase_save_user(r: Request,
+                           provider: str = common_params.PATH_PROVIDER,
+                           kbase_auth_token: Optional[str] = common_params.HEADER_KBASE_AUTH_TOKEN
+                           ) -> Optional[str]:
+    # the save routes take the token in their own header
+    return await _kbase_user(r, provider, kbase_auth_token)
+
+
 @ROUTER_DATA.get("/data2")
 def list_providers():
     return app_state.DATAVERSE.list_handlers()
 
 
+# must be declared before the /data2/{provider}/{path} route
+@ROUTER_DATA.post("/data2/{provider}/batch")
+async def retrieve_data2_batch(request: common_params.BatchRequestObject,
+                               provider: str = common_params.PATH_PROVIDER,
+                               auth_token: Optional[str] = common_params.HEADER_AUTH_TOKEN,
+                               auth_user: Optional[str] = common_params.HEADER_ARM_USERNAME,
+                               kbase_user: Optional[str] = Depends(_kbase_user),
+                               ):
+
+    args = {
+        'token': auth_token,
+        'user': auth_user,
+        'auth_user': kbase_user,
+        'objects': [o.dict() for o in request.objects],
+        'chunk_size': request.chunk_size
+    }
+    return await app_state.DATAVERSE.resolve_batch(provider, **args)
+
+
+@ROUTER_DATA.get("/data2/{provider}/facets")
+async def list_facets2(r: Request,
+                       provider: str = common_params.PATH_PROVIDER,
+                       names: list[str] = common_params.FACET_NAMES,
+                       project: str = common_params.FACET_PROJECT,
+                       ):
+    # the remaining query parameters filter the counted datasets, e.g. &variable_id=tas
+    facets = {k: r.query_params.getlist(k) for k in r.query_params if k not in ('names', 'project')}
+    args = {
+        'path': project,
+        'names': names,
+        'facets': facets
+    }
+    return await app_state.DATAVERSE.resolve_facets(provider, **args)
+
+
+def _data_response(r: Request, provider: str, args: dict, data):
+    """
+    Immutable data gets a strong ETag and may be cached indefinitely. Data read with a token is
+    only cached by the client, as shared caches can't be trusted to keep it per token or to drop it
+    when access is revoked. Other data is returned as is.
+    """
+    if not app_state.DATAVERSE.is_immutable(provider, **args):
+        return data
+    body = json.dumps(jsonable_encoder(data), separators=(',', ':')).encode('utf-8')
+    headers = {
+        'ETag': f'"{hashlib.sha256(body).hexdigest()}"',
+        'Cache-Control': f"{'private' if args.get('token') else 'public'}, max-age=31536000, immutable",
+        'Vary': common_params.HEADER_AUTH_TOKEN.alias
+    }
+    if headers['ETag'] in r.headers.get('If-None-Match', ''):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type='application/json', headers=headers)
+
+
+def _accepts(r: Request, media_type: str) -> bool:
+    return media_type in r.headers.get('Accept', '')
+
+
+async def _ndjson_response(rows) -> StreamingResponse:
+    """
+    Stream rows as newline delimited JSON so the first rows reach the client before the rest
+    have been fetched.
+    """
+    # pull the first row before responding so upstream errors still get a proper error response
+    try:
+        first = [await rows.__anext__()]
+    except StopAsyncIteration:
+        first = []
+
+    async def lines():
+        for row in first:
+            yield json.dumps(jsonable_encoder(row)) + '\n'
+        async for row in rows:
+            yield json.dumps(jsonable_encoder(row)) + '\n'
+
+    return StreamingResponse(lines(), media_type=common_params.MEDIA_TYPE_NDJSON)
+
+
+def _negotiate_format(r: Request) -> Optional[str]:
+    """
+    Returns the first columnar media type in the Accept header, or None if the client didn't ask
+    for one.
+    """
+    for media_type in r.headers.get('Accept', '').split(','):
+        media_type = media_type.split(';')[0].strip()
+        if media_type in data_formats.ENCODERS:
+            return media_type
+    return None
+
+
+async def _columnar_response(media_type: str, df) -> Response:
+    try:
+        # encoding large frames is CPU bound, keep it off the event loop
+        body = await run_in_threadpool(data_formats.ENCODERS[media_type], df)
+    except ImportError as e:
+        raise UnsupportedOperationError(f'{media_type} output is not available: {str(e)}') from e
+    return Response(content=body, media_type=media_type)
+
+
+async def _file_response(provider: str, args: dict) -> StreamingResponse:
+    """
+    Proxy a file from the provider in chunks, so large files are never held in memory whole.
+    """
+    file_stream = await app_state.DATAVERSE.open_file(provider, **args)
+    return StreamingResponse(app_state.DATAVERSE.iter_file(file_stream),
+                             status_code=file_stream.status_code,
+                             headers=file_stream.headers)
+
+
+@ROUTER_DATA.get("/data2/{provider}/{path}/{object_id}")
+async def download_data2(r: Request,
+                         provider: str = common_params.PATH_PROVIDER,
+                         path: str = common_params.PATH_PROVIDER,
+                         object_id: str = common_params.PATH_OBJECT_ID,
+                         auth_token: Optional[str] = common_params.HEADER_AUTH_TOKEN,
+                         auth_user: Optional[str] = common_params.HEADER_ARM_USERNAME,
+                         kbase_user: Optional[str] = Depends(_kbase_user),
+                         ):
+    # a GET twin of the octet-stream mode of the POST route below, for Range aware download tools
+    args = {
+        'token': auth_token,
+        'user': auth_user,
+        'auth_user': kbase_user,
+        'path': path,
+        'object_id': object_id,
+        'range': r.headers.get('Range')
+    }
+    return await _file_response(provider, args)
+
+
+@ROUTER_DATA.get("/data2/{provider}/{path}/{object_id}/{version}")
+async def retrieve_data2_version(r: Request,
+                                 provider: str = common_params.PATH_PROVIDER,
+                                 path: str = common_params.PATH_PROVIDER,
+                                 object_id: str = common_params.PATH_OBJECT_ID,
+                                 version: int = common_params.PATH_VERSION,
+                                 auth_token: Optional[str] = common_params.HEADER_AUTH_TOKEN,
+                                 auth_user: Optional[str] = common_params.HEADER_ARM_USERNAME,
+                                 kbase_user: Optional[str] = Depends(_kbase_user),
+                                 ):
+    # a GET twin of the POST route below so exact versions can be cached by HTTP caches
+    args = {
+        'token': auth_token,
+        'user': auth_user,
+        'auth_user': kbase_user,
+        'path': path,
+        'object_id': object_id,
+        'version': version
+    }
+    data = await app_state.DATAVERSE.resolve_path(provider, **args)
+    return _data_response(r, provider, args, data)
+
+
 @ROUTER_DATA.post("/data2/{provider}/{path}")
-async def retrieve_data2(request: common_params.RequestObject,
-                    provider: str = common_params.PATH_PROVIDER,
-                   path: str = common_params.PATH_PROVIDER,
-                   auth_token: Optional[str] = common_params.HEADER_AUTH_TOKEN,
-                   auth_user: Optional[str] = common_params.HEADER_ARM_USERNAME,
-                   ):
+async def retrieve_data2(r: Request,
+                         request: common_params.RequestObject,
+                         provider: str = common_params.PATH_PROVIDER,
+                         path: str = common_params.PATH_PROVIDER,
+                         auth_token: Optional[str] = common_params.HEADER_AUTH_TOKEN,
+                         auth_user: Optional[str] = common_params.HEADER_ARM_USERNAME,
+                         kbase_user: Optional[str] = Depends(_kbase_user),
+                         ):
 
     args = {
         'token': auth_token,
         'user': auth_user,
+        'auth_user': kbase_user,
         'path': path,
         'object_id': request.object_id,
         'version': request.version,
+        'included': request.included,
+        'no_data': request.no_data,
+        'limit': request.limit,
+        'after': request.after,
         'date_start': request.date_start,
-        'date_end': request.date_end
+        'date_end': request.date_end,
+        'facets': request.facets,
+        'variables': request.variables,
+        'time_start': request.time_start,
+        'time_end': request.time_end,
+        'bbox': request.bbox
     }
-    return app_state.DATAVERSE.resolve_path(provider, **args)
+    if _accepts(r, common_params.MEDIA_TYPE_OCTET_STREAM) or _accepts(r, MEDIA_TYPE_TAR):
+        return await _file_response(provider, {**args, 'range': r.headers.get('Range')})
+    if _accepts(r, common_params.MEDIA_TYPE_NDJSON):
+        return await _ndjson_response(app_state.DATAVERSE.stream_path(provider, **args))
+    data = await app_state.DATAVERSE.resolve_path(provider, **args)
+    return _data_response(r, provider, args, data)
 
 
 @ROUTER_DATA.post("/data2/{provider}")
-async def retrieve_data2(provider: str = common_params.PATH_PROVIDER,
+async def retrieve_data2(r: Request,
+                         request: Optional[common_params.RequestObject] = None,
+                         provider: str = common_params.PATH_PROVIDER,
                          auth_token: Optional[str] = common_params.HEADER_AUTH_TOKEN,
                          auth_user: Optional[str] = common_params.HEADER_ARM_USERNAME,
+                         kbase_user: Optional[str] = Depends(_kbase_user),
                          ):
 
     args = {
         'token': auth_token,
-        'user': auth_user
+        'user': auth_user,
+        'auth_user': kbase_user
     }
-    return app_state.DATAVERSE.resolve_path(provider, **args)
+    if request:
+        args.update({'limit': request.limit, 'after': request.after})
+    if _accepts(r, common_params.MEDIA_TYPE_NDJSON):
+        return await _ndjson_response(app_state.DATAVERSE.stream_path(provider, **args))
+    return await app_state.DATAVERSE.resolve_path(provider, **args)
 
 
 @ROUTER_DATA.get("/data/{provider}", response_model=RetrievedData)
@@ -101,8 +330,15 @@ async def retrieve_data(r: Request,
                         kbase_object_reference: Optional[str] = common_params.KBASE_OBJ_REF,
                         arm_datastream: Optional[str] = common_params.ARM_DATASREAM,
                         arm_acquire_date: Optional[str] = common_params.ARM_ACQ_DATE,
+                        arm_end_date: Optional[str] = common_params.ARM_END_DATE,
+                        arm_variables: Optional[list[str]] = common_params.ARM_VARIABLES,
+                        arm_time_start: Optional[str] = common_params.ARM_TIME_START,
+                        arm_time_end: Optional[str] = common_params.ARM_TIME_END,
+                        arm_resample_minutes: Optional[int] = common_params.ARM_RESAMPLE_MINUTES,
+                        arm_aggregate: str = common_params.ARM_AGGREGATE,
                         auth_token: Optional[str] = common_params.HEADER_AUTH_TOKEN,
-                        arm_username: Optional[str] = common_params.HEADER_ARM_USERNAME) -> RetrievedData:
+                        arm_username: Optional[str] = common_params.HEADER_ARM_USERNAME,
+                        kbase_user: Optional[str] = Depends(_kbase_user)) -> RetrievedData:
     kbase_metadata, kbase_data, arm_data = list(), dict(), list()
 
     if provider == 'KBase':
@@ -119,11 +355,25 @@ async def retrieve_data(r: Request,
     elif provider == 'ARM':
         if not (arm_username and auth_token):
             raise MissingTokenError('Please provide ARM Auth Token and Username')
-        arm_handler = ARMHandler(arm_username, auth_token)
+        cfg = app_state.get_config(r)
+        arm_handler = ARMHandler(arm_username, auth_token, file_cache=app_state.ARM_FILE_CACHE,
+                                 download_parallelism=cfg.arm_download_parallelism, max_rows=cfg.arm_max_rows)
 
         if not (arm_datastream and arm_acquire_date):
             raise MissingParameterError('Please provide ARM Datastream and Acquire Date')
-        arm_data = await arm_handler.fetch_data(arm_datastream, arm_acquire_date)
+        # applied to the dataset before it is loaded and converted
+        subset = {
+            'variables': arm_variables,
+            'time_start': arm_time_start,
+            'time_end': arm_time_end,
+            'resample_minutes': arm_resample_minutes,
+            'aggregate': arm_aggregate
+        }
+        media_type = _negotiate_format(r)
+        if media_type:
+            df = await arm_handler.fetch_frame(arm_datastream, arm_acquire_date, arm_end_date, **subset)
+            return await _columnar_response(media_type, df)
+        arm_data = await arm_handler.fetch_data(arm_datastream, arm_acquire_date, arm_end_date, **subset)
     elif provider == 'ESGF':
         pass
     else:
@@ -136,7 +386,8 @@ async def retrieve_data(r: Request,
 async def save_data(r: Request,
                     provider: str = common_params.PATH_PROVIDER,
                     save_obj: ObjToSave = Body(...),
-                    kbase_auth_token: Optional[str] = common_params.HEADER_KBASE_AUTH_TOKEN) -> SavedData:
+                    kbase_auth_token: Optional[str] = common_params.HEADER_KBASE_AUTH_TOKEN,
+                    kbase_user: Optional[str] = Depends(_kbase_save_user)) -> SavedData:
     kbase_obj_ref, kbase_obj_info = list(), None
 
     if provider == 'KBase':
@@ -160,3 +411,34 @@ async def save_data(r: Request,
         raise IllegalParameterError(f'Unexpected provider. Please use one of {common_params.PROVIDERS}')
 
     return SavedData(kbase_obj_ref=kbase_obj_ref, kbase_obj_info=kbase_obj_info)
+
+
+@ROUTER_DATA.post("/data/{provider}/batch", response_model=list[BatchSavedData])
+async def save_data_batch(r: Request,
+                          provider: str = common_params.PATH_PROVIDER,
+                          save_objs: list[ObjToSave] = Body(...),
+                          kbase_auth_token: Optional[str] = common_params.HEADER_KBASE_AUTH_TOKEN,
+                          kbase_user: Optional[str] = Depends(_kbase_save_user)
+                          ) -> list[BatchSavedData]:
+
+    if provider == 'KBase':
+        ws_url = app_state.get_workspace_url(r)
+        if not kbase_auth_token:
+            raise MissingTokenError('Please provide KBase Auth Token')
+
+        kbase_handler = KBaseHandler(kbase_auth_token, ws_url=ws_url)
+
+        objs = [(o.wsid, o.obj_data.dict(), o.provenance) for o in save_objs]
+        cfg = app_state.get_config(r)
+        results = await kbase_handler.save_batch(
+            objs, chunk_size=cfg.kbase_batch_chunk_size, max_concurrency=cfg.kbase_save_concurrency)
+
+    elif provider in common_params.PROVIDERS:
+        raise UnsupportedOperationError(f'{provider} does not support saving data in batches')
+
+    else:
+        raise IllegalParameterError(f'Unexpected provider. Please use one of {common_params.PROVIDERS}')
+
+    return [BatchSavedData(error=str(res)) if isinstance(res, Exception)
+            else BatchSavedData(kbase_obj_ref=res[0], kbase_obj_info=res[1])
+            for res in results]
@@ -0,0 +1,267 @@
+"""
+Helpers for the ARM Data Center (ADC) live data web service.
+
+https://adc.arm.gov/armlive/
+"""
+
+import datetime as dt
+import functools
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.utils.cache import TTLCache
+
+ADC_URL = 'https://adc.arm.gov/armlive/livedata/'
+
+_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+_DEFAULT_POOL_MAXSIZE = 10
+_DEFAULT_QUERY_CACHE_SIZE = 1000
+_DEFAULT_CLOSED_QUERY_TTL_SEC = 24 * 3600
+_DEFAULT_OPEN_QUERY_TTL_SEC = 300
+# ARM data is often processed and published some days after it was collected, so a range ending
+# this recently may still gain files
+_OPEN_RANGE_DAYS = 7
+
+# the session shared by all requests to the ADC
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+_POOL_MAXSIZE = _DEFAULT_POOL_MAXSIZE
+
+# (user hash, datastream, start, end) -> file names
+_QUERIES = TTLCache(maxsize=_DEFAULT_QUERY_CACHE_SIZE)
+_QUERY_TTLS = (_DEFAULT_CLOSED_QUERY_TTL_SEC, _DEFAULT_OPEN_QUERY_TTL_SEC)
+
+
+# from act.utils
+def date_parser(date_string, output_format='%Y%m%d', return_datetime=False):
+    """Converts one datetime string to another or to
+    a datetime object.
+
+    Parameters
+    ----------
+    date_string : str
+        datetime string to be parsed. Accepted formats are
+        YYYY-MM-DD, DD.MM.YYYY, DD/MM/YYYY or YYYYMMDD.
+    output_format : str
+        Format for datetime.strftime to output datetime string.
+    return_datetime : bool
+        If true, returns str as a datetime object.
+        Default is False.
+
+    returns
+    -------
+    datetime_str : str
+        A valid datetime string.
+    datetime_obj : datetime.datetime
+        A datetime object.
+
+    """
+    date_fmts = [
+        '%Y-%m-%d',
+        '%d.%m.%Y',
+        '%d/%m/%Y',
+        '%Y%m%d',
+        '%Y/%m/%d',
+        '%Y-%m-%dT%H:%M:%S',
+        '%d.%m.%YT%H:%M:%S',
+        '%d/%m/%YT%H:%M:%S',
+        '%Y%m%dT%%H:%M:%S',
+        '%Y/%m/%dT%H:%M:%S',
+    ]
+    for fmt in date_fmts:
+        try:
+            datetime_obj = dt.datetime.strptime(date_string, fmt)
+            if return_datetime:
+                return datetime_obj
+            else:
+                return datetime_obj.strftime(output_format)
+        except ValueError:
+            pass
+    fmt_strings = ', '.join(date_fmts)
+    raise ValueError('Invalid Date format, please use one of these formats ' + fmt_strings)
+
+
+def parse_filename(fname):
+    """
+    Returns the datastream and date of an ARM archive file name, for example
+    ('sgpmetE13.b1', '20170114') for sgpmetE13.b1.20170114.000000.cdf.
+    """
+    parts = fname.split('.')
+    if len(parts) < 4 or not (len(parts[2]) == 8 and parts[2].isdigit()):
+        raise ValueError(f'Unexpected ARM file name {fname}')
+    return '.'.join(parts[:2]), parts[2]
+
+
+def _query_range(date_start=None, date_end=None):
+    # the start and end datetimes of a query, either of which may be None
+    start_datetime, end_datetime = None, None
+    if date_start:
+        start_datetime = date_parser(date_start, return_datetime=True)
+        if date_end:
+            end_datetime = date_parser(date_end, return_datetime=True)
+            # If the start and end date are the same, and a day to the end date
+            if start_datetime == end_datetime:
+                end_datetime += timedelta(hours=23, minutes=59, seconds=59)
+    return start_datetime, end_datetime
+
+
+def _format_query_date(datetime_obj):
+    return datetime_obj.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def query_url(user, token, datastream, date_start=None, date_end=None):
+    """ Returns the ADC query URL listing the files of a datastream between two dates. """
+    start_datetime, end_datetime = _query_range(date_start, date_end)
+    # start and end strings for query_url are constructed
+    # if the arguments were provided
+    start = f'&start={_format_query_date(start_datetime)}' if start_datetime else ''
+    end = f'&end={_format_query_date(end_datetime)}' if end_datetime else ''
+    return (ADC_URL + 'query?user={0}&ds={1}{2}{3}&wt=json').format(':'.join([user, token]), datastream, start, end)
+
+
+def save_data_url(user, token, fname):
+    """ Returns the ADC URL downloading a file. """
+    return (ADC_URL + 'saveData?user={0}&file={1}').format(':'.join([user, token]), fname)
+
+
+def configure_session(pool_maxsize: int = _DEFAULT_POOL_MAXSIZE):
+    """
+    Set the size of the connection pool of the shared ADC session, replacing the session.
+    pool_maxsize - the number of connections to the ADC kept open for reuse.
+    """
+    global _POOL_MAXSIZE
+    with _SESSION_LOCK:
+        _POOL_MAXSIZE = pool_maxsize
+    close_session()
+
+
+def get_session() -> requests.Session:
+    """ Get the pooled session shared by all requests to the ADC, creating it if needed. """
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _SESSION = requests.Session()
+            # the session is shared between users, so never let cookies leak from one to another
+            _SESSION.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            _SESSION.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=_POOL_MAXSIZE))
+        return _SESSION
+
+
+def close_session():
+    """ Close the shared ADC session, a new one is created when next needed. """
+    global _SESSION
+    with _SESSION_LOCK:
+        session, _SESSION = _SESSION, None
+    if session:
+        session.close()
+
+
+def configure_query_cache(maxsize: int = _DEFAULT_QUERY_CACHE_SIZE,
+                          closed_ttl: float = _DEFAULT_CLOSED_QUERY_TTL_SEC,
+                          open_ttl: float = _DEFAULT_OPEN_QUERY_TTL_SEC):
+    """
+    Replace the query cache with an empty one with the given bounds.
+    maxsize - the maximum number of query results to keep.
+    closed_ttl - the time in seconds the results for a range that has ended are kept.
+    open_ttl - the time in seconds the results for a range that may still gain files are kept.
+    """
+    global _QUERIES, _QUERY_TTLS
+    _QUERIES = TTLCache(maxsize=maxsize)
+    _QUERY_TTLS = (closed_ttl, open_ttl)
+
+
+def query_cache_stats() -> dict:
+    """ Returns the query cache size and hit statistics. """
+    return _QUERIES.stats()
+
+
+def _query_ttl(start_datetime, end_datetime):
+    closed_ttl, open_ttl = _QUERY_TTLS
+    if end_datetime is None:
+        # open ended, files are still being added
+        return open_ttl
+    if end_datetime.date() >= dt.datetime.now(dt.timezone.utc).date() - timedelta(days=_OPEN_RANGE_DAYS):
+        return open_ttl
+    return closed_ttl
+
+
+def query_files(session, user, token, datastream, date_start=None, date_end=None):
+    """
+    Returns the names of the files of a datastream between two dates. Results are cached per
+    user, as the query also checks the user may read the datastream.
+    session - the requests session to query the ADC with.
+    """
+    start_datetime, end_datetime = _query_range(date_start, date_end)
+    user_hash = hashlib.sha256(':'.join([user, token]).encode('utf-8')).hexdigest()
+    key = (user_hash, datastream, start_datetime, end_datetime)
+    queries = _QUERIES
+    files = queries.get(key)
+    if files is not None:
+        return list(files)
+    response = session.get(query_url(user, token, datastream, date_start, date_end))
+    if response.status_code == 200:
+        response_body_json = response.json()
+        if 'files' in response_body_json:
+            files = response_body_json['files']
+            queries.set(key, tuple(files), ttl=_query_ttl(start_datetime, end_datetime))
+            return files
+        else:
+            raise ValueError(f"Could not fetch data from ARM: no files returned")
+    else:
+        raise ValueError(f"Could not fetch data from ARM: status {response.status_code}")
+
+
+def download_file(session, user, token, fname, out):
+    """
+    Download a file, writing it to the binary file object out in chunks.
+    session - the requests session to download the file with.
+    """
+    # ask for the raw bytes so the file is written exactly as stored in the archive
+    headers = {'Accept-Encoding': 'identity'}
+    with session.get(save_data_url(user, token, fname), headers=headers, stream=True) as response:
+        if response.status_code != 200:
+            raise ValueError(f"Could not fetch data from ARM: status {response.status_code}")
+        for chunk in response.iter_content(_DOWNLOAD_CHUNK_SIZE):
+            out.write(chunk)
+
+
+def directory_store(directory):
+    """
+    Returns a store function for download_files that writes the files to a directory.
+    """
+    def store(fname, download):
+        path = os.path.join(directory, os.path.basename(fname))
+        with open(path, 'wb') as out:
+            download(out)
+        return path
+    return store
+
+
+def download_files(session, user, token, fnames, store, max_workers=4):
+    """
+    Download files concurrently, yielding (file name, path) pairs in the order of fnames as each
+    file becomes available.
+    session - the requests session to download the files with.
+    store - called with a file name and a function writing the file to a binary file object,
+        returns the path the file was stored at. For example FileCache.fetch or directory_store.
+    max_workers - the maximum number of files downloaded at once.
+
+    Downloads not yet started are cancelled if the generator is closed early.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='arm_download') as executor:
+        futures = [executor.submit(store, fname, functools.partial(download_file, session, user, token, fname))
+                   for fname in fnames]
+        try:
+            for fname, future in zip(fnames, futures):
+                yield fname, future.result()
+        finally:
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,100 @@
+"""
+Micro-batching of concurrent calls made from handler threads, in the style of a DataLoader.
+"""
+
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable
+
+
+class _Batch:
+
+    def __init__(self):
+        self.items = []
+        self.futures = []
+        # set when the batch is full, so the leader needn't wait out the window
+        self.full = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Collects items submitted by concurrent threads into batches. The first item of a batch waits
+    up to the window for more items with the same key, then a single call loads the whole batch
+    and each submitter gets the result for its own item.
+    """
+
+    def __init__(self, window: float = 0.002, max_batch_size: int = 100):
+        """
+        Create the batcher.
+        window - how long the first item of a batch waits for more items in seconds. 0 disables
+            batching, each item is loaded on its own without waiting.
+        max_batch_size - the maximum number of items per batch. A full batch is loaded at once.
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self._window = window
+        self._max_batch_size = max_batch_size
+        self._lock = threading.Lock()
+        # key -> the batch still open to new items
+        self._open = {}
+        self._batches = 0
+        self._items = 0
+
+    def submit(self, key: Hashable, item: Any, load: Callable[[list], list]) -> Any:
+        """
+        Load an item as part of a batch, blocking until it is loaded, and return its result.
+        key - items are only batched with items of the same key.
+        load - called with the items of a batch, returns a result for each item in order. A
+            result that is an exception is raised for its submitter. The load function of the
+            first item of a batch is used for the whole batch.
+        """
+        if self._window <= 0:
+            return self._unwrap(load([item])[0])
+        future = Future()
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = _Batch()
+            batch.items.append(item)
+            batch.futures.append(future)
+            if len(batch.items) >= self._max_batch_size:
+                del self._open[key]
+                batch.full.set()
+        if leader:
+            batch.full.wait(self._window)
+            with self._lock:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+                self._batches += 1
+                self._items += len(batch.items)
+            self._load(batch, load)
+        return future.result()
+
+    @staticmethod
+    def _unwrap(result):
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    @staticmethod
+    def _load(batch, load):
+        try:
+            results = load(batch.items)
+            if len(results) != len(batch.items):
+                raise ValueError(f"Expected {len(batch.items)} results, got {len(results)}")
+        except BaseException as e:
+            # raised for every submitter, including the leader, so no one is left waiting
+            for future in batch.futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(batch.futures, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        """ Returns the number of batches loaded and the items they held. """
+        with self._lock:
+            return {"batches": self._batches, "items": self._items}
@@ -0,0 +1,421 @@
+"""
+Caches shared by the Dataverse service and its data handlers.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, BinaryIO, Callable, Hashable, Optional
+
+_CACHE_FILE_SUFFIX = '.cache'
+
+
+class TTLCache:
+    """
+    A thread safe, size bounded LRU cache. Entries optionally expire after a time to live.
+    """
+
+    def __init__(self, maxsize: int = 1000, ttl: Optional[float] = None):
+        """
+        Create the cache.
+        maxsize - the maximum number of entries. The least recently used entry is evicted when
+            the cache is full.
+        ttl - the default time to live of an entry in seconds, or None for no expiry.
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """ Get a value from the cache, or the default if it is absent or expired. """
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._cache.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._cache[key]
+            self._misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Add a value to the cache.
+        ttl - the time to live of the entry in seconds, overriding the cache default.
+        """
+        ttl = self._ttl if ttl is None else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._cache[key] = (value, expires)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._maxsize:
+                self._cache.popitem(last=False)
+                self._evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        """ Remove a value from the cache if present. """
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def clear(self) -> None:
+        """ Remove all values from the cache. """
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._cache)
+
+    def stats(self) -> dict:
+        """ Returns the cache size and hit statistics. """
+        with self._lock:
+            return {
+                "size": len(self._cache),
+                "maxsize": self._maxsize,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions
+            }
+
+
+class DiskCache:
+    """
+    A thread safe, size bounded LRU cache of byte strings stored as files in a directory.
+    Writes are atomic, so several processes may share the directory.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        """
+        Create the cache.
+        directory - the directory to store the cache files in. Created if it doesn't exist.
+        max_bytes - the maximum total size of the cache files. The least recently used files are
+            evicted when the cache is full.
+        """
+        if max_bytes < 1:
+            raise ValueError("max_bytes must be at least 1")
+        self._dir = directory
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(os.path.getsize(p) for p in self._cache_files())
+
+    def _cache_files(self):
+        return [e.path for e in os.scandir(self._dir)
+                if e.is_file() and e.name.endswith(_CACHE_FILE_SUFFIX)]
+
+    def path(self, key: str) -> str:
+        """ Returns the path of the cache file for a key, whether or not it exists. """
+        return os.path.join(
+            self._dir, hashlib.sha256(key.encode('utf-8')).hexdigest() + _CACHE_FILE_SUFFIX)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """ Get a value from the cache, or None if it is absent. """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            # the modification time records when the file was last used for LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return value
+
+    def set(self, key: str, value: bytes) -> None:
+        """ Add a value to the cache. """
+        if len(value) > self._max_bytes:
+            return
+        self._write(key, lambda f: f.write(value))
+
+    def _write(self, key: str, write: Callable[[BinaryIO], Any]) -> str:
+        # write to a temporary file then rename it, so readers never see a partial file
+        path = self.path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        with self._lock:
+            self._size += os.path.getsize(path)
+            if self._size > self._max_bytes:
+                self._evict(keep=path)
+        return path
+
+    def _evict(self, keep: str = None):
+        # other processes may share the directory, so rescan rather than trust the running total
+        files = []
+        for p in self._cache_files():
+            try:
+                st = os.stat(p)
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+        files.sort()
+        self._size = sum(f[1] for f in files)
+        # evict down to 90% of the limit so every write doesn't trigger a rescan
+        target = self._max_bytes * 0.9
+        for _, size, p in files:
+            if self._size <= target:
+                break
+            if p == keep:
+                continue
+            try:
+                os.unlink(p)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+
+class FileCache(DiskCache):
+    """
+    A DiskCache of immutable files, such as downloaded data files, that are read from their path
+    rather than loaded into memory. Concurrent requests for the same missing file share a single
+    download.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        super().__init__(directory, max_bytes)
+        # key -> lock held while the file is downloaded
+        self._downloads = {}
+
+    def get_file(self, key: str) -> Optional[str]:
+        """ Returns the path of a cached file, or None if it is absent. """
+        path = self.path(key)
+        try:
+            # the modification time records when the file was last used for LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def fetch(self, key: str, download: Callable[[BinaryIO], Any]) -> str:
+        """
+        Returns the path of a cached file, downloading it first if it is absent.
+        download - writes the file to the binary file object it is called with. If several threads
+            fetch the same missing file, download is only called once.
+        """
+        path = self.get_file(key)
+        if path:
+            return path
+        with self._lock:
+            download_lock = self._downloads.setdefault(key, threading.Lock())
+        with download_lock:
+            try:
+                # another thread may have downloaded the file while this one waited
+                return self.get_file(key) or self._write(key, download)
+            finally:
+                with self._lock:
+                    self._downloads.pop(key, None)
+
+    def open_file(self, key: str) -> Optional[BinaryIO]:
+        """
+        Opens a cached file for reading, or returns None if it is absent. The open file stays
+        readable if another process evicts it meanwhile.
+        """
+        path = self.get_file(key)
+        if path is None:
+            return None
+        try:
+            return open(path, 'rb')
+        except FileNotFoundError:
+            # evicted since it was found
+            return None
+
+    def fetch_open(self, key: str, download: Callable[[BinaryIO], Any]) -> BinaryIO:
+        """ Opens a cached file for reading, downloading it first if it is absent, see fetch. """
+        try:
+            return open(self.fetch(key, download), 'rb')
+        except FileNotFoundError:
+            # evicted by another process between the download and opening it
+            return open(self.fetch(key, download), 'rb')
+
+
+class SQLiteCache:
+    """
+    A thread safe, size bounded cache of JSON serialisable values in an SQLite database. Several
+    processes may share the database, for example the workers and containers of a deployment
+    with the file on a volume shared between them, so they also share their hits. The volume must
+    be local to the host, as SQLite locking is unreliable over network file systems. Entries
+    optionally expire after a time to live.
+
+    Keys are strings or other JSON serialisable values. Note that tuples come back as lists.
+    """
+
+    # how stale the last use of an entry may get before a read records it, so most reads don't
+    # write to the database
+    _TOUCH_INTERVAL_SEC = 60
+
+    def __init__(self, path: str, table: str = 'cache', maxsize: int = 10000, ttl: Optional[float] = None):
+        """
+        Create the cache.
+        path - the database file, created if it doesn't exist.
+        table - the table holding the cache, so one database may hold several caches.
+        maxsize - the maximum number of entries. Expired and then the least recently used entries
+            are evicted when the cache is full.
+        ttl - the default time to live of an entry in seconds, or None for no expiry.
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        if not table.isidentifier():
+            raise ValueError(f"Invalid table name {table}")
+        self._path = path
+        self._table = table
+        self._maxsize = maxsize
+        self._ttl = ttl
+        # sqlite connections can't be shared between threads
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+        # counting the entries takes a table scan, so the size is only checked every so often
+        self._evict_check = max(1, maxsize // 100)
+        with self._connect() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                         "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL, used REAL NOT NULL)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_used ON {table} (used)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            # readers don't block the writer, and vice versa
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _key(key: Any) -> str:
+        return key if isinstance(key, str) else json.dumps(key)
+
+    def get_entry(self, key: Any) -> Optional[tuple]:
+        """
+        Returns the (value, expiry time in seconds since the epoch or None) of an entry, or None
+        if it is absent or expired.
+        """
+        key, now = self._key(key), time.time()
+        conn = self._connect()
+        row = conn.execute(f"SELECT value, expires, used FROM {self._table} WHERE key = ?", (key,)).fetchone()
+        if row is not None and (row[1] is None or row[1] > now):
+            if row[2] < now - self._TOUCH_INTERVAL_SEC:
+                conn.execute(f"UPDATE {self._table} SET used = ? WHERE key = ?", (now, key))
+            with self._lock:
+                self._hits += 1
+            return json.loads(row[0]), row[1]
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        """ Get a value from the cache, or the default if it is absent or expired. """
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Add a value to the cache.
+        ttl - the time to live of the entry in seconds, overriding the cache default.
+        """
+        ttl = self._ttl if ttl is None else ttl
+        now = time.time()
+        conn = self._connect()
+        conn.execute(f"INSERT OR REPLACE INTO {self._table} (key, value, expires, used) VALUES (?, ?, ?, ?)",
+                     (self._key(key), json.dumps(value), None if ttl is None else now + ttl, now))
+        with self._lock:
+            self._writes += 1
+            check = self._writes % self._evict_check == 0
+        if check and len(self) > self._maxsize:
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        # evict down to 90% of the limit so every write doesn't trigger an eviction
+        with conn:
+            conn.execute(f"DELETE FROM {self._table} WHERE expires <= ?", (now,))
+            conn.execute(f"DELETE FROM {self._table} WHERE key IN "
+                         f"(SELECT key FROM {self._table} ORDER BY used LIMIT max(0, "
+                         f"(SELECT COUNT(*) FROM {self._table}) - ?))", (int(self._maxsize * 0.9),))
+
+    def delete(self, key: Any) -> None:
+        """ Remove a value from the cache if present. """
+        self._connect().execute(f"DELETE FROM {self._table} WHERE key = ?", (self._key(key),))
+
+    def clear(self) -> None:
+        """ Remove all values from the cache. """
+        self._connect().execute(f"DELETE FROM {self._table}")
+
+    def __len__(self) -> int:
+        return self._connect().execute(f"SELECT COUNT(*) FROM {self._table}").fetchone()[0]
+
+    def stats(self) -> dict:
+        """ Returns the cache size and this process's hit statistics. """
+        size = len(self)
+        with self._lock:
+            return {
+                "size": size,
+                "maxsize": self._maxsize,
+                "hits": self._hits,
+                "misses": self._misses
+            }
+
+
+class TieredCache:
+    """
+    A TTLCache in front of a cache shared with other processes, such as an SQLiteCache. Values
+    are written to both, and values found in the shared cache are kept locally until they expire.
+    """
+
+    def __init__(self, local: TTLCache, shared: SQLiteCache):
+        self._local = local
+        self._shared = shared
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """ Get a value from the cache, or the default if it is absent or expired. """
+        value = self._local.get(key)
+        if value is not None:
+            return value
+        entry = self._shared.get_entry(key)
+        if entry is None:
+            return default
+        value, expires = entry
+        self._local.set(key, value, ttl=None if expires is None else max(expires - time.time(), 0))
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Add a value to the cache.
+        ttl - the time to live of the entry in seconds, overriding the caches' defaults.
+        """
+        self._local.set(key, value, ttl)
+        self._shared.set(key, value, ttl)
+
+    def delete(self, key: Hashable) -> None:
+        """ Remove a value from the cache if present. """
+        self._local.delete(key)
+        self._shared.delete(key)
+
+    def clear(self) -> None:
+        """ Remove all values from this process's cache. The shared cache is left as is. """
+        self._local.clear()
+
+    def __len__(self) -> int:
+        return len(self._local)
+
+    def stats(self) -> dict:
+        """ Returns the local and shared cache statistics. """
+        return {"local": self._local.stats(), "shared": self._shared.stats()}
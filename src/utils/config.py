@@ -20,7 +20,105 @@ class DataverseServiceConfig:
         service path, the path to the service. The path is required in order for the OpenAPI
         documentation to function.
 
+    handler_thread_pool_size: int - the number of threads running synchronous data handler
+        calls.
+
     kbase_workspace_url: str - the URL of the KBase Workspace service.
+
+    kbase_auth_url: str - the token endpoint of the KBase Auth service, by default the one in the
+        same deployment as the Workspace.
+
+    kbase_auth_timeout_sec: int - how long to wait for the KBase Auth service in seconds.
+
+    kbase_token_cache_size: int - the maximum number of KBase tokens cached.
+
+    kbase_invalid_token_ttl_sec: int - how long a KBase token the Auth service rejected is cached
+        in seconds.
+
+    shared_cache_path: str | None - an SQLite database file shared by the service workers to
+        cache validated tokens and access checks in, or None to cache them per worker only.
+
+    shared_cache_size: int - the maximum number of entries of each cache in the shared database.
+
+    kbase_pool_connections: int - the number of host connection pools cached by the KBase
+        service clients.
+
+    kbase_pool_maxsize: int - the maximum number of keep-alive connections per host for the
+        KBase service clients.
+
+    kbase_max_retries: int - the number of times the KBase service clients retry establishing
+        a connection.
+
+    kbase_keep_alive: bool - whether the KBase service clients keep connections alive between
+        calls.
+
+    kbase_client_cache_size: int - the maximum number of Workspace clients kept for reuse.
+
+    kbase_client_cache_ttl_sec: int - how long a Workspace client is kept for reuse in seconds.
+
+    kbase_version_refresh_sec: int - the interval between Workspace version probes in seconds.
+
+    kbase_max_concurrency: int - the maximum number of KBase data handler calls running at once.
+
+    arm_max_concurrency: int - the maximum number of ARM data handler calls running at once.
+
+    kbase_batch_chunk_size: int - the maximum number of objects per Workspace call when
+        fetching objects in batches.
+
+    kbase_save_concurrency: int - the maximum number of Workspace save calls running at once for
+        one batch save.
+
+    kbase_read_batch_window_ms: int - how long a single object Workspace fetch waits for
+        concurrent fetches with the same token to batch with in milliseconds, 0 to disable
+        batching.
+
+    kbase_read_batch_max_size: int - the maximum number of single object fetches batched into
+        one Workspace call.
+
+    kbase_object_cache_size: int - the maximum number of exact object versions cached in memory.
+
+    kbase_object_cache_dir: str | None - a directory to cache exact object versions in, or None
+        to only cache them in memory.
+
+    kbase_object_cache_max_mb: int - the maximum size of the on disk object cache in megabytes.
+
+    arm_file_cache_dir: str | None - a directory to cache downloaded ARM files in, or None to
+        download them for every request.
+
+    arm_file_cache_max_mb: int - the maximum size of the ARM file cache in megabytes.
+
+    arm_download_parallelism: int - the maximum number of ARM files downloaded at once for a
+        multi-file request.
+
+    arm_max_rows: int - the maximum number of rows of ARM data read into one response.
+
+    arm_query_cache_size: int - the maximum number of ARM datastream file listings cached.
+
+    arm_query_closed_ttl_sec: int - how long the file listing of a date range that has ended is
+        cached in seconds.
+
+    arm_query_open_ttl_sec: int - how long the file listing of a date range that may still gain
+        files is cached in seconds.
+
+    esgf_index_url: str | None - the search endpoint of the ESGF index node, or None to use the
+        LLNL node.
+
+    esgf_max_concurrency: int - the maximum number of ESGF data handler calls running at once.
+
+    esgf_search_concurrency: int - the maximum number of ESGF search result pages fetched at once
+        for one request.
+
+    esgf_search_cache_size: int - the maximum number of ESGF search results and facet counts
+        cached in memory.
+
+    esgf_search_cache_ttl_sec: int - how long ESGF search results and facet counts are cached in
+        seconds.
+
+    esgf_search_cache_dir: str | None - a directory to also cache ESGF search results in, or None
+        to cache them in memory only.
+
+    esgf_search_cache_max_mb: int - the maximum size of the on disk ESGF search cache in
+        megabytes.
     """
 
     def __init__(self, config_file: BinaryIO, service_root_path=None, kbase_workspace_url=None):
@@ -37,9 +135,87 @@ class DataverseServiceConfig:
             self.service_root_path = _get_string_optional(config, _SEC_SERVICE, "root_path")
             self.kbase_workspace_url = _get_string_required(config, _SEC_SERVICE_DEPS, "kbase_workspace_url")
         else:
+            config = {_SEC_SERVICE: {}, _SEC_SERVICE_DEPS: {}}
             self.service_root_path = service_root_path
             self.kbase_workspace_url = kbase_workspace_url
 
+        self.kbase_auth_url = (_get_string_optional(config, _SEC_SERVICE_DEPS, "kbase_auth_url")
+                               or _default_auth_url(self.kbase_workspace_url))
+
+        # tuning options, all of which fall back to their defaults if absent
+        self.handler_thread_pool_size = _get_int_optional(
+            config, _SEC_SERVICE, "handler_thread_pool_size", 32)
+        self.kbase_pool_connections = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "kbase_pool_connections", 10)
+        self.kbase_pool_maxsize = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "kbase_pool_maxsize", 10)
+        self.kbase_max_retries = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "kbase_max_retries", 3, minimum=0)
+        self.kbase_keep_alive = _get_bool_optional(
+            config, _SEC_SERVICE_DEPS, "kbase_keep_alive", True)
+        self.kbase_auth_timeout_sec = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "kbase_auth_timeout_sec", 10)
+        self.kbase_token_cache_size = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "kbase_token_cache_size", 2000)
+        self.kbase_invalid_token_ttl_sec = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "kbase_invalid_token_ttl_sec", 60)
+        self.shared_cache_path = _get_string_optional(
+            config, _SEC_SERVICE, "shared_cache_path")
+        self.shared_cache_size = _get_int_optional(
+            config, _SEC_SERVICE, "shared_cache_size", 100000)
+        self.kbase_client_cache_size = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "kbase_client_cache_size", 1000)
+        self.kbase_client_cache_ttl_sec = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "kbase_client_cache_ttl_sec", 300)
+        self.kbase_version_refresh_sec = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "kbase_version_refresh_sec", 600)
+        self.kbase_max_concurrency = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "kbase_max_concurrency", 24)
+        self.arm_max_concurrency = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "arm_max_concurrency", 8)
+        self.kbase_batch_chunk_size = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "kbase_batch_chunk_size", 100)
+        self.kbase_save_concurrency = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "kbase_save_concurrency", 4)
+        self.kbase_read_batch_window_ms = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "kbase_read_batch_window_ms", 2, minimum=0)
+        self.kbase_read_batch_max_size = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "kbase_read_batch_max_size", 100)
+        self.kbase_object_cache_size = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "kbase_object_cache_size", 256)
+        self.kbase_object_cache_dir = _get_string_optional(
+            config, _SEC_SERVICE_DEPS, "kbase_object_cache_dir")
+        self.kbase_object_cache_max_mb = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "kbase_object_cache_max_mb", 1024)
+        self.arm_file_cache_dir = _get_string_optional(
+            config, _SEC_SERVICE_DEPS, "arm_file_cache_dir")
+        self.arm_file_cache_max_mb = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "arm_file_cache_max_mb", 10240)
+        self.arm_download_parallelism = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "arm_download_parallelism", 4)
+        self.arm_max_rows = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "arm_max_rows", 1000000)
+        self.arm_query_cache_size = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "arm_query_cache_size", 1000)
+        self.arm_query_closed_ttl_sec = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "arm_query_closed_ttl_sec", 86400)
+        self.arm_query_open_ttl_sec = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "arm_query_open_ttl_sec", 300)
+        self.esgf_index_url = _get_string_optional(
+            config, _SEC_SERVICE_DEPS, "esgf_index_url")
+        self.esgf_max_concurrency = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "esgf_max_concurrency", 8)
+        self.esgf_search_concurrency = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "esgf_search_concurrency", 4)
+        self.esgf_search_cache_size = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "esgf_search_cache_size", 1000)
+        self.esgf_search_cache_ttl_sec = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "esgf_search_cache_ttl_sec", 3600)
+        self.esgf_search_cache_dir = _get_string_optional(
+            config, _SEC_SERVICE_DEPS, "esgf_search_cache_dir")
+        self.esgf_search_cache_max_mb = _get_int_optional(
+            config, _SEC_SERVICE_DEPS, "esgf_search_cache_max_mb", 256)
+
     def print_config(self, output: TextIO):
         """
         Print the configuration to the output argument, censoring secrets.
@@ -47,7 +223,12 @@ class DataverseServiceConfig:
         output.writelines([
             "\n*** Service Configuration ***\n",
             f"Service root path: {self.service_root_path}\n",
+            f"Handler thread pool size: {self.handler_thread_pool_size}\n",
             f"Workspace URL: {self.kbase_workspace_url}\n",
+            f"Auth URL: {self.kbase_auth_url}\n",
+            f"KBase connection pool: {self.kbase_pool_connections} pools, "
+            + f"{self.kbase_pool_maxsize} connections per pool, "
+            + f"{self.kbase_max_retries} retries, keep alive {self.kbase_keep_alive}\n",
             "*** End Service Configuration ***\n\n"
         ])
 
@@ -78,9 +259,39 @@ def _get_string_optional(config, section, key) -> Optional[str]:
     return putative.strip()
 
 
+# assumes section exists
+def _get_int_optional(config, section, key, default: int, minimum: int = 1) -> int:
+    putative = config[section].get(key)
+    if putative is None:
+        return default
+    if type(putative) != int:
+        raise ValueError(
+            f"Expected integer value for key {key} in section {section}, got {putative}")
+    if putative < minimum:
+        raise ValueError(
+            f"Value for key {key} in section {section} must be at least {minimum}, got {putative}")
+    return putative
+
+
+# assumes section exists
+def _get_bool_optional(config, section, key, default: bool) -> bool:
+    putative = config[section].get(key)
+    if putative is None:
+        return default
+    if type(putative) != bool:
+        raise ValueError(
+            f"Expected boolean value for key {key} in section {section}, got {putative}")
+    return putative
+
+
 # assumes section exists
 def _get_list_string(config, section, key) -> list:
     putative = _get_string_optional(config, section, key)
     if not putative:
         return []
     return [x.strip() for x in putative.split(",")]
+
+
+def _default_auth_url(workspace_url: str) -> str:
+    # e.g. https://ci.kbase.us/services/ws -> https://ci.kbase.us/services/auth/api/V2/token
+    return workspace_url.rstrip('/').rsplit('/', 1)[0] + '/auth/api/V2/token'
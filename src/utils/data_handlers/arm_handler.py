@@ -1,23 +1,20 @@
 import tempfile
 from pathlib import Path
 
-import act
-import pandas as pd
-import xarray as xr
+from starlette.concurrency import run_in_threadpool
 
+from src.utils.arm_helpers.arm_helper import directory_store, download_files, get_session, query_files
 from src.utils.data_handlers.data_handler import DataHandler
+from src.utils.netcdf_reader import read_frame
 
 
 class ARMHandler(DataHandler):
 
-    @staticmethod
-    def _process_cdf_file(file_path):
+    def _process_cdf_file(self, file_path, variables=None, time_start=None, time_end=None, resample_minutes=None,
+                          aggregate='mean'):
         # read in a netCDF file and convert it to a pandas DataFrame
-
-        with xr.open_dataset(file_path) as ds:
-            df = ds.to_dataframe()
-
-        return df
+        return read_frame(file_path, variables, time_start, time_end,
+                          resample_minutes=resample_minutes, aggregate=aggregate, max_rows=self._max_rows)
 
     async def query(self):
         """
@@ -31,34 +28,83 @@ class ARMHandler(DataHandler):
         """
         pass
 
-    async def _fetch_obj_from_arm(self, datastream, date):
+    def _download_files(self, datastream, date_start, date_end, directory):
+        # the query also checks the user's credentials, so cached files are only served to users
+        # the ADC would serve them to
+        session = get_session()
+        fnames = query_files(session, self.arm_username, self.arm_auth_token, datastream, date_start, date_end)
+        store = self._file_cache.fetch if self._file_cache else directory_store(directory)
+        return [path for _, path in download_files(
+            session, self.arm_username, self.arm_auth_token, fnames, store,
+            max_workers=self._download_parallelism)]
+
+    def _read_frame_from_arm(self, datastream, date, variables=None, time_start=None, time_end=None,
+                             date_end=None, resample_minutes=None, aggregate='mean'):
         with tempfile.TemporaryDirectory() as tmp_dir:
-            try:
-                # https://arm-doe.github.io/ACT/API/generated/act.discovery.download_data.html
-                files = act.discovery.download_data(self.arm_username, self.arm_auth_token, datastream, date, date,
-                                                    output=tmp_dir)
-            except Exception as e:
-                raise ValueError(f"Could not fetch data from ARM: {str(e)}") from e
-
-            # Process each netCDF file in the directory and concatenate the resulting DataFrames
-            df_list = [self._process_cdf_file(file_path) for file_path in files]
-
-        combined_df = pd.concat(df_list)
+            for attempt in range(2):
+                try:
+                    # downloads the files concurrently, rather than one by one as act.discovery.download_data does
+                    files = self._download_files(datastream, date, date_end or date, tmp_dir)
+                except Exception as e:
+                    raise ValueError(f"Could not fetch data from ARM: {str(e)}") from e
+
+                try:
+                    # Read the netCDF files together, loading only the requested variables and time window
+                    return self._process_cdf_file(files, variables, time_start, time_end, resample_minutes, aggregate)
+                except FileNotFoundError:
+                    # another process evicted a cached file before it was read, fetch it again
+                    if attempt or not self._file_cache:
+                        raise
+
+    def _read_obj_from_arm(self, datastream, date, date_end=None, **subset):
+        combined_df = self._read_frame_from_arm(datastream, date, date_end=date_end, **subset)
         data = combined_df.astype(str).to_dict(orient='records')
 
         return data
 
+    # the downloads and reads block, so they run on the thread pool to keep the event loop free
+    async def _fetch_frame_from_arm(self, datastream, date, date_end=None, **subset):
+        return await run_in_threadpool(self._read_frame_from_arm, datastream, date, date_end=date_end, **subset)
+
+    async def _fetch_obj_from_arm(self, datastream, date, date_end=None, **subset):
+        return await run_in_threadpool(self._read_obj_from_arm, datastream, date, date_end=date_end, **subset)
+
     async def _save_obj_to_ws(self, wsid, obj_data, provenance=None):
         pass
 
-    def __init__(self, arm_username, arm_auth_token):
+    def __init__(self, arm_username, arm_auth_token, file_cache=None, download_parallelism=4, max_rows=None):
+        """
+        file_cache - a FileCache shared between requests to keep downloaded files in, or None to
+            download the files for every request.
+        download_parallelism - the maximum number of files downloaded at once.
+        max_rows - the maximum number of rows read into one response, or None for no limit.
+        """
         super().__init__('ARM')
         self.arm_username, self.arm_auth_token = arm_username, arm_auth_token
+        self._file_cache = file_cache
+        self._download_parallelism = download_parallelism
+        self._max_rows = max_rows
 
-    async def fetch_data(self, datastream, date):
-        arm_data = await self._fetch_obj_from_arm(datastream, date)
+    async def fetch_data(self, datastream, date, date_end=None, **subset):
+        """
+        Fetch the data as a list of records with string values.
+        date_end - the last date to fetch, the files for the range are merged.
+        subset - optional arguments selecting part of the data before it is loaded:
+            variables - the names of the variables to return.
+            time_start, time_end - the time window to return, as ISO 8601 date times.
+            resample_minutes - resample the data to one record per this many minutes.
+            aggregate - how resampled values are aggregated, one of mean, min or max.
+        """
+        arm_data = await self._fetch_obj_from_arm(datastream, date, date_end, **subset)
 
         return arm_data
 
+    async def fetch_frame(self, datastream, date, date_end=None, **subset):
+        """
+        Fetch the data as a pandas DataFrame, keeping the native data types. See
+        src.utils.data_formats for encoding it, and fetch_data for the arguments.
+        """
+        return await self._fetch_frame_from_arm(datastream, date, date_end=date_end, **subset)
+
     async def save_data(self, file_path):
         pass
@@ -1,112 +1,81 @@
-import requests
-
-from src.utils.data_handlers.data_handler import DataHandler
-from urllib.request import urlopen
-
-import datetime as dt
-
-
-# from act.utils
-def date_parser(date_string, output_format='%Y%m%d', return_datetime=False):
-    """Converts one datetime string to another or to
-    a datetime object.
-
-    Parameters
-    ----------
-    date_string : str
-        datetime string to be parsed. Accepted formats are
-        YYYY-MM-DD, DD.MM.YYYY, DD/MM/YYYY or YYYYMMDD.
-    output_format : str
-        Format for datetime.strftime to output datetime string.
-    return_datetime : bool
-        If true, returns str as a datetime object.
-        Default is False.
-
-    returns
-    -------
-    datetime_str : str
-        A valid datetime string.
-    datetime_obj : datetime.datetime
-        A datetime object.
-
-    """
-    date_fmts = [
-        '%Y-%m-%d',
-        '%d.%m.%Y',
-        '%d/%m/%Y',
-        '%Y%m%d',
-        '%Y/%m/%d',
-        '%Y-%m-%dT%H:%M:%S',
-        '%d.%m.%YT%H:%M:%S',
-        '%d/%m/%YT%H:%M:%S',
-        '%Y%m%dT%%H:%M:%S',
-        '%Y/%m/%dT%H:%M:%S',
-    ]
-    for fmt in date_fmts:
-        try:
-            datetime_obj = dt.datetime.strptime(date_string, fmt)
-            if return_datetime:
-                return datetime_obj
-            else:
-                return datetime_obj.strftime(output_format)
-        except ValueError:
-            pass
-    fmt_strings = ', '.join(date_fmts)
-    raise ValueError('Invalid Date format, please use one of these formats ' + fmt_strings)
+import contextlib
+import tempfile
+
+from src.utils.arm_helpers.arm_helper import (
+    directory_store,
+    download_file,
+    download_files,
+    get_session,
+    parse_filename,
+    query_files,
+    save_data_url
+)
+from src.utils.data_handlers.data_handler import DataHandler, FileStream
+from src.utils.netcdf_reader import read_frame
+from src.utils.tar_stream import MEDIA_TYPE_TAR, iter_tar
+
+_STREAM_CHUNK_SIZE = 1024 * 1024
+# the upstream response headers passed on to clients when streaming a file
+_STREAM_HEADERS = ['Content-Length', 'Content-Range', 'Content-Type', 'Accept-Ranges', 'Last-Modified', 'ETag']
 
 
 class ARMHandler2(DataHandler):
 
-    @staticmethod
-    def _process_cdf_file(file_path):
+    def _process_cdf_file(self, file_path):
         # read in a netCDF file and convert it to a pandas DataFrame
 
-        with xr.open_dataset(file_path) as ds:
-            df = ds.to_dataframe()
-
-        return df
-
-    def _fetch_file(self, fname):
-        save_data_url = (
-                'https://adc.arm.gov/armlive/livedata/' + 'saveData?user={0}&file={1}'
-        ).format(':'.join([self.auth_user, self.auth_token]), fname)
-        data = urlopen(save_data_url).read()
+        return read_frame(file_path, max_rows=self._max_rows)
+
+    def _check_file_access(self, user, token, fname):
+        # cached files are shared by all users, so make sure the ADC would serve this user the file
+        datastream, date = parse_filename(fname)
+        if fname not in query_files(self._session, user, token, datastream, date, date):
+            raise ValueError(f"Could not fetch data from ARM: {fname} is not available")
+
+    def _read_file(self, user, token, fname):
+        if not self._file_cache:
+            response = self._session.get(save_data_url(user, token, fname))
+            if response.status_code != 200:
+                raise ValueError(f"Could not fetch data from ARM: status {response.status_code}")
+            return response.content
+        # the file is opened before the access check, so it can't be evicted while that runs
+        f = self._file_cache.open_file(fname)
+        if f:
+            with f:
+                self._check_file_access(user, token, fname)
+                return f.read()
+        with self._file_cache.fetch_open(
+                fname, lambda out: download_file(self._session, user, token, fname, out)) as f:
+            return f.read()
+
+    def _fetch_file(self, user, token, fname):
+        data = self._read_file(user, token, fname)
         return [{'id': fname, 'type': 'data', 'data': data.hex(), 'd': 'cdf hex string'}]
 
-    def _fetch_datastream(self, datastream, date_start=None, date_end=None):
-        from datetime import timedelta
-        # default start and end are empty
-        start, end = '', ''
-        # start and end strings for query_url are constructed
-        # if the arguments were provided
-        if date_start:
-            start_datetime = date_parser(date_start, return_datetime=True)
-            start = start_datetime.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
-            start = f'&start={start}'
-            if date_end:
-                end_datetime = date_parser(date_end, return_datetime=True)
-                # If the start and end date are the same, and a day to the end date
-                if start_datetime == end_datetime:
-                    end_datetime += timedelta(hours=23, minutes=59, seconds=59)
-                end = end_datetime.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
-                end = f'&end={end}'
-        # print(datastream, start, end)
-        print(start, end)
-        query_url = (
-                'https://adc.arm.gov/armlive/livedata/query?' + 'user={0}&ds={1}{2}{3}&wt=json'
-        ).format(':'.join([self.auth_user, self.auth_token]), datastream, start, end)
-        # print(query_url)
-        response = requests.get(query_url)
-        if response.status_code == 200:
-            response_body_json = response.json()
-            if 'files' in response_body_json:
-                print(len(response_body_json['files']))
-                return [{'id': s, 'd': s, 'owner': 'nan', 't': 'nan', 'type': 'file'} for s in
-                        response_body_json['files']]
+    def _fetch_datastream(self, user, token, datastream, date_start=None, date_end=None):
+        files = query_files(self._session, user, token, datastream, date_start, date_end)
+        return [{'id': s, 'd': s, 'owner': 'nan', 't': 'nan', 'type': 'file'} for s in files]
+
+    def _iter_archive(self, user, token, fnames):
+        with contextlib.ExitStack() as stack:
+            if self._file_cache:
+                store = self._file_cache.fetch
             else:
-                raise ValueError(f"Could not fetch data from ARM: no files returned")
-        else:
-            raise ValueError(f"Could not fetch data from ARM: status {response.status_code}")
+                store = directory_store(stack.enter_context(tempfile.TemporaryDirectory()))
+            # files are added to the archive in order as their downloads complete
+            yield from iter_tar(download_files(
+                self._session, user, token, fnames, store, max_workers=self._download_parallelism))
+
+    def _open_archive(self, user, token, datastream, date_start=None, date_end=None):
+        if not datastream:
+            raise ValueError('Please provide the datastream to download')
+        fnames = query_files(self._session, user, token, datastream, date_start, date_end)
+        chunks = self._iter_archive(user, token, fnames)
+        headers = {
+            'Content-Type': MEDIA_TYPE_TAR,
+            'Content-Disposition': f'attachment; filename="{datastream}.tar"'
+        }
+        return FileStream(chunks, 200, headers, chunks.close)
 
     async def _fetch_obj_from_arm(self, datastream, date):
         with tempfile.TemporaryDirectory() as tmp_dir:
@@ -129,17 +98,57 @@ class ARMHandler2(DataHandler):
         pass
 
     def __init__(self, **kwargs):
+        """
+        file_cache - a FileCache to keep downloaded files in, or None to download them every time.
+        download_parallelism - the maximum number of files downloaded at once for one request.
+        max_rows - the maximum number of rows read from a file into one response, or None for no
+            limit.
+        """
         super().__init__('ARM')
-        self.auth_token = kwargs.get('token', None)
-        self.auth_user = kwargs.get('user', None)
-        # self.arm_username, self.arm_auth_token = arm_username, arm_auth_token
+        self._file_cache = kwargs.get('file_cache', None)
+        self._download_parallelism = kwargs.get('download_parallelism', 4)
+        self._max_rows = kwargs.get('max_rows', None)
+        # the pooled session shared by all requests to the ADC, see arm_helper.configure_session
+        self._session = get_session()
 
     def fetch_data(self, **kwargs):
+        user = kwargs.get('user', None)
+        token = kwargs.get('token', None)
         datastream = kwargs.get('path', None)
         date_start = kwargs.get('date_start', None)
         date_end = kwargs.get('date_end', None)
         file = kwargs.get('object_id', None)
         if file is None:
-            return self._fetch_datastream(datastream, date_start, date_end)
+            return self._fetch_datastream(user, token, datastream, date_start, date_end)
         else:
-            return self._fetch_file(file)
+            return self._fetch_file(user, token, file)
+
+    def open_file(self, **kwargs):
+        """
+        Open an ARM file for streaming rather than reading it into memory. An HTTP Range header
+        value may be given as range, it is passed on to the ADC so clients can fetch part of a file
+        or resume a download.
+
+        Without an object_id, all the files of the datastream between date_start and date_end are
+        downloaded concurrently and streamed as a single tar archive.
+        """
+        user = kwargs.get('user', None)
+        token = kwargs.get('token', None)
+        fname = kwargs.get('object_id', None)
+        if not (user and token):
+            raise ValueError('Please provide ARM Auth Token and Username')
+        if fname is None:
+            return self._open_archive(
+                user, token, kwargs.get('path', None), kwargs.get('date_start', None), kwargs.get('date_end', None))
+        # ask for the raw bytes so Content-Length and Content-Range stay valid for the client
+        headers = {'Accept-Encoding': 'identity'}
+        if kwargs.get('range'):
+            headers['Range'] = kwargs['range']
+        response = self._session.get(save_data_url(user, token, fname), headers=headers, stream=True)
+        if response.status_code not in (200, 206, 416):
+            response.close()
+            raise ValueError(f"Could not fetch data from ARM: status {response.status_code}")
+        headers = {h: response.headers[h] for h in _STREAM_HEADERS if h in response.headers}
+        headers.setdefault('Content-Type', 'application/octet-stream')
+        headers['Content-Disposition'] = f'attachment; filename="{fname}"'
+        return FileStream(response.iter_content(_STREAM_CHUNK_SIZE), response.status_code, headers, response.close)
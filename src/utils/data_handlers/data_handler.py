@@ -1,4 +1,49 @@
+class FileStream:
+    """
+    A file opened upstream for streaming. chunks yields the body of the file as bytes, headers
+    holds the HTTP headers worth passing on to the client, for example Content-Length and
+    Content-Range, and status_code is 206 for a partial (Range) response.
+    """
+
+    def __init__(self, chunks, status_code=200, headers=None, close=None):
+        self.chunks = chunks
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._close = close
+
+    def close(self):
+        """ Release the upstream connection. """
+        if self._close:
+            self._close()
+
+
 class DataHandler:
 
     def __init__(self, provider):
         self.provider = provider
+
+    async def startup(self):
+        """
+        Called once when the service starts, before any requests are handled.
+        """
+        pass
+
+    async def shutdown(self):
+        """
+        Called once when the service shuts down to release any resources held by the handler.
+        """
+        pass
+
+    def is_immutable(self, **kwargs):
+        """
+        Returns True if the data fetched with the given arguments can never change, which allows
+        clients and proxies to cache it indefinitely.
+        """
+        return False
+
+    def iter_data(self, **kwargs):
+        """
+        Yields the rows of fetch_data one at a time. Handlers override this to stream rows as they
+        arrive from upstream, rather than assembling the whole result first.
+        """
+        yield from self.fetch_data(**kwargs)
@@ -1,50 +1,166 @@
-import pandas as pd
-import xarray as xr
+import asyncio
+import itertools
+
+import aiohttp
 
 from src.utils.data_handlers.data_handler import DataHandler
-from src.utils.esgf_helpers.esgf_helper import esgf_search
+from src.utils.esgf_helpers.esgf_helper import DEFAULT_SERVER, esgf_facets, esgf_search_cached, file_url
+from src.utils.netcdf_reader import DEFAULT_TIME_CHUNK, iter_frames, open_datasets
+
+# search parameters set by the handler, which can't be overridden with facets
+_RESERVED_PARAMS = {'project', 'type', 'distrib', 'fields', 'format', 'offset', 'limit', 'facets'}
+# the record fields needed to list files and to open them
+_LIST_FIELDS = ['id', 'title', 'dataset_id', 'data_node', 'version', 'size', 'url']
+_OPEN_FIELDS = ['id', 'variable_id', 'url']
+# the most items returned by a listing without a limit
+_MAX_LIST = 10000
+# the most files opened for one dataset, a CMIP6 dataset is usually a few dozen files at most
+_MAX_FILES = 1000
+# the most rows of a dataset read into one response, larger reads must be streamed as NDJSON
+_MAX_ROWS = 100000
 
 
 class ESGFHandler(DataHandler):
 
-    @staticmethod
-    def _process_cdf_file(file_path):
-        # read in a netCDF file and convert it to a pandas DataFrame
-
-        with xr.open_dataset(file_path) as ds:
-            df = ds.to_dataframe()
-
-        return df
-
-    async def _fetch_obj_from_esgf(self, datastream, date):
-        try:
-            # https://projectpythia.org/cmip6-cookbook/notebooks/foundations/esgf-opendap.html
-            files = esgf_search(activity_id='CMIP', table_id='Amon', variable_id='tas', experiment_id='historical',
-                                institution_id="NCAR", source_id="CESM2", member_id="r10i1p1f1")
-
-        except Exception as e:
-            raise ValueError(f"Could not fetch data from ARM: {str(e)}") from e
-
-        # with xr.open_mfdataset(files, combine='by_coords') as ds:
-        #     df = ds.to_dataframe()
-
-        df_list = [self._process_cdf_file(file_path) for file_path in files]
-        combined_df = pd.concat(df_list)
-
-        data = combined_df.astype(str).to_dict(orient='records')
-
-        return data
-
-    async def _save_obj_to_ws(self, wsid, obj_data, provenance=None):
-        pass
-
-    def __init__(self):
+    def __init__(self, **kwargs):
+        """
+        index_url - the search endpoint of the ESGF index node, or None to use the LLNL node.
+        search_concurrency - the maximum number of search result pages fetched at once for one
+            request.
+        time_chunk - the number of time steps read from the data nodes at a time when streaming.
+        """
         super().__init__('ESGF')
+        self._index_url = kwargs.get('index_url', None) or DEFAULT_SERVER
+        self._search_concurrency = kwargs.get('search_concurrency', 4)
+        self._time_chunk = kwargs.get('time_chunk', DEFAULT_TIME_CHUNK)
+        self._loop = None
+
+    async def startup(self):
+        # searches run on the service's event loop so they share its pooled aiohttp session
+        self._loop = asyncio.get_running_loop()
+
+    def _run(self, facets, coro):
+        reserved = _RESERVED_PARAMS.intersection(facets)
+        if reserved:
+            coro.close()
+            raise ValueError(f"Facets may not include the search parameters {sorted(reserved)}")
+        if self._loop is None:
+            coro.close()
+            raise RuntimeError('The ESGF handler has not been started')
+        # handler methods run on the thread pool, so searches are handed over to the event loop
+        try:
+            return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+        except aiohttp.ClientError as e:
+            raise ValueError(f"Could not fetch data from ESGF: {str(e)}") from e
 
-    async def fetch_data(self, datastream, date):
-        arm_data = await self._fetch_obj_from_esgf(datastream, date)
+    def _search(self, project, facets, limit=None, offset=0, fields=None):
+        return self._run(facets, esgf_search_cached(
+            server=self._index_url, project=project, limit=limit, fields=fields,
+            max_concurrency=self._search_concurrency, offset=offset, **facets))
 
-        return arm_data
+    @staticmethod
+    def _file_item(doc):
+        return {'id': doc['id'], 'd': doc.get('title', doc['id']), 'owner': doc.get('data_node', 'nan'),
+                't': doc.get('version', 'nan'), 'type': 'file', 'dataset_id': doc.get('dataset_id'),
+                'size': doc.get('size')}
+
+    def _list_files(self, project, facets, limit=None, after=None):
+        offset = after or 0
+        if not limit:
+            return [self._file_item(d) for d in
+                    self._search(project, facets, limit=_MAX_LIST, offset=offset, fields=_LIST_FIELDS)]
+        # fetch one extra file to find out if there's another page
+        docs = self._search(project, facets, limit=limit + 1, offset=offset, fields=_LIST_FIELDS)
+        return {'items': [self._file_item(d) for d in docs[:limit]],
+                'next': offset + limit if len(docs) > limit else None}
 
-    async def save_data(self, file_path):
-        pass
+    @staticmethod
+    def _frame_rows(df):
+        df = df.reset_index()
+        for name, col in df.items():
+            if col.dtype == object:
+                # e.g. the cftime dates of model calendars without leap days
+                df[name] = col.astype(str)
+        # missing values become null rather than NaN, which isn't valid JSON
+        df = df.astype(object).where(df.notna(), None)
+        return df.to_dict(orient='records')
+
+    def _iter_dataset(self, project, facets, dataset_id, variables=None, time_start=None,
+                      time_end=None, bbox=None):
+        docs = self._search(project, {**facets, 'dataset_id': dataset_id}, limit=_MAX_FILES + 1,
+                            fields=_OPEN_FIELDS)
+        if len(docs) > _MAX_FILES:
+            raise ValueError(f"Dataset {dataset_id} has more than {_MAX_FILES} files")
+        urls = sorted(filter(None, (file_url(d) for d in docs)))
+        if not urls:
+            raise ValueError(f"Could not fetch data from ESGF: no OPENDAP files found for {dataset_id}")
+        if not variables:
+            variables = sorted({v for d in docs for v in d.get('variable_id', [])})
+        bounds = None
+        if bbox:
+            lat_min, lat_max, lon_min, lon_max = bbox
+            bounds = {'lat': (lat_min, lat_max), 'lon': (lon_min, lon_max)}
+        # only the selected variables, time steps and grid cells are ever requested from the data
+        # nodes, a block of time steps at a time
+        with open_datasets(urls, variables or None, time_start, time_end,
+                           time_chunk=self._time_chunk, bounds=bounds) as ds:
+            for df in iter_frames(ds, time_chunk=self._time_chunk):
+                yield from self._frame_rows(df)
+
+    def fetch_data(self, **kwargs):
+        """
+        Lists or reads the files of an ESGF project, given as the path.
+
+        facets - the search facets the files must match, for example {'source_id': 'CESM2',
+            'variable_id': 'tas'}. A list of values matches any of them.
+
+        Without an object_id the matching files are listed, paged with limit and after. With an
+        object_id, the data of that dataset (the dataset_id of its files) is read row by row,
+        optionally restricted with variables, time_start, time_end, and a bbox of
+        [lat_min, lat_max, lon_min, lon_max], and limit caps the number of rows. The rows are all
+        held in memory, so reads of more than _MAX_ROWS rows fail, use iter_data to stream them.
+        """
+        if kwargs.get('object_id', None) is None:
+            return self._list_files(kwargs.get('path', None), kwargs.get('facets', None) or {},
+                                    kwargs.get('limit', None), kwargs.get('after', None))
+        limit = kwargs.get('limit', None)
+        if limit and limit <= _MAX_ROWS:
+            return list(self.iter_data(**kwargs))
+        # read one extra row to find out if there are too many
+        it = self.iter_data(**{**kwargs, 'limit': _MAX_ROWS + 1})
+        try:
+            rows = list(it)
+        finally:
+            # closes the datasets as soon as the rows are read
+            it.close()
+        if len(rows) > _MAX_ROWS:
+            raise ValueError(f"The selected data has more than {_MAX_ROWS} rows. Narrow it down with "
+                             f"variables, time_start, time_end or bbox, set a limit, or stream it "
+                             f"with Accept: application/x-ndjson")
+        return rows
+
+    def fetch_facets(self, **kwargs):
+        """
+        Returns the number of datasets of an ESGF project, given as the path, with each value of
+        the facets named in names, as {facet: {value: count}}. Only the datasets matching the
+        facets filter are counted.
+        """
+        names = kwargs.get('names', None)
+        if not names:
+            raise ValueError('Please provide the names of the facets to count')
+        facets = kwargs.get('facets', None) or {}
+        return self._run(facets, esgf_facets(
+            server=self._index_url, project=kwargs.get('path', None), facets=names, **facets))
+
+    def iter_data(self, **kwargs):
+        project = kwargs.get('path', None)
+        facets = kwargs.get('facets', None) or {}
+        if kwargs.get('object_id', None) is None:
+            docs = self._search(project, facets, limit=kwargs.get('limit', None) or _MAX_LIST,
+                                offset=kwargs.get('after', None) or 0, fields=_LIST_FIELDS)
+            yield from (self._file_item(d) for d in docs)
+            return
+        rows = self._iter_dataset(
+            project, facets, kwargs['object_id'], kwargs.get('variables', None),
+            kwargs.get('time_start', None), kwargs.get('time_end', None), kwargs.get('bbox', None))
+        yield from itertools.islice(rows, kwargs.get('limit', None))
@@ -1,7 +1,8 @@
+import asyncio
 import copy
 
 from src.utils.data_handlers.data_handler import DataHandler
-from src.utils.kbase_helpers.workspaceClient import Workspace
+from src.utils.kbase_helpers.client_registry import get_workspace_client
 
 
 def _sort_dict(in_struct):
@@ -20,8 +21,8 @@ class KBaseHandler(DataHandler):
 
     async def _fetch_obj_from_ws(self, obj_ref):
         try:
-            item = self.ws.get_objects2({'objects': [{'ref': obj_ref}],
-                                         'no_data': 0})['data'][0]
+            item = (await self.ws.get_objects2({'objects': [{'ref': obj_ref}],
+                                                'no_data': 0}))['data'][0]
         except Exception as e:
             raise ValueError(f"Could not fetch object from workspace: {str(e)}") from e
 
@@ -30,7 +31,8 @@ class KBaseHandler(DataHandler):
 
         return obj_info, obj_data
 
-    async def _save_obj_to_ws(self, wsid, obj_data, provenance=None):
+    @staticmethod
+    def _prepare_obj_to_save(obj_data, provenance=None):
         obj_to_save = {}
 
         prov_to_save = provenance
@@ -55,20 +57,31 @@ class KBaseHandler(DataHandler):
 
         obj_to_save['provenance'] = prov_to_save
 
+        return obj_to_save
+
+    async def _save_obj_to_ws(self, wsid, obj_data, provenance=None):
+        obj_to_save = self._prepare_obj_to_save(obj_data, provenance=provenance)
+
         try:
-            obj_info = self.ws.save_objects({'id': wsid, 'objects': [obj_to_save]})[0]
+            obj_info = (await self.ws.save_objects({'id': wsid, 'objects': [obj_to_save]}))[0]
         except Exception as e:
             raise ValueError(f"Could not save object to workspace: {str(e)}") from e
 
         return obj_info
 
+    async def _save_objs_to_ws(self, wsid, objs_to_save):
+        try:
+            return await self.ws.save_objects({'id': wsid, 'objects': objs_to_save})
+        except Exception as e:
+            raise ValueError(f"Could not save objects to workspace: {str(e)}") from e
+
     def __init__(self, auth_token, ws_url="https://ci.kbase.us/services/ws"):
         super().__init__('KBase')
         self.auth_token = auth_token
         self.ws_url = ws_url
         try:
-            self.ws = Workspace(url=self.ws_url, token=self.auth_token)
-            self.ws.ver()
+            # the async client keeps the event loop free while waiting on the workspace
+            self.ws = get_workspace_client(self.ws_url, self.auth_token, async_client=True)
         except Exception as e:
             raise ValueError('Cannot connect to KBase Workspace client') from e
 
@@ -84,3 +97,42 @@ class KBaseHandler(DataHandler):
         obj_ref = f"{obj_info[6]}/{obj_info[0]}/{obj_info[4]}"
 
         return obj_ref, obj_info
+
+    async def save_batch(self, objs, chunk_size=100, max_concurrency=4):
+        """
+        Save many objects with one save_objects call per workspace and chunk of objects.
+        objs - a list of (wsid, obj_data, provenance) tuples.
+        max_concurrency - the maximum number of save_objects calls running at once.
+        Returns an (obj_ref, obj_info) tuple, or the error for objects that couldn't be saved,
+        for each object in input order.
+        """
+        results = [None] * len(objs)
+        by_wsid = {}
+        for i, (wsid, obj_data, provenance) in enumerate(objs):
+            try:
+                obj_to_save = self._prepare_obj_to_save(obj_data, provenance)
+            except Exception as e:
+                results[i] = ValueError(f"Could not save object to workspace: {str(e)}")
+                continue
+            by_wsid.setdefault(wsid, []).append((i, obj_to_save))
+
+        chunks = []
+        for wsid, items in by_wsid.items():
+            chunks.extend((wsid, items[j:j + chunk_size]) for j in range(0, len(items), chunk_size))
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def save_chunk(wsid, items):
+            async with semaphore:
+                return await self._save_objs_to_ws(wsid, [obj for _, obj in items])
+
+        chunk_infos = await asyncio.gather(
+            *[save_chunk(wsid, items) for wsid, items in chunks], return_exceptions=True)
+
+        for (wsid, items), infos in zip(chunks, chunk_infos):
+            if isinstance(infos, Exception):
+                for i, _ in items:
+                    results[i] = infos
+            else:
+                for (i, _), obj_info in zip(items, infos):
+                    results[i] = (f"{obj_info[6]}/{obj_info[0]}/{obj_info[4]}", obj_info)
+        return results
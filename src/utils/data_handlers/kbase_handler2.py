@@ -1,13 +1,37 @@
 import copy
+import hashlib
+import itertools
+import json
+import re
 
+from src.utils.batcher import MicroBatcher
+from src.utils.cache import DiskCache, SQLiteCache, TieredCache, TTLCache
 from src.utils.data_handlers.data_handler import DataHandler
-from src.utils.kbase_helpers.workspaceClient import Workspace as WorkspaceClient
+from src.utils.kbase_helpers.baseclient import ServerError
+from src.utils.kbase_helpers.client_registry import get_workspace_client
 
+# larger cached objects are only kept on disk
+_MAX_MEMORY_CACHED_BYTES = 1024 * 1024
+# the number of objects fetched per list_objects call when streaming listings, 10000 max
+_LIST_PAGE_SIZE = 1000
+# how the Workspace names the malformed spec, numbered from 1, that failed a whole call
+_BAD_SPEC = re.compile(r'Error on Object(?:Specification|Identity) #(\d+)')
 
-def _process_workspace_identifiers(id_or_ref, workspace=None):
+
+def _parse_id(id_or_name):
+    """
+    Workspace and object names can't be integers, so numeric strings are always IDs
+    """
+    if isinstance(id_or_name, str) and id_or_name.isdigit():
+        return int(id_or_name)
+    return id_or_name
+
+
+def _process_workspace_identifiers(id_or_ref, workspace=None, version=None):
     """
     IDs should always be processed through this function so we can interchangeably use
-    refs, IDs, and names for workspaces and objects
+    refs, IDs, and names for workspaces and objects. The version is ignored for refs, which
+    carry their own version.
     """
     obj_spec = {}
     if workspace is None:
@@ -21,24 +45,143 @@ def _process_workspace_identifiers(id_or_ref, workspace=None):
             obj_spec["objid"] = id_or_ref
         else:
             obj_spec["name"] = id_or_ref
+        if version is not None:
+            obj_spec["ver"] = version
     return obj_spec
 
 
 class KBaseHandler2(DataHandler):
 
-    def _fetch_obj_from_ws(self, id_or_ref, workspace=None):
+    def _fetch_obj_from_ws(self, ws, id_or_ref, workspace=None, included=None, no_data=False, version=None):
+        """
+        Fetch a single object. Concurrent fetches with the same Workspace client, and so the same
+        token, are batched into one get_objects2 call.
+        """
+        obj_spec = _process_workspace_identifiers(id_or_ref, workspace, version)
+        if included:
+            # only the listed paths into the object are returned
+            obj_spec['included'] = included
+
+        def load(obj_specs):
+            if len(obj_specs) == 1:
+                return [self._get_object(ws, obj_specs[0], no_data)]
+            return self._fetch_objs_from_ws(ws, obj_specs, self.batch_chunk_size, no_data)
+
+        return self._read_batcher.submit((ws, bool(no_data)), obj_spec, load)
+
+    @staticmethod
+    def _get_object(ws, obj_spec, no_data=False):
+        # returns the error rather than raising it, as for _fetch_objs_from_ws
         try:
-            item = self.ws.get_objects2({'objects': [_process_workspace_identifiers(id_or_ref, workspace)],
-                                         'no_data': 0})['data'][0]
+            item = ws.get_objects2({'objects': [obj_spec],
+                                    'no_data': 1 if no_data else 0})['data'][0]
         except Exception as e:
-            raise ValueError(f"Could not fetch object from workspace: {str(e)}") from e
+            return ValueError(f"Could not fetch object from workspace: {str(e)}")
 
         obj_info = item.get('info')
         obj_data = item.get('data')
 
         return obj_info, obj_data
 
-    async def _save_obj_to_ws(self, wsid, obj_data, provenance=None):
+    @staticmethod
+    def _object_cache_key(upa, included=None, no_data=False):
+        return f"{upa}|{json.dumps(included)}|{1 if no_data else 0}"
+
+    def _get_cached_obj(self, key):
+        cached = self._object_cache.get(key)
+        if cached is None and self._object_disk_cache:
+            cached_bytes = self._object_disk_cache.get(key)
+            if cached_bytes is not None:
+                cached = json.loads(cached_bytes)
+                if len(cached_bytes) <= _MAX_MEMORY_CACHED_BYTES:
+                    self._object_cache.set(key, cached)
+        return cached
+
+    def _cache_obj(self, key, obj_info, obj_data):
+        cached_bytes = json.dumps([obj_info, obj_data]).encode('utf-8')
+        if len(cached_bytes) <= _MAX_MEMORY_CACHED_BYTES:
+            self._object_cache.set(key, [obj_info, obj_data])
+        if self._object_disk_cache:
+            self._object_disk_cache.set(key, cached_bytes)
+
+    @staticmethod
+    def _access_key(token, wsid, auth_user=None):
+        # the user resolved from the token by the service covers all of the user's tokens
+        if auth_user:
+            return 'user', auth_user, wsid
+        return 'token', hashlib.sha256(token.encode('utf-8')).hexdigest() if token else None, wsid
+
+    def _check_read_access(self, ws, token, wsid, upa, auth_user=None):
+        access_key = self._access_key(token, wsid, auth_user)
+        if self._read_access.get(access_key):
+            return
+        try:
+            # far cheaper than fetching the object data again
+            ws.get_object_info3({'objects': [{'ref': upa}]})
+        except Exception as e:
+            raise ValueError(f"Could not fetch object from workspace: {str(e)}") from e
+        self._read_access.set(access_key, True)
+
+    def _fetch_obj_version(self, ws, token, id_or_ref, workspace, version, included=None, no_data=False,
+                           auth_user=None):
+        """
+        Fetch an exact object version. Versions are immutable, so they're served from the cache
+        when possible, provided the user has been seen to have read access to the workspace.
+        auth_user - the KBase user of the token, if the service has validated it.
+        """
+        if isinstance(workspace, int) and isinstance(id_or_ref, int):
+            upa = f"{workspace}/{id_or_ref}/{version}"
+            cached = self._get_cached_obj(self._object_cache_key(upa, included, no_data))
+            if cached is not None:
+                self._check_read_access(ws, token, workspace, upa, auth_user)
+                return cached
+
+        obj_info, obj_data = self._fetch_obj_from_ws(
+            ws, id_or_ref, workspace, included=included, no_data=no_data, version=version)
+        # cache under the upa even if the object was requested by name
+        upa = f"{obj_info[6]}/{obj_info[0]}/{obj_info[4]}"
+        self._read_access.set(self._access_key(token, obj_info[6], auth_user), True)
+        self._cache_obj(self._object_cache_key(upa, included, no_data), obj_info, obj_data)
+        return obj_info, obj_data
+
+    def _fetch_objs_from_ws(self, ws, obj_specs, chunk_size, no_data=False):
+        """
+        Fetch objects in chunked get_objects2 calls. Returns an (info, data) tuple, or the
+        error for objects that couldn't be fetched, for each object spec in order.
+        """
+        results = []
+        for i in range(0, len(obj_specs), chunk_size):
+            chunk = obj_specs[i:i + chunk_size]
+            try:
+                items = ws.get_objects2({'objects': chunk, 'no_data': 1 if no_data else 0, 'ignoreErrors': 1})['data']
+            except Exception as e:
+                bad = self._bad_spec(e, len(chunk))
+                if bad is None:
+                    # auth, network and server failures would fail every object alike
+                    results.extend(ValueError(f"Could not fetch object from workspace: {str(e)}") for _ in chunk)
+                else:
+                    # ignoreErrors doesn't cover malformed specs, fetch the others without it
+                    rest = self._fetch_objs_from_ws(ws, chunk[:bad] + chunk[bad + 1:], chunk_size, no_data)
+                    rest.insert(bad, ValueError(f"Could not fetch object from workspace: {str(e)}"))
+                    results.extend(rest)
+                continue
+            for item in items:
+                if item is None:
+                    results.append(ValueError('Could not fetch object from workspace: '
+                                              'Object does not exist or is inaccessible'))
+                else:
+                    results.append((item.get('info'), item.get('data')))
+        return results
+
+    @staticmethod
+    def _bad_spec(error, count):
+        # the index of the malformed spec a Workspace error names, or None for other errors
+        match = _BAD_SPEC.search(error.message) if isinstance(error, ServerError) else None
+        if match and 1 <= int(match.group(1)) <= count:
+            return int(match.group(1)) - 1
+        return None
+
+    async def _save_obj_to_ws(self, ws, wsid, obj_data, provenance=None):
         obj_to_save = {}
 
         prov_to_save = provenance
@@ -64,7 +207,7 @@ class KBaseHandler2(DataHandler):
         obj_to_save['provenance'] = prov_to_save
 
         try:
-            obj_info = self.ws.save_objects({'id': wsid, 'objects': [obj_to_save]})[0]
+            obj_info = ws.save_objects({'id': wsid, 'objects': [obj_to_save]})[0]
         except Exception as e:
             raise ValueError(f"Could not save object to workspace: {str(e)}") from e
 
@@ -72,26 +215,104 @@ class KBaseHandler2(DataHandler):
 
     def __init__(self, **kwargs):
         super().__init__('KBase')
-        self.auth_token = kwargs.get('token', None)
+        # the maximum number of objects fetched per get_objects2 call in batches
+        self.batch_chunk_size = kwargs.get('batch_chunk_size', 100)
+        # concurrent single object fetches are collected for up to the window and fetched together
+        self._read_batcher = MicroBatcher(window=kwargs.get('read_batch_window_sec', 0.002),
+                                          max_batch_size=kwargs.get('read_batch_max_size', 100))
+        # exact object versions are immutable, so they're cached by upa in memory and on disk
+        self._object_cache = TTLCache(maxsize=kwargs.get('object_cache_size', 256))
+        self._object_cache_dir = kwargs.get('object_cache_dir', None)
+        self._object_cache_max_bytes = kwargs.get('object_cache_max_bytes', 1024 * 1024 * 1024)
+        self._object_disk_cache = None
+        # (user or token hash, wsid) pairs recently seen to be readable, so cache hits can skip the
+        # workspace. Shared with the other workers of the deployment if a shared cache is given
+        self._read_access_ttl = kwargs.get('read_access_ttl_sec', 300)
+        self._read_access = TTLCache(maxsize=10000, ttl=self._read_access_ttl)
+        self._shared_cache_path = kwargs.get('shared_cache_path', None)
+        self._shared_cache_size = kwargs.get('shared_cache_size', 100000)
         self.ws_url = kwargs.get('ws_url', 'https://kbase.us/services/ws/')
         self.ws_handle_url = kwargs.get('ws_handle_url', 'https://kbase.us/services/handle_service')
         # KBASE_WS_URL = "https://kbase.us/services/ws/"
         # KBASE_HANDLE_URL = "https://kbase.us/services/handle_service"
+
+    @staticmethod
+    def _iter_workspaces(ws, after=None):
+        """
+        Yields (workspace ID, item) for each narrative workspace, ordered by workspace ID.
+        """
+        # list_workspace_info can't filter by ID, so the cursor is applied here
+        for o in sorted(ws.list_workspace_info({}), key=lambda o: o[0]):
+            if (after is None or o[0] > after) and 'narrative_nice_name' in o[8]:
+                yield o[0], {'id': o[1], 'd': o[8]['narrative_nice_name'], 'owner': o[2], 't': o[3],
+                             'type': 'folder'}
+
+    @staticmethod
+    def _iter_objects(ws, workspace, after=None, page_size=_LIST_PAGE_SIZE):
+        """
+        Yields (object ID, item) for each object in a workspace, ordered by object ID, paging
+        through list_objects lazily.
+        """
+        params = {'ids': [workspace]} if isinstance(workspace, int) else {'workspaces': [workspace]}
+        min_id = (after or 0) + 1
+        while True:
+            res = sorted(ws.list_objects({**params, 'minObjectID': min_id, 'limit': page_size}),
+                         key=lambda o: o[0])
+            for o in res:
+                if not o[2].startswith('KBaseNarrative.Narrative'):
+                    yield o[0], {'id': o[1], 'd': o[2], 'owner': o[5], 't': o[3], 'type': 'file'}
+            if len(res) < page_size:
+                return
+            min_id = res[-1][0] + 1
+
+    @staticmethod
+    def _page(rows, limit):
+        """
+        Returns up to limit items from the (ID, item) rows and the cursor for the next page, or
+        None if there are no more rows.
+        """
+        items, cursor = [], None
+        for row_id, item in rows:
+            if len(items) == limit:
+                return {'items': items, 'next': cursor}
+            items.append(item)
+            cursor = row_id
+        return {'items': items, 'next': None}
+
+    async def startup(self):
+        if self._object_cache_dir:
+            self._object_disk_cache = DiskCache(self._object_cache_dir, self._object_cache_max_bytes)
+        if self._shared_cache_path:
+            self._read_access = TieredCache(self._read_access, SQLiteCache(
+                self._shared_cache_path, 'kbase_read_access', self._shared_cache_size, self._read_access_ttl))
+
+    def _get_ws(self, token):
         try:
-            self.ws = WorkspaceClient(url=self.ws_url, token=self.auth_token)
-            self.ws.ver()
+            return get_workspace_client(self.ws_url, token)
         except Exception as e:
             raise ValueError(f'Cannot connect to KBase Workspace client: {e}') from e
 
     def fetch_data(self, **kwargs):
-        ws_id = kwargs.get('path', None)
+        token = kwargs.get('token', None)
+        ws = self._get_ws(token)
+        path = kwargs.get('path', None)
+        ws_id = _parse_id(path)
         object_id = kwargs.get('object_id', None)
         version = kwargs.get('version', None)
+        included = kwargs.get('included', None)
+        no_data = kwargs.get('no_data', False)
+        limit = kwargs.get('limit', None)
+        after = kwargs.get('after', None)
 
         # print(ws_id, object_id, version)
 
-        if ws_id is None:  # list workspace if no ws
-            res = self.ws.list_workspace_info({})
+        if limit and object_id is None:  # page through a listing
+            if ws_id is None:
+                return self._page(self._iter_workspaces(ws, after), limit)
+            # fetch one extra object to find out if there's another page
+            return self._page(self._iter_objects(ws, ws_id, after, page_size=min(limit + 1, 10000)), limit)
+        elif ws_id is None:  # list workspace if no ws
+            res = ws.list_workspace_info({})
             object_list = []
             for o in res:
                 if 'narrative_nice_name' in o[8]:
@@ -99,19 +320,56 @@ class KBaseHandler2(DataHandler):
                     object_list.append(item)
             return object_list
         elif object_id is None:  # list workspace objects if no object_id
-            res = self.ws.list_workspace_objects({'workspace': ws_id})
+            res = ws.list_workspace_objects({'workspace': path})
             return [{'id': o[0], 'd': o[1], 'owner': o[5], 't': o[2], 'type': 'file'} for o in res if
                     not o[1].startswith('KBaseNarrative.Narrative')]
         elif version is None:  # get object lastest version
-            obj_info, obj_data = self._fetch_obj_from_ws(object_id, ws_id)
+            obj_info, obj_data = self._fetch_obj_from_ws(ws, _parse_id(object_id), ws_id, included=included,
+                                                         no_data=no_data)
             return [{'id': object_id, 'type': 'data', 'data': [obj_info, obj_data]}]
-            pass
         else:  # get exact object version
-            raise Exception('Not implemented')
+            obj_info, obj_data = self._fetch_obj_version(ws, token, _parse_id(object_id), ws_id, version,
+                                                         included=included, no_data=no_data,
+                                                         auth_user=kwargs.get('auth_user', None))
+            return [{'id': object_id, 'type': 'data', 'data': [obj_info, obj_data]}]
+
+    def iter_data(self, **kwargs):
+        if kwargs.get('object_id', None) is not None:
+            yield from self.fetch_data(**kwargs)
+            return
+        ws = self._get_ws(kwargs.get('token', None))
+        ws_id = _parse_id(kwargs.get('path', None))
+        after = kwargs.get('after', None)
+        if ws_id is None:
+            rows = self._iter_workspaces(ws, after)
+        else:
+            rows = self._iter_objects(ws, ws_id, after)
+        yield from itertools.islice((item for _, item in rows), kwargs.get('limit', None))
+
+    def is_immutable(self, **kwargs):
+        # only an exact version of an object identified by IDs can never change, names can be reused
+        return (kwargs.get('version', None) is not None
+                and isinstance(_parse_id(kwargs.get('path', None)), int)
+                and isinstance(_parse_id(kwargs.get('object_id', None)), int))
+
+    def fetch_batch(self, **kwargs):
+        ws = self._get_ws(kwargs.get('token', None))
+        objects = kwargs.get('objects', [])
+        chunk_size = min(kwargs.get('chunk_size', None) or self.batch_chunk_size, self.batch_chunk_size)
+
+        obj_specs = [_process_workspace_identifiers(o['object_id'], o.get('workspace', None), o.get('version', None))
+                     for o in objects]
+        batch = []
+        for o, res in zip(objects, self._fetch_objs_from_ws(ws, obj_specs, chunk_size)):
+            if isinstance(res, Exception):
+                batch.append({'id': o['object_id'], 'type': 'error', 'error': str(res)})
+            else:
+                batch.append({'id': o['object_id'], 'type': 'data', 'data': list(res)})
+        return batch
 
-    async def save_data(self, wsid, obj_data, provenance=None):
+    async def save_data(self, wsid, obj_data, provenance=None, token=None):
 
-        obj_info = await self._save_obj_to_ws(wsid, obj_data, provenance=provenance)
+        obj_info = await self._save_obj_to_ws(self._get_ws(token), wsid, obj_data, provenance=provenance)
 
         obj_ref = f"{obj_info[6]}/{obj_info[0]}/{obj_info[4]}"
 
@@ -1,25 +1,158 @@
 #!/usr/bin/env python
 from __future__ import print_function
+import asyncio
+import collections
+import itertools
+import json
+import time
+import weakref
+
+import aiohttp
 import requests
 import xml.etree.ElementTree as ET
 import numpy
 
+from src.utils.cache import DiskCache, TTLCache
+
 # Author: Unknown
 # I got the original version from a word document published by ESGF
 # https://docs.google.com/document/d/1pxz1Kd3JHfFp8vR2JCVBfApbsHmbUQQstifhGNdc6U0/edit?usp=sharing
 
 # API AT: https://github.com/ESGF/esgf.github.io/wiki/ESGF_Search_REST_API#results-pagination
 
-def esgf_search(server="https://esgf-node.llnl.gov/esg-search/search",
+DEFAULT_SERVER = "https://esgf-node.llnl.gov/esg-search/search"
+
+_PAGE_SIZE = 500
+_POOL_MAXSIZE = 10
+
+_DEFAULT_SEARCH_CACHE_SIZE = 1000
+_DEFAULT_SEARCH_CACHE_TTL_SEC = 3600
+
+# normalised search -> search results, optionally backed by a DiskCache holding
+# {"expires": <epoch seconds>, "value": <search results>} as JSON
+_SEARCHES = TTLCache(maxsize=_DEFAULT_SEARCH_CACHE_SIZE)
+_SEARCH_DISK_CACHE = None
+_SEARCH_TTL = _DEFAULT_SEARCH_CACHE_TTL_SEC
+
+# aiohttp sessions are bound to the event loop they were created in
+_SESSIONS = weakref.WeakKeyDictionary()
+
+
+def _get_session():
+    loop = asyncio.get_running_loop()
+    session = _SESSIONS.get(loop)
+    if session is None or session.closed:
+        # the session is shared between users, so never let cookies leak from one to another
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=_POOL_MAXSIZE),
+                                        cookie_jar=aiohttp.DummyCookieJar())
+        _SESSIONS[loop] = session
+    return session
+
+
+async def close_sessions():
+    """
+    Closes the pooled aiohttp sessions used by esgf_search_async.
+    """
+    sessions = list(_SESSIONS.values())
+    _SESSIONS.clear()
+    for session in sessions:
+        await session.close()
+
+
+def configure_search_cache(maxsize: int = _DEFAULT_SEARCH_CACHE_SIZE,
+                           ttl: float = _DEFAULT_SEARCH_CACHE_TTL_SEC,
+                           directory: str = None,
+                           max_bytes: int = 256 * 1024 * 1024):
+    """
+    Replace the search cache with an empty one with the given bounds.
+    maxsize - the maximum number of search results kept in memory.
+    ttl - the time in seconds search results are kept.
+    directory - a directory to also keep search results in, so they are shared between processes
+        and survive restarts, or None to keep them in memory only.
+    max_bytes - the maximum total size of the search results kept in the directory.
+    """
+    global _SEARCHES, _SEARCH_DISK_CACHE, _SEARCH_TTL
+    _SEARCHES = TTLCache(maxsize=maxsize)
+    _SEARCH_DISK_CACHE = DiskCache(directory, max_bytes) if directory else None
+    _SEARCH_TTL = ttl
+
+
+def search_cache_stats() -> dict:
+    """ Returns the in memory search cache size and hit statistics. """
+    return _SEARCHES.stats()
+
+
+def _cache_key(server, params):
+    # neither the order of the facets nor of their values changes the results
+    return json.dumps([server, sorted({(k, str(v)) for k, v in params})])
+
+
+def _disk_cache_get(disk_cache, key):
+    cached = disk_cache.get(key)
+    if cached is None:
+        return None
+    entry = json.loads(cached)
+    ttl = entry["expires"] - time.time()
+    if ttl <= 0:
+        return None
+    _SEARCHES.set(key, entry["value"], ttl=ttl)
+    return entry["value"]
+
+
+def _disk_cache_set(disk_cache, key, value):
+    entry = {"expires": time.time() + _SEARCH_TTL, "value": value}
+    disk_cache.set(key, json.dumps(entry).encode("utf-8"))
+
+
+# the searches run on the service's event loop, so the disk cache, which reads, writes and evicts
+# files, is only used from the thread pool
+async def _cache_get(key):
+    value = _SEARCHES.get(key)
+    if value is None and _SEARCH_DISK_CACHE:
+        value = await asyncio.get_running_loop().run_in_executor(
+            None, _disk_cache_get, _SEARCH_DISK_CACHE, key)
+    return value
+
+
+async def _cache_set(key, value):
+    _SEARCHES.set(key, value, ttl=_SEARCH_TTL)
+    if _SEARCH_DISK_CACHE:
+        await asyncio.get_running_loop().run_in_executor(
+            None, _disk_cache_set, _SEARCH_DISK_CACHE, key, value)
+
+
+def _search_params(project, local_node, search, fields=None, record_type="File"):
+    payload = dict(search)
+    payload["project"] = project
+    payload["type"] = record_type
+    if local_node:
+        payload["distrib"] = "false"
+    if fields:
+        payload["fields"] = ",".join(fields)
+    payload["format"] = "application/solr+json"
+    # facets may be given several values, which are sent as repeated parameters
+    return [(k, str(v)) for k, vs in payload.items() for v in (vs if isinstance(vs, (list, tuple)) else [vs])]
+
+
+def file_url(doc, files_type="OPENDAP"):
+    """
+    Returns the URL of the given access type (OPENDAP, HTTPServer, ...) of a file record, or None
+    if the file can't be accessed that way.
+    """
+    for f in doc.get("url", []):
+        sp = f.split("|")
+        if sp[-1].upper() == files_type.upper():
+            return sp[0].split(".html")[0]
+    return None
+
+
+def esgf_search(server=DEFAULT_SERVER,
                 files_type="OPENDAP", local_node=True, project="CMIP6",
                 verbose=False, format="application%2Fsolr%2Bjson",
                 use_csrf=False, **search):
+    # format is ignored, the search results are always requested as JSON
     client = requests.session()
-    payload = search
-    payload["project"] = project
-    payload["type"]= "File"
-    if local_node:
-        payload["distrib"] = "false"
+    params = _search_params(project, local_node, search)
     if use_csrf:
         client.get(server)
         if 'csrftoken' in client.cookies:
@@ -28,35 +161,118 @@ def esgf_search(server="https://esgf-node.llnl.gov/esg-search/search",
         else:
             # older versions
             csrftoken = client.cookies['csrf']
-        payload["csrfmiddlewaretoken"] = csrftoken
-
-    payload["format"] = format
+        params.append(("csrfmiddlewaretoken", csrftoken))
 
     offset = 0
     numFound = 10000
     all_files = []
-    files_type = files_type.upper()
     while offset < numFound:
-        payload["offset"] = offset
-        url_keys = []
-        for k in payload:
-            url_keys += ["{}={}".format(k, payload[k])]
-
-        url = "{}/?{}".format(server, "&".join(url_keys))
-        print(url)
-        r = client.get(url)
+        r = client.get("{}/".format(server), params=params + [("offset", offset)])
         r.raise_for_status()
         resp = r.json()["response"]
         numFound = int(resp["numFound"])
         resp = resp["docs"]
+        if not resp:
+            break
         offset += len(resp)
         for d in resp:
             if verbose:
                 for k in d:
                     print("{}: {}".format(k,d[k]))
-            url = d["url"]
-            for f in d["url"]:
-                sp = f.split("|")
-                if sp[-1] == files_type:
-                    all_files.append(sp[0].split(".html")[0])
-    return sorted(all_files)
\ No newline at end of file
+            url = file_url(d, files_type)
+            if url:
+                all_files.append(url)
+    return sorted(all_files)
+
+
+async def esgf_search_async(server=DEFAULT_SERVER, local_node=True, project="CMIP6", limit=None,
+                            fields=None, page_size=_PAGE_SIZE, max_concurrency=4, offset=0, **search):
+    """
+    Search ESGF for files, yielding the Solr record of each file found in result order.
+
+    The first page is fetched to learn how many files were found, then the remaining pages are
+    fetched concurrently, at most max_concurrency at a time.
+
+    limit - the maximum number of records to return, or None for all of them.
+    fields - the names of the record fields to return, or None for all of them. Include url to
+        use file_url on the records.
+    page_size - the number of records per search request.
+    offset - the number of records to skip, for paging through the results.
+    search - the facets to search for, for example variable_id='tas'. A list of values matches
+        any of them.
+    """
+    params = _search_params(project, local_node, search, fields)
+    session = _get_session()
+
+    async def fetch_page(offset, size):
+        page_params = params + [("offset", offset), ("limit", size)]
+        async with session.get("{}/".format(server), params=page_params) as r:
+            r.raise_for_status()
+            return (await r.json(content_type=None))["response"]
+
+    start = offset
+    resp = await fetch_page(start, min(page_size, limit) if limit else page_size)
+    # the end of the records to return, exclusive
+    end = int(resp["numFound"]) if limit is None else min(start + limit, int(resp["numFound"]))
+    docs = resp["docs"][:max(end - start, 0)]
+    for d in docs:
+        yield d
+    if not docs:
+        return
+    # the index node may cap the page size below what was asked for
+    page_size = min(page_size, len(docs))
+
+    # fetch ahead by at most max_concurrency pages, yielding them in order
+    offsets = iter(range(start + len(docs), end, page_size))
+    pending = collections.deque()
+    try:
+        for offset in itertools.islice(offsets, max_concurrency):
+            pending.append(asyncio.ensure_future(fetch_page(offset, min(page_size, end - offset))))
+        while pending:
+            docs = (await pending.popleft())["docs"]
+            offset = next(offsets, None)
+            if offset is not None:
+                pending.append(asyncio.ensure_future(fetch_page(offset, min(page_size, end - offset))))
+            for d in docs:
+                yield d
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def esgf_search_cached(server=DEFAULT_SERVER, local_node=True, project="CMIP6", limit=None,
+                             fields=None, page_size=_PAGE_SIZE, max_concurrency=4, offset=0, **search) -> list:
+    """
+    Returns the records of esgf_search_async as a list. Results are cached, see
+    configure_search_cache.
+    """
+    key = _cache_key(server, _search_params(project, local_node, search, fields)
+                     + [("offset", offset), ("limit", limit)])
+    docs = await _cache_get(key)
+    if docs is None:
+        docs = [d async for d in esgf_search_async(
+            server, local_node, project, limit, fields, page_size, max_concurrency, offset, **search)]
+        await _cache_set(key, docs)
+    return list(docs)
+
+
+async def esgf_facets(server=DEFAULT_SERVER, local_node=True, project="CMIP6", facets=(), **search) -> dict:
+    """
+    Returns the number of datasets with each value of the given facets among the datasets found
+    by the search, as {facet: {value: count}}. Results are cached, see configure_search_cache.
+
+    facets - the names of the facets to count, for example ['source_id', 'experiment_id'].
+    search - the facets to search for, as for esgf_search_async.
+    """
+    params = (_search_params(project, local_node, search, record_type="Dataset")
+              + [("facets", ",".join(sorted(set(facets)))), ("limit", 0)])
+    key = _cache_key(server, params)
+    counts = await _cache_get(key)
+    if counts is None:
+        async with _get_session().get("{}/".format(server), params=params) as r:
+            r.raise_for_status()
+            fields = (await r.json(content_type=None))["facet_counts"]["facet_fields"]
+        # Solr returns the counts of each facet as a flat [value, count, value, count, ...] list
+        counts = {f: dict(zip(vs[::2], vs[1::2])) for f, vs in fields.items()}
+        await _cache_set(key, counts)
+    return counts
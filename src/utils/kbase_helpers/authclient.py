@@ -9,50 +9,107 @@ import time as _time
 import requests as _requests
 import threading as _threading
 import hashlib
+from collections import OrderedDict as _OrderedDict
 
 
-class TokenCache(object):
-    ''' A basic cache for tokens. '''
+class InvalidToken(ValueError):
+    ''' The auth service rejected the token. '''
 
-    _MAX_TIME_SEC = 5 * 60  # 5 min
 
-    _lock = _threading.RLock()
+class AuthServiceError(Exception):
+    ''' The auth service could not be reached or failed to answer. '''
 
-    def __init__(self, maxsize=2000):
-        self._cache = {}
-        self._maxsize = maxsize
-        self._halfmax = maxsize / 2  # int division to round down
 
-    def get_user(self, token):
+class TokenCache(object):
+    '''
+    A thread safe LRU cache for tokens, keyed by the token hash. Valid tokens are kept until they
+    expire, and tokens known to be invalid are kept for a short time so repeated requests with a
+    bad token don't reach the auth service.
+
+    The cache is split into stripes, each with its own lock, so concurrent requests rarely wait
+    on each other. A cache shared with other processes may back it, so a token validated by one
+    worker is known to all of them.
+    '''
+
+    _MAX_TIME_SEC = 5 * 60  # 5 min
+
+    def __init__(self, maxsize=2000, invalid_token_ttl=60, stripes=16, shared=None):
+        '''
+        maxsize - the maximum number of tokens kept. The least recently used token in a stripe is
+            evicted when the stripe is full.
+        invalid_token_ttl - how long a token known to be invalid is kept in seconds.
+        stripes - the number of independently locked parts of the cache.
+        shared - a cache shared with other processes, such as an SQLiteCache, to check for tokens
+            that aren't cached locally. Only token hashes are stored in it.
+        '''
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        stripes = max(1, min(stripes, maxsize))
+        self._stripe_maxsize = -(-maxsize // stripes)  # round up
+        self._invalid_token_ttl = invalid_token_ttl
+        self._stripes = [(_OrderedDict(), _threading.Lock()) for _ in range(stripes)]
+        self._shared = shared
+
+    def _stripe(self, token):
         token = hashlib.sha256(token.encode('utf-8')).hexdigest()
-        with self._lock:
-            usertime = self._cache.get(token)
-        if not usertime:
-            return None
+        return (token,) + self._stripes[int(token[:8], 16) % len(self._stripes)]
 
-        user, intime = usertime
-        if _time.time() - intime > self._MAX_TIME_SEC:
+    def get_user(self, token, shared=True):
+        '''
+        Returns the user of a cached valid token, or None if the token is not cached. Raises
+        InvalidToken if the token is known to be invalid.
+        shared - whether to check the shared cache for tokens that aren't cached locally. The
+            local cache never blocks, the shared cache may wait on other processes.
+        '''
+        token, cache, lock = self._stripe(token)
+        with lock:
+            entry = cache.get(token)
+            if entry and entry[1] <= _time.time():
+                del cache[token]
+                entry = None
+            if entry:
+                cache.move_to_end(token)
+        if not entry and shared and self._shared is not None:
+            entry = self._shared.get(token)
+            if entry:
+                self._add_local(token, cache, lock, *entry)
+        if not entry:
             return None
+        user, expires = entry
+        if user is None:
+            raise InvalidToken('Invalid token')
         return user
 
-    def add_valid_token(self, token, user):
+    def _add_local(self, token, cache, lock, user, expires):
+        with lock:
+            cache[token] = (user, expires)
+            cache.move_to_end(token)
+            if len(cache) > self._stripe_maxsize:
+                cache.popitem(last=False)
+
+    def _add(self, token, user, expires):
+        token, cache, lock = self._stripe(token)
+        self._add_local(token, cache, lock, user, expires)
+        if self._shared is not None:
+            self._shared.set(token, [user, expires], ttl=expires - _time.time())
+
+    def add_valid_token(self, token, user, expires=None):
+        '''
+        Cache a valid token.
+        expires - when the cached token expires in seconds since the epoch, by default 5 minutes
+            from now.
+        '''
         if not token:
             raise ValueError('Must supply token')
         if not user:
             raise ValueError('Must supply user')
-        token = hashlib.sha256(token.encode('utf-8')).hexdigest()
-        with self._lock:
-            self._cache[token] = [user, _time.time()]
-            if len(self._cache) > self._maxsize:
-                sorted_items = sorted(
-                    list(self._cache.items()),
-                    key=(lambda v: v[1][1])
-                )
-                for i, (t, _) in enumerate(sorted_items):
-                    if i <= self._halfmax:
-                        del self._cache[t]
-                    else:
-                        break
+        self._add(token, user, expires or _time.time() + self._MAX_TIME_SEC)
+
+    def add_invalid_token(self, token):
+        ''' Cache a token the auth service rejected. '''
+        if not token:
+            raise ValueError('Must supply token')
+        self._add(token, None, _time.time() + self._invalid_token_ttl)
 
 
 class KBaseAuth(object):
@@ -60,35 +117,67 @@ class KBaseAuth(object):
     A very basic KBase auth client for the Python server.
     '''
 
-    _LOGIN_URL = 'https://kbase.us/services/auth/api/legacy/KBase/Sessions/Login'
+    _TOKEN_URL = 'https://kbase.us/services/auth/api/V2/token'
 
-    def __init__(self, auth_url=None):
+    def __init__(self, auth_url=None, cache_maxsize=2000, invalid_token_ttl=60, shared_cache=None,
+                 timeout=10):
         '''
         Constructor
+        auth_url - the token endpoint of the auth service.
+        timeout - how long to wait for the auth service in seconds.
+        cache_maxsize - the maximum number of tokens cached.
+        invalid_token_ttl - how long a token the auth service rejected is cached in seconds.
+        shared_cache - a cache shared with other processes to back the token cache, see
+            TokenCache.
         '''
         self._authurl = auth_url
         if not self._authurl:
-            self._authurl = self._LOGIN_URL
-        self._cache = TokenCache()
+            self._authurl = self._TOKEN_URL
+        self._cache = TokenCache(cache_maxsize, invalid_token_ttl, shared=shared_cache)
+        self._timeout = timeout
+
+    def get_cached_user(self, token):
+        '''
+        Returns the user name of a token from the in-process cache, or None if the token isn't
+        cached there. Raises InvalidToken if the token is known to be invalid. Neither the auth
+        service nor the shared cache are called, so this is safe to call from an event loop.
+        '''
+        if not token:
+            raise ValueError('Must supply token')
+        return self._cache.get_user(token, shared=False)
 
     def get_user(self, token):
+        '''
+        Returns the user name of a token. Raises InvalidToken if the auth service rejects the
+        token, or AuthServiceError if it can't be reached or fails.
+        '''
         if not token:
             raise ValueError('Must supply token')
         user = self._cache.get_user(token)
         if user:
             return user
 
-        d = {'token': token, 'fields': 'user_id'}
-        ret = _requests.post(self._authurl, data=d)
+        try:
+            ret = _requests.get(self._authurl, headers={'Authorization': token},
+                                timeout=self._timeout)
+        except _requests.RequestException as e:
+            raise AuthServiceError('Error connecting to auth service: {}'.format(e)) from e
+        if ret.status_code == 401:
+            self._cache.add_invalid_token(token)
+            raise InvalidToken('Invalid token')
         if not ret.ok:
             try:
-                err = ret.json()
-            except Exception as e:
-                ret.raise_for_status()
-            raise ValueError('Error connecting to auth service: {} {}\n{}'
-                             .format(ret.status_code, ret.reason,
-                                     err['error']['message']))
-
-        user = ret.json()['user_id']
-        self._cache.add_valid_token(token, user)
-        return user
+                message = ret.json()['error']['message']
+            except Exception:
+                message = None
+            raise AuthServiceError('Error connecting to auth service: {} {}{}'
+                                   .format(ret.status_code, ret.reason,
+                                           '\n' + message if message else ''))
+
+        j = ret.json()
+        # the service gives the token expiry and how long it may be cached, both in ms
+        expires = _time.time() + j.get('cachefor', self._cache._MAX_TIME_SEC * 1000) / 1000
+        if j.get('expires'):
+            expires = min(expires, j['expires'] / 1000)
+        self._cache.add_valid_token(token, j['user'], expires)
+        return j['user']
@@ -7,13 +7,21 @@
 
 from __future__ import print_function
 
+import asyncio as _asyncio
+import contextlib as _contextlib
 import json as _json
+import weakref as _weakref
+import aiohttp as _aiohttp
 import requests as _requests
 import random as _random
 import os as _os
+import threading as _threading
 import traceback as _traceback
+from http.cookiejar import DefaultCookiePolicy as _DefaultCookiePolicy
+from requests.adapters import HTTPAdapter as _HTTPAdapter
 from requests.exceptions import ConnectionError
 from urllib3.exceptions import ProtocolError
+from urllib3.util.retry import Retry as _Retry
 
 try:
     from configparser import ConfigParser as _ConfigParser  # py 3
@@ -31,6 +39,200 @@ _AJ = 'application/json'
 _URL_SCHEME = frozenset(['http', 'https'])
 _CHECK_JOB_RETRYS = 3
 
+# Connection pool defaults, overridable per process via set_pool_defaults() or per client
+_POOL_DEFAULTS = {
+    'pool_connections': 10,
+    'pool_maxsize': 10,
+    'max_retries': 3,
+    'keep_alive': True
+}
+
+# pooled sessions shared by every client pointed at the same url with the same pool settings
+_SESSIONS = {}
+_SESSIONS_LOCK = _threading.Lock()
+
+
+def set_pool_defaults(pool_connections=None, pool_maxsize=None, max_retries=None,
+                      keep_alive=None):
+    '''
+    Set the process wide connection pool defaults used by clients that don't specify their own.
+    Only affects sessions created after the call.
+    '''
+    for k, v in (('pool_connections', pool_connections), ('pool_maxsize', pool_maxsize),
+                 ('max_retries', max_retries), ('keep_alive', keep_alive)):
+        if v is not None:
+            _POOL_DEFAULTS[k] = v
+
+
+class _PooledSession(object):
+
+    def __init__(self, url, pool_connections, pool_maxsize, max_retries, keep_alive):
+        self.url = url
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.keep_alive = keep_alive
+        self.calls = 0
+        self.session = _requests.Session()
+        # the session is shared between users, so never let cookies leak from one to another
+        self.session.cookies.set_policy(_DefaultCookiePolicy(allowed_domains=[]))
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+        # only retry connection failures, JSON-RPC calls such as save_objects aren't idempotent
+        retries = _Retry(total=max_retries, connect=max_retries, read=0, status=0,
+                         redirect=0, backoff_factor=0.1)
+        self.adapter = _HTTPAdapter(pool_connections=pool_connections,
+                                    pool_maxsize=pool_maxsize,
+                                    max_retries=retries)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+    def post(self, url, **kwargs):
+        self.calls += 1
+        return self.session.post(url, **kwargs)
+
+    def stats(self):
+        pools = self.adapter.poolmanager.pools
+        hosts = []
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            hosts.append({
+                'host': pool.host,
+                'port': pool.port,
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle_connections': pool.pool.qsize() if pool.pool else 0
+            })
+        return {
+            'url': self.url,
+            'pool_connections': self.pool_connections,
+            'pool_maxsize': self.pool_maxsize,
+            'max_retries': self.max_retries,
+            'keep_alive': self.keep_alive,
+            'calls': self.calls,
+            'hosts': hosts
+        }
+
+
+def _session_key(session):
+    return (session.url, session.pool_connections, session.pool_maxsize, session.max_retries,
+            session.keep_alive)
+
+
+def _get_session(url, pool_connections, pool_maxsize, max_retries, keep_alive):
+    key = (url, pool_connections, pool_maxsize, max_retries, keep_alive)
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(key)
+        if session is None:
+            session = _PooledSession(url, pool_connections, pool_maxsize, max_retries,
+                                     keep_alive)
+            _SESSIONS[key] = session
+    return session
+
+
+def get_pool_stats():
+    '''
+    Returns connection pool statistics for every pooled session in the process.
+    '''
+    with _SESSIONS_LOCK:
+        sessions = list(_SESSIONS.values())
+    return [s.stats() for s in sessions]
+
+
+def close_pooled_sessions():
+    '''
+    Closes all the pooled sessions in the process.
+    '''
+    with _SESSIONS_LOCK:
+        sessions = [s for s in _SESSIONS.values() if isinstance(s, _PooledSession)]
+        for s in sessions:
+            del _SESSIONS[_session_key(s)]
+    for s in sessions:
+        s.session.close()
+
+
+class _AsyncPooledSession(object):
+
+    def __init__(self, url, pool_maxsize, max_retries, keep_alive):
+        self.url = url
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.keep_alive = keep_alive
+        self.calls = 0
+        # aiohttp sessions are bound to the event loop they were created in
+        self._sessions = _weakref.WeakKeyDictionary()
+
+    def _get_client_session(self):
+        loop = _asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = _aiohttp.TCPConnector(limit=self.pool_maxsize,
+                                              limit_per_host=self.pool_maxsize,
+                                              force_close=not self.keep_alive)
+            # the session is shared between users, so never let cookies leak from one to another
+            session = _aiohttp.ClientSession(connector=connector,
+                                             cookie_jar=_aiohttp.DummyCookieJar())
+            self._sessions[loop] = session
+        return session
+
+    @_contextlib.asynccontextmanager
+    async def post(self, url, **kwargs):
+        self.calls += 1
+        session = self._get_client_session()
+        retries = 0
+        while True:
+            try:
+                ret = await session.post(url, **kwargs)
+                break
+            # only retry connection failures, JSON-RPC calls such as save_objects aren't
+            # idempotent
+            except _aiohttp.ClientConnectorError:
+                if retries >= self.max_retries:
+                    raise
+                await _asyncio.sleep(0.1 * 2 ** retries)
+                retries += 1
+        async with ret:
+            yield ret
+
+    async def close(self):
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            await session.close()
+
+    def stats(self):
+        return {
+            'url': self.url,
+            'async': True,
+            'pool_maxsize': self.pool_maxsize,
+            'max_retries': self.max_retries,
+            'keep_alive': self.keep_alive,
+            'calls': self.calls,
+            'open_sessions': len([s for s in self._sessions.values() if not s.closed])
+        }
+
+
+def _get_async_session(url, pool_maxsize, max_retries, keep_alive):
+    key = ('async', url, pool_maxsize, max_retries, keep_alive)
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(key)
+        if session is None:
+            session = _AsyncPooledSession(url, pool_maxsize, max_retries, keep_alive)
+            _SESSIONS[key] = session
+    return session
+
+
+async def close_async_pooled_sessions():
+    '''
+    Closes all the pooled aiohttp sessions in the process.
+    '''
+    with _SESSIONS_LOCK:
+        sessions = [s for s in _SESSIONS.values() if isinstance(s, _AsyncPooledSession)]
+    for s in sessions:
+        await s.close()
+
 
 def _get_token(user_id, password, auth_svc):
     # This is bandaid helper function until we get a full
@@ -120,6 +322,11 @@ class BaseClient(object):
     lookup_url - set to true when contacting KBase dynamic services.
     async_job_check_time_ms - the wait time between checking job state for
         asynchronous jobs run with the run_job method.
+    pool_connections - the number of host connection pools to cache.
+    pool_maxsize - the maximum number of connections kept alive per host.
+    max_retries - the number of times to retry establishing a connection.
+    keep_alive - set to False to close the connection after every call.
+    Clients with the same url and pool settings share one pooled session.
     '''
     def __init__(
             self, url=None, timeout=30 * 60, user_id=None,
@@ -129,7 +336,11 @@ class BaseClient(object):
             lookup_url=False,
             async_job_check_time_ms=100,
             async_job_check_time_scale_percent=150,
-            async_job_check_max_time_ms=300000):
+            async_job_check_max_time_ms=300000,
+            pool_connections=None,
+            pool_maxsize=None,
+            max_retries=None,
+            keep_alive=None):
         if url is None:
             raise ValueError('A url is required')
         scheme, _, _, _, _, _ = _urlparse(url)
@@ -163,8 +374,18 @@ class BaseClient(object):
                         authdata['user_id'], authdata['password'], auth_svc)
         if self.timeout < 1:
             raise ValueError('Timeout value must be at least 1 second')
+        self._session = self._get_pooled_session(
+            url,
+            _POOL_DEFAULTS['pool_connections'] if pool_connections is None else pool_connections,
+            _POOL_DEFAULTS['pool_maxsize'] if pool_maxsize is None else pool_maxsize,
+            _POOL_DEFAULTS['max_retries'] if max_retries is None else max_retries,
+            _POOL_DEFAULTS['keep_alive'] if keep_alive is None else keep_alive)
 
-    def _call(self, url, method, params, context=None):
+    def _get_pooled_session(self, url, pool_connections, pool_maxsize, max_retries,
+                            keep_alive):
+        return _get_session(url, pool_connections, pool_maxsize, max_retries, keep_alive)
+
+    def _build_body(self, method, params, context=None):
         arg_hash = {'method': method,
                     'params': params,
                     'version': '1.1',
@@ -175,10 +396,23 @@ class BaseClient(object):
                 raise ValueError('context is not type dict as required.')
             arg_hash['context'] = context
 
-        body = _json.dumps(arg_hash, cls=_JSONObjectEncoder)
-        ret = _requests.post(url, data=body, headers=self._headers,
-                             timeout=self.timeout,
-                             verify=not self.trust_all_ssl_certificates)
+        return _json.dumps(arg_hash, cls=_JSONObjectEncoder)
+
+    @staticmethod
+    def _process_response(resp):
+        if 'result' not in resp:
+            raise ServerError('Unknown', 0, 'An unknown server error occurred')
+        if not resp['result']:
+            return
+        if len(resp['result']) == 1:
+            return resp['result'][0]
+        return resp['result']
+
+    def _call(self, url, method, params, context=None):
+        body = self._build_body(method, params, context)
+        ret = self._session.post(url, data=body, headers=self._headers,
+                                 timeout=self.timeout,
+                                 verify=not self.trust_all_ssl_certificates)
         ret.encoding = 'utf-8'
         if ret.status_code == 500:
             if ret.headers.get(_CT) == _AJ:
@@ -191,14 +425,7 @@ class BaseClient(object):
                 raise ServerError('Unknown', 0, ret.text)
         if not ret.ok:
             ret.raise_for_status()
-        resp = ret.json()
-        if 'result' not in resp:
-            raise ServerError('Unknown', 0, 'An unknown server error occurred')
-        if not resp['result']:
-            return
-        if len(resp['result']) == 1:
-            return resp['result'][0]
-        return resp['result']
+        return self._process_response(ret.json())
 
     def _get_service_url(self, service_method, service_version):
         if not self.lookup_url:
@@ -280,3 +507,100 @@ class BaseClient(object):
         url = self._get_service_url(service_method, service_ver)
         context = self._set_up_context(service_ver, context)
         return self._call(url, service_method, args, context)
+
+
+class AsyncBaseClient(BaseClient):
+    '''
+    An asyncio variant of the KBase base client built on aiohttp.
+    Takes the same arguments as BaseClient, but _call, call_method and run_job are
+    coroutines. Clients with the same url and pool settings share one pooled aiohttp session
+    per event loop.
+    '''
+
+    def _get_pooled_session(self, url, pool_connections, pool_maxsize, max_retries,
+                            keep_alive):
+        return _get_async_session(url, pool_maxsize, max_retries, keep_alive)
+
+    async def _call(self, url, method, params, context=None):
+        body = self._build_body(method, params, context)
+        async with self._session.post(
+                url, data=body, headers=self._headers,
+                timeout=_aiohttp.ClientTimeout(total=self.timeout),
+                ssl=False if self.trust_all_ssl_certificates else None) as ret:
+            text = await ret.text(encoding='utf-8')
+            if ret.status == 500:
+                if ret.headers.get(_CT) == _AJ:
+                    err = _json.loads(text)
+                    if 'error' in err:
+                        raise ServerError(**err['error'])
+                    else:
+                        raise ServerError('Unknown', 0, text)
+                else:
+                    raise ServerError('Unknown', 0, text)
+            if not ret.ok:
+                ret.raise_for_status()
+        return self._process_response(_json.loads(text))
+
+    async def _get_service_url(self, service_method, service_version):
+        if not self.lookup_url:
+            return self.url
+        service, _ = service_method.split('.')
+        service_status_ret = await self._call(
+            self.url, 'ServiceWizard.get_service_status',
+            [{'module_name': service, 'version': service_version}])
+        return service_status_ret['url']
+
+    async def run_job(self, service_method, args, service_ver=None, context=None):
+        '''
+        Run a SDK method asynchronously.
+        Required arguments:
+        service_method - the service and method to run, e.g. myserv.mymeth.
+        args - a list of arguments to the method.
+        Optional arguments:
+        service_ver - the version of the service to run, e.g. a git hash
+            or dev/beta/release.
+        context - the rpc context dict.
+        '''
+        mod, _ = service_method.split('.')
+        job_id = await self._submit_job(service_method, args, service_ver, context)
+        async_job_check_time = self.async_job_check_time
+        check_job_failures = 0
+        while check_job_failures < _CHECK_JOB_RETRYS:
+            await _asyncio.sleep(async_job_check_time)
+            async_job_check_time = (async_job_check_time *
+                                    self.async_job_check_time_scale_percent /
+                                    100.0)
+            if async_job_check_time > self.async_job_check_max_time:
+                async_job_check_time = self.async_job_check_max_time
+
+            try:
+                job_state = await self._check_job(mod, job_id)
+            except _aiohttp.ClientConnectionError:
+                _traceback.print_exc()
+                check_job_failures += 1
+                continue
+
+            if job_state['finished']:
+                if not job_state['result']:
+                    return
+                if len(job_state['result']) == 1:
+                    return job_state['result'][0]
+                return job_state['result']
+        raise RuntimeError("_check_job failed {} times and exceeded limit".format(
+            check_job_failures))
+
+    async def call_method(self, service_method, args, service_ver=None,
+                          context=None):
+        '''
+        Call a standard or dynamic service asynchronously.
+        Required arguments:
+        service_method - the service and method to run, e.g. myserv.mymeth.
+        args - a list of arguments to the method.
+        Optional arguments:
+        service_ver - the version of the service to run, e.g. a git hash
+            or dev/beta/release.
+        context - the rpc context dict.
+        '''
+        url = await self._get_service_url(service_method, service_ver)
+        context = self._set_up_context(service_ver, context)
+        return await self._call(url, service_method, args, context)
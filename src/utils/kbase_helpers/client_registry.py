@@ -0,0 +1,49 @@
+"""
+A per process registry of KBase Workspace clients, so clients are reused across requests
+rather than constructed for every call.
+"""
+
+import hashlib
+
+from src.utils.cache import TTLCache
+from src.utils.kbase_helpers.workspaceClient import AsyncWorkspace, Workspace
+
+_DEFAULT_MAXSIZE = 1000
+_DEFAULT_TTL_SEC = 300
+
+_CLIENTS = TTLCache(maxsize=_DEFAULT_MAXSIZE, ttl=_DEFAULT_TTL_SEC)
+
+
+def configure_workspace_clients(maxsize: int = _DEFAULT_MAXSIZE, ttl: float = _DEFAULT_TTL_SEC):
+    """
+    Replace the client registry with an empty one with the given bounds.
+    maxsize - the maximum number of clients to keep.
+    ttl - the time in seconds a client is kept after it was created.
+    """
+    global _CLIENTS
+    _CLIENTS = TTLCache(maxsize=maxsize, ttl=ttl)
+
+
+def get_workspace_client(ws_url: str, token: str = None, async_client: bool = False):
+    """
+    Get a Workspace client for a url and token, creating it if it isn't already registered.
+    Tokens are only stored in the registry key as a hash.
+    ws_url - the url of the workspace service.
+    token - the user's token, or None for an anonymous client.
+    async_client - True to get an AsyncWorkspace rather than a Workspace.
+    """
+    token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest() if token else None
+    key = (async_client, ws_url, token_hash)
+    clients = _CLIENTS
+    ws = clients.get(key)
+    if ws is None:
+        client_class = AsyncWorkspace if async_client else Workspace
+        # never pick up credentials from a ~/.kbase_config file on the server
+        ws = client_class(url=ws_url, token=token, ignore_authrc=True)
+        clients.set(key, ws)
+    return ws
+
+
+def workspace_client_stats() -> dict:
+    """ Returns the registry size and hit statistics. """
+    return _CLIENTS.stats()
@@ -10,6 +10,7 @@ from __future__ import print_function
 # the following is a hack to get the baseclient to import whether we're in a
 # package or not. This makes pep8 unhappy hence the annotations.
 from src.utils.kbase_helpers.baseclient import BaseClient as _BaseClient
+from src.utils.kbase_helpers.baseclient import AsyncBaseClient as _AsyncBaseClient
 
 class Workspace(object):
 
@@ -17,7 +18,9 @@ class Workspace(object):
             self, url=None, timeout=30 * 60, user_id=None,
             password=None, token=None, ignore_authrc=False,
             trust_all_ssl_certificates=False,
-            auth_svc='https://ci.kbase.us/services/auth/api/legacy/KBase/Sessions/Login'):
+            auth_svc='https://ci.kbase.us/services/auth/api/legacy/KBase/Sessions/Login',
+            pool_connections=None, pool_maxsize=None, max_retries=None,
+            keep_alive=None):
         if url is None:
             raise ValueError('A url is required')
         self._service_ver = None
@@ -25,7 +28,9 @@ class Workspace(object):
             url, timeout=timeout, user_id=user_id, password=password,
             token=token, ignore_authrc=ignore_authrc,
             trust_all_ssl_certificates=trust_all_ssl_certificates,
-            auth_svc=auth_svc)
+            auth_svc=auth_svc, pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize, max_retries=max_retries,
+            keep_alive=keep_alive)
 
     def ver(self, context=None):
         """
@@ -5270,3 +5275,26 @@ class Workspace(object):
     def status(self, context=None):
         return self._client.call_method('Workspace.status',
                                         [], self._service_ver, context)
+
+
+class AsyncWorkspace(Workspace):
+    """
+    An asyncio variant of the Workspace client. Every Workspace method is available and returns
+    an awaitable, e.g. ``info = await ws.get_objects2(params)``.
+    """
+
+    def __init__(
+            self, url=None, timeout=30 * 60, user_id=None,
+            password=None, token=None, ignore_authrc=False,
+            trust_all_ssl_certificates=False,
+            auth_svc='https://ci.kbase.us/services/auth/api/legacy/KBase/Sessions/Login',
+            pool_maxsize=None, max_retries=None, keep_alive=None):
+        if url is None:
+            raise ValueError('A url is required')
+        self._service_ver = None
+        self._client = _AsyncBaseClient(
+            url, timeout=timeout, user_id=user_id, password=password,
+            token=token, ignore_authrc=ignore_authrc,
+            trust_all_ssl_certificates=trust_all_ssl_certificates,
+            auth_svc=auth_svc, pool_maxsize=pool_maxsize,
+            max_retries=max_retries, keep_alive=keep_alive)
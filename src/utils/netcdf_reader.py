@@ -0,0 +1,130 @@
+"""
+A lazy reader for netCDF files shared by the ARM and ESGF handlers.
+
+The files are opened together as one dask backed dataset, and the variable selection and time
+slice, and any coordinate bounds, are applied before anything is loaded, so only the requested
+data is ever read. iter_frames then materialises the data a block of time steps at a time to bound
+peak memory whatever the date range. read_frame loads the whole selection at once, so it is
+bounded by refusing selections of more than max_rows rows before anything is loaded.
+"""
+
+import math
+
+import pandas as pd
+import xarray as xr
+
+# the number of time steps per dask chunk and per frame yielded by iter_frames
+DEFAULT_TIME_CHUNK = 1440
+
+AGGREGATES = ('mean', 'min', 'max')
+
+
+def _select(ds: xr.Dataset, variables=None, time_dim='time', time_start=None, time_end=None,
+            bounds=None) -> xr.Dataset:
+    if variables:
+        missing = [v for v in variables if v not in ds.variables]
+        if missing:
+            raise ValueError(f"Unknown variables {missing}, expected some of {sorted(ds.data_vars)}")
+        # selecting data variables keeps the coordinates they depend on
+        ds = ds[list(variables)]
+    if (time_start or time_end) and time_dim in ds.dims:
+        ds = ds.sel({time_dim: slice(time_start, time_end)})
+    for dim, (low, high) in (bounds or {}).items():
+        if dim not in ds.dims:
+            raise ValueError(f"Unknown dimension {dim}, expected one of {sorted(ds.dims)}")
+        # coordinates may be stored in descending order, e.g. latitude from north to south
+        values = ds[dim].values
+        if len(values) > 1 and values[0] > values[-1]:
+            low, high = high, low
+        ds = ds.sel({dim: slice(low, high)})
+    return ds
+
+
+def open_datasets(paths, variables=None, time_start=None, time_end=None, time_dim='time',
+                  time_chunk=DEFAULT_TIME_CHUNK, bounds=None) -> xr.Dataset:
+    """
+    Lazily open one or more netCDF files or OPENDAP URLs as a single dataset.
+
+    paths - the file paths or URLs, combined along their coordinates.
+    variables - the names of the variables to keep, or None to keep them all.
+    time_start, time_end - the inclusive time window to keep, either end may be None.
+    time_dim - the name of the time dimension.
+    time_chunk - the number of time steps per dask chunk.
+    bounds - the inclusive (low, high) range to keep per dimension, for example
+        {'lat': (30, 45), 'lon': (250, 270)}. Either end may be None.
+
+    The dataset must be closed by the caller once the data has been read.
+    """
+    if isinstance(paths, (str, bytes)) or not hasattr(paths, '__iter__'):
+        paths = [paths]
+    paths = [str(p) for p in paths]
+    if not paths:
+        raise ValueError('No files to read')
+
+    def preprocess(ds):
+        # applied to each file as it is opened, so unneeded variables are dropped before combining
+        return _select(ds, variables)
+
+    ds = xr.open_mfdataset(
+        paths,
+        combine='by_coords',
+        chunks={time_dim: time_chunk},
+        preprocess=preprocess,
+        data_vars='minimal',
+        coords='minimal',
+        compat='override',
+        join='outer'
+    )
+    # slicing the combined dataset is still lazy, and copes with files entirely outside the window
+    return _select(ds, time_dim=time_dim, time_start=time_start, time_end=time_end, bounds=bounds)
+
+
+def resample(ds: xr.Dataset, minutes: int, aggregate='mean', time_dim='time') -> xr.Dataset:
+    """
+    Lazily resample a dataset to one time step every given number of minutes, aggregating the
+    values in each step with mean, min or max.
+    """
+    if aggregate not in AGGREGATES:
+        raise ValueError(f"Unknown aggregate {aggregate}, expected one of {list(AGGREGATES)}")
+    if time_dim not in ds.dims:
+        raise ValueError(f"Cannot resample data without a {time_dim} dimension")
+    return getattr(ds.resample({time_dim: f'{minutes}min'}), aggregate)()
+
+
+def iter_frames(ds: xr.Dataset, time_dim='time', time_chunk=DEFAULT_TIME_CHUNK):
+    """
+    Yields the dataset as pandas DataFrames of at most time_chunk time steps each, so only one
+    block of the data is in memory at a time.
+    """
+    if time_dim not in ds.dims:
+        yield ds.to_dataframe()
+        return
+    for start in range(0, ds.sizes[time_dim], time_chunk):
+        yield ds.isel({time_dim: slice(start, start + time_chunk)}).to_dataframe()
+
+
+def count_rows(ds: xr.Dataset) -> int:
+    """ Returns the number of rows of the dataset as a DataFrame, without loading it. """
+    return math.prod(ds.sizes.values())
+
+
+def read_frame(paths, variables=None, time_start=None, time_end=None, time_dim='time',
+               time_chunk=DEFAULT_TIME_CHUNK, resample_minutes=None, aggregate='mean',
+               max_rows=None) -> pd.DataFrame:
+    """
+    Read the selected data from one or more netCDF files into a single DataFrame. See
+    open_datasets for the arguments. The whole selection is held in memory, use open_datasets and
+    iter_frames to stream larger selections.
+    resample_minutes - if given, resample the data to one row per this many minutes, see resample.
+    aggregate - how the values are aggregated when resampling.
+    max_rows - if given, selections of more rows fail before any data is loaded.
+    """
+    with open_datasets(paths, variables, time_start, time_end, time_dim, time_chunk) as ds:
+        if resample_minutes:
+            ds = resample(ds, resample_minutes, aggregate, time_dim)
+        rows = count_rows(ds)
+        if max_rows and rows > max_rows:
+            raise ValueError(f"The selected data has {rows} rows, more than the {max_rows} allowed. "
+                             f"Narrow it down with time_start and time_end or resample it")
+        # loaded in one go, reading it block by block would only add a concatenated copy
+        return ds.to_dataframe()
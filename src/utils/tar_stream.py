@@ -0,0 +1,33 @@
+"""
+Writes tar archives as a stream of byte strings, so an archive of large files can be sent to a
+client without being assembled in memory or on disk first.
+"""
+
+import os
+import tarfile
+
+MEDIA_TYPE_TAR = "application/x-tar"
+
+_BLOCK_SIZE = tarfile.BLOCKSIZE
+_CHUNK_SIZE = 1024 * 1024
+
+
+def iter_tar(members, chunk_size=_CHUNK_SIZE):
+    """
+    Yields a tar archive in chunks.
+    members - an iterable of (name in the archive, path of the file) pairs. It is consumed lazily,
+        so the files may still be in the making when the archive is started.
+    """
+    for name, path in members:
+        with open(path, 'rb') as f:
+            info = tarfile.TarInfo(name)
+            st = os.fstat(f.fileno())
+            info.size, info.mtime = st.st_size, int(st.st_mtime)
+            yield info.tobuf(format=tarfile.PAX_FORMAT)
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                yield chunk
+        # each member is padded to a whole number of blocks
+        if info.size % _BLOCK_SIZE:
+            yield b'\0' * (_BLOCK_SIZE - info.size % _BLOCK_SIZE)
+    # the end of archive marker
+    yield b'\0' * (2 * _BLOCK_SIZE)
@@ -0,0 +1,233 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src.service.dataverse import Dataverse
+from src.service.errors import UnsupportedOperationError
+from src.utils.data_handlers.data_handler import DataHandler, FileStream
+
+
+class _DummyHandler(DataHandler):
+
+    def __init__(self):
+        super().__init__('dummy')
+        self.started, self.stopped = False, False
+
+    async def startup(self):
+        self.started = True
+
+    async def shutdown(self):
+        self.stopped = True
+
+    def fetch_data(self, **kwargs):
+        return [kwargs.get('token'), kwargs.get('path')]
+
+
+@pytest.mark.asyncio
+async def test_handler_lifecycle():
+    handler = _DummyHandler()
+    dataverse = Dataverse()
+    dataverse.register_handler('dummy', handler)
+
+    await dataverse.startup()
+    assert handler.started
+
+    assert await dataverse.resolve_path('dummy', token='t1', path='p1') == ['t1', 'p1']
+    assert await dataverse.resolve_path('dummy', token='t2', path='p2') == ['t2', 'p2']
+    assert dataverse.list_handlers() == ['dummy']
+
+    await dataverse.shutdown()
+    assert handler.stopped
+
+
+class _SlowHandler(DataHandler):
+
+    def __init__(self):
+        super().__init__('slow')
+        self.running, self.max_running = 0, 0
+        self._lock = threading.Lock()
+
+    def fetch_data(self, **kwargs):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.05)
+        with self._lock:
+            self.running -= 1
+        return threading.current_thread().name
+
+
+@pytest.mark.asyncio
+async def test_sync_handlers_offloaded_and_limited():
+    slow = _SlowHandler()
+    dataverse = Dataverse(max_workers=8)
+    dataverse.register_handler('slow', slow, max_concurrency=2)
+    dataverse.register_handler('dummy', _DummyHandler())
+    await dataverse.startup()
+    try:
+        # distinct calls, identical ones would share a single fetch
+        slow_calls = asyncio.gather(*[dataverse.resolve_path('slow', path=str(i)) for i in range(6)])
+        # the event loop stays free to serve other providers while the slow calls run
+        assert await dataverse.resolve_path('dummy', token='t') == ['t', None]
+        threads = await slow_calls
+    finally:
+        await dataverse.shutdown()
+
+    assert slow.max_running == 2
+    assert all(t.startswith('dataverse_handler') for t in threads)
+
+
+@pytest.mark.asyncio
+async def test_stream_path():
+    dataverse = Dataverse(max_workers=2)
+    dataverse.register_handler('dummy', _DummyHandler(), max_concurrency=1)
+    await dataverse.startup()
+    try:
+        rows = [row async for row in dataverse.stream_path('dummy', token='t', path='p')]
+    finally:
+        await dataverse.shutdown()
+
+    assert rows == ['t', 'p']
+
+
+class _RowsHandler(DataHandler):
+
+    def __init__(self):
+        super().__init__('rows')
+        self.pulled, self.closed = 0, False
+
+    def iter_data(self, **kwargs):
+        try:
+            for i in range(2500):
+                self.pulled += 1
+                yield i
+        finally:
+            self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_stream_path_blocks():
+    handler = _RowsHandler()
+    dataverse = Dataverse(max_workers=2)
+    dataverse.register_handler('rows', handler)
+    calls = []
+    call_handler = dataverse._call_handler
+    dataverse._call_handler = lambda *args, **kwargs: calls.append(args) or call_handler(*args, **kwargs)
+    await dataverse.startup()
+    try:
+        rows = [row async for row in dataverse.stream_path('rows')]
+    finally:
+        await dataverse.shutdown()
+
+    assert rows == list(range(2500))
+    # rows are pulled from the handler a block at a time
+    assert len(calls) == 3
+    assert handler.closed
+
+
+@pytest.mark.asyncio
+async def test_stream_path_closed_early():
+    handler = _RowsHandler()
+    dataverse = Dataverse(max_workers=2)
+    dataverse.register_handler('rows', handler)
+    await dataverse.startup()
+    try:
+        stream = dataverse.stream_path('rows')
+        assert await stream.__anext__() == 0
+        # the client went away
+        await stream.aclose()
+    finally:
+        await dataverse.shutdown()
+
+    assert handler.closed
+    assert handler.pulled == 1000
+
+
+@pytest.mark.asyncio
+async def test_open_file():
+    class _FileHandler(_DummyHandler):
+
+        def open_file(self, **kwargs):
+            return FileStream(iter([b'ab', b'cd']), 206, {'Content-Range': 'bytes 0-3/10'}, close)
+
+    closed = []
+
+    def close():
+        closed.append(True)
+
+    dataverse = Dataverse(max_workers=2)
+    dataverse.register_handler('dummy', _DummyHandler())
+    dataverse.register_handler('file', _FileHandler())
+    await dataverse.startup()
+    try:
+        with pytest.raises(UnsupportedOperationError):
+            await dataverse.open_file('dummy', object_id='f')
+        file_stream = await dataverse.open_file('file', object_id='f')
+        chunks = [chunk async for chunk in dataverse.iter_file(file_stream)]
+    finally:
+        await dataverse.shutdown()
+
+    assert file_stream.status_code == 206
+    assert chunks == [b'ab', b'cd']
+    assert closed == [True]
+
+
+@pytest.mark.asyncio
+async def test_resolve_facets():
+    class _FacetHandler(_DummyHandler):
+
+        def fetch_facets(self, **kwargs):
+            return {name: {'v': 1} for name in kwargs.get('names')}
+
+    dataverse = Dataverse(max_workers=2)
+    dataverse.register_handler('dummy', _DummyHandler())
+    dataverse.register_handler('facets', _FacetHandler())
+    await dataverse.startup()
+    try:
+        with pytest.raises(UnsupportedOperationError):
+            await dataverse.resolve_facets('dummy', names=['a'])
+        counts = await dataverse.resolve_facets('facets', names=['a', 'b'])
+    finally:
+        await dataverse.shutdown()
+
+    assert counts == {'a': {'v': 1}, 'b': {'v': 1}}
+
+
+@pytest.mark.asyncio
+async def test_resolve_path_single_flight():
+    class _CountingHandler(_DummyHandler):
+
+        def __init__(self):
+            super().__init__()
+            self.calls = 0
+
+        async def fetch_data(self, **kwargs):
+            self.calls += 1
+            await asyncio.sleep(0.05)
+            return [kwargs.get('path')]
+
+    handler = _CountingHandler()
+    dataverse = Dataverse(max_workers=2)
+    dataverse.register_handler('slow', handler)
+    await dataverse.startup()
+    try:
+        first = asyncio.ensure_future(dataverse.resolve_path('slow', token='t1', path='p'))
+        await asyncio.sleep(0)
+        # the first caller going away doesn't cancel the fetch for the others
+        first.cancel()
+        results = await asyncio.gather(
+            *[dataverse.resolve_path('slow', token='t1', path='p') for _ in range(3)],
+            dataverse.resolve_path('slow', token='t2', path='p'),
+            dataverse.resolve_path('slow', token='t1', path='q'),
+            dataverse.resolve_path('slow', token='t3', auth_user='u', path='p'),
+            dataverse.resolve_path('slow', token='t4', auth_user='u', path='p'))
+        # fetched again once the first fetch has landed
+        assert await dataverse.resolve_path('slow', token='t1', path='p') == ['p']
+    finally:
+        await dataverse.shutdown()
+
+    assert results == [['p'], ['p'], ['p'], ['p'], ['q'], ['p'], ['p']]
+    assert handler.calls == 5
+    assert dataverse.flight_stats() == {'fetches': 5, 'collapsed': 4, 'in_flight': 0}
@@ -0,0 +1,87 @@
+from fastapi.testclient import TestClient
+
+from src.service import app_state
+from src.service.app import create_app
+from src.service.dataverse import Dataverse
+from src.utils.data_handlers.data_handler import DataHandler
+from src.utils.kbase_helpers.authclient import KBaseAuth
+
+
+class _EchoHandler(DataHandler):
+
+    def __init__(self):
+        super().__init__('KBase')
+        self.calls = []
+
+    def fetch_data(self, **kwargs):
+        self.calls.append(kwargs)
+        return [kwargs.get('auth_user')]
+
+
+def _client():
+    app = create_app()
+    # the auth service is never called, the tokens are all cached
+    auth = KBaseAuth('http://auth.test/api/V2/token')
+    auth._cache.add_valid_token('good', 'user1')
+    auth._cache.add_invalid_token('bad')
+    app.state._auth = auth
+    handler = _EchoHandler()
+    dataverse = Dataverse()
+    dataverse.register_handler('KBase', handler)
+    dataverse.register_handler('ARM', handler)
+    app_state.DATAVERSE = dataverse
+    return TestClient(app, raise_server_exceptions=False), handler
+
+
+def test_kbase_token_validated():
+    client, handler = _client()
+
+    res = client.post('/data2/KBase/35084', json={'object_id': '1'}, headers={'Auth-Token': 'good'})
+    assert res.status_code == 200
+    assert res.json() == ['user1']
+
+    res = client.post('/data2/KBase/35084', json={'object_id': '1'}, headers={'Auth-Token': 'bad'})
+    assert res.status_code == 401
+    assert res.json()['error']['appcode'] == 10020
+    assert len(handler.calls) == 1
+
+
+def test_other_tokens_not_validated():
+    client, handler = _client()
+
+    # ARM tokens are checked by the ADC, and KBase public data needs no token
+    res = client.post('/data2/ARM/sgpmetE13.b1', json={}, headers={'Auth-Token': 'bad', 'Username': 'u'})
+    assert res.status_code == 200
+    res = client.post('/data2/KBase/35084', json={'object_id': '1'})
+    assert res.status_code == 200
+    assert [c['auth_user'] for c in handler.calls] == [None, None]
+
+
+def test_auth_service_down():
+    client, handler = _client()
+    # nothing listens on port 1
+    client.app.state._auth = KBaseAuth('http://127.0.0.1:1/api/V2/token', timeout=1)
+
+    res = client.post('/data2/KBase/35084', json={'object_id': '1'}, headers={'Auth-Token': 'new'})
+    assert res.status_code == 503
+    assert res.json()['error']['appcode'] == 110000
+    assert handler.calls == []
+
+
+class _ImmutableHandler(_EchoHandler):
+
+    def is_immutable(self, **kwargs):
+        return True
+
+
+def test_immutable_cache_control():
+    client, _ = _client()
+    app_state.DATAVERSE.register_handler('KBase', _ImmutableHandler())
+
+    res = client.post('/data2/KBase/35084', json={'object_id': '1', 'version': 1}, headers={'Auth-Token': 'good'})
+    assert res.status_code == 200
+    # data read with a token must not be kept by shared caches
+    assert res.headers['Cache-Control'] == 'private, max-age=31536000, immutable'
+    res = client.post('/data2/KBase/35084', json={'object_id': '1', 'version': 1})
+    assert res.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert 'ETag' in res.headers
@@ -0,0 +1,69 @@
+import datetime as dt
+import time
+
+import pytest
+
+from src.utils.arm_helpers import arm_helper
+
+
+class _FakeResponse:
+
+    def __init__(self, status_code, body):
+        self.status_code, self.body = status_code, body
+
+    def json(self):
+        return self.body
+
+
+class _FakeSession:
+
+    def __init__(self, status_code=200):
+        self.urls = []
+        self.status_code = status_code
+
+    def get(self, url):
+        self.urls.append(url)
+        return _FakeResponse(self.status_code, {'files': [f'file{len(self.urls)}.cdf']})
+
+
+@pytest.fixture(autouse=True)
+def query_cache():
+    arm_helper.configure_query_cache(maxsize=10, closed_ttl=3600, open_ttl=0.01)
+    yield
+    arm_helper.configure_query_cache()
+
+
+def test_query_cache():
+    session = _FakeSession()
+    files = arm_helper.query_files(session, 'u', 't', 'sgpmetE13.b1', '2017-01-14', '2017-01-20')
+    assert files == ['file1.cdf']
+    # equivalent dates share the cache entry
+    assert arm_helper.query_files(session, 'u', 't', 'sgpmetE13.b1', '20170114', '2017-01-20') == files
+    assert len(session.urls) == 1
+    assert session.urls[0] == ('https://adc.arm.gov/armlive/livedata/query?user=u:t&ds=sgpmetE13.b1'
+                               '&start=2017-01-14T00:00:00.000Z&end=2017-01-20T00:00:00.000Z&wt=json')
+
+    # results are cached per user
+    assert arm_helper.query_files(session, 'u2', 't', 'sgpmetE13.b1', '2017-01-14', '2017-01-20') == ['file2.cdf']
+    assert arm_helper.query_cache_stats()['hits'] == 1
+
+
+def test_query_cache_open_range():
+    session = _FakeSession()
+    today = dt.datetime.now(dt.timezone.utc).strftime('%Y-%m-%d')
+    arm_helper.query_files(session, 'u', 't', 'sgpmetE13.b1', '2017-01-14', today)
+    arm_helper.query_files(session, 'u', 't', 'sgpmetE13.b1', '2017-01-14')
+    time.sleep(0.02)
+    arm_helper.query_files(session, 'u', 't', 'sgpmetE13.b1', '2017-01-14', today)
+    arm_helper.query_files(session, 'u', 't', 'sgpmetE13.b1', '2017-01-14')
+
+    # ranges that may still gain files expire quickly
+    assert len(session.urls) == 4
+
+
+def test_query_failure_not_cached():
+    session = _FakeSession(status_code=401)
+    for _ in range(2):
+        with pytest.raises(ValueError, match='status 401'):
+            arm_helper.query_files(session, 'u', 'bad', 'sgpmetE13.b1', '2017-01-14', '2017-01-14')
+    assert len(session.urls) == 2
@@ -0,0 +1,98 @@
+import threading
+
+import pytest
+
+from src.utils.batcher import MicroBatcher
+
+
+def _submit_all(batcher, items, load, key='k'):
+    results = [None] * len(items)
+    barrier = threading.Barrier(len(items))
+
+    def submit(i):
+        barrier.wait()
+        try:
+            results[i] = batcher.submit(key, items[i], load)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(len(items))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_concurrent_items_batched():
+    batcher = MicroBatcher(window=0.5)
+    loads = []
+
+    def load(items):
+        loads.append(list(items))
+        return [i * 10 for i in items]
+
+    assert _submit_all(batcher, [1, 2, 3, 4], load) == [10, 20, 30, 40]
+    assert len(loads) == 1 and sorted(loads[0]) == [1, 2, 3, 4]
+    assert batcher.stats() == {'batches': 1, 'items': 4}
+
+
+def test_item_errors():
+    batcher = MicroBatcher(window=0.5)
+
+    def load(items):
+        return [ValueError(f'bad {i}') if i % 2 else i for i in items]
+
+    results = _submit_all(batcher, [1, 2, 3], load)
+    assert [str(r) if isinstance(r, Exception) else r for r in results] == ['bad 1', 2, 'bad 3']
+
+
+def test_load_error():
+    batcher = MicroBatcher(window=0.5)
+
+    def load(items):
+        return items[1:]
+
+    results = _submit_all(batcher, [1, 2], load)
+    assert all('Expected 2 results' in str(r) for r in results)
+
+
+def test_full_batch_and_keys():
+    # a long window, which full batches needn't wait out
+    batcher = MicroBatcher(window=5, max_batch_size=2)
+    loads = []
+
+    def load(items):
+        loads.append(list(items))
+        return items
+
+    results = [None] * 4
+    barrier = threading.Barrier(4)
+
+    def submit(i):
+        barrier.wait()
+        results[i] = batcher.submit(i % 2, i, load)
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=4)
+    assert results == [0, 1, 2, 3]
+    # items are only batched with items of the same key
+    assert sorted(sorted(b) for b in loads) == [[0, 2], [1, 3]]
+
+
+def test_no_window():
+    batcher = MicroBatcher(window=0)
+    loads = []
+
+    def load(items):
+        loads.append(list(items))
+        return [ValueError('bad')]
+
+    with pytest.raises(ValueError, match='bad'):
+        batcher.submit('k', 1, load)
+    assert loads == [[1]]
+    with pytest.raises(ValueError):
+        MicroBatcher(max_batch_size=0)
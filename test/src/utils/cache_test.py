@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+
+from src.utils.cache import DiskCache, FileCache, SQLiteCache, TieredCache, TTLCache
+
+
+def test_lru_eviction():
+    cache = TTLCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # a is now the most recently used
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_ttl_expiry():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=0.01)
+    time.sleep(0.02)
+
+    assert cache.get('a') == 1
+    assert cache.get('b', 'gone') == 'gone'
+    assert len(cache) == 1
+
+
+def test_disk_cache(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=25)
+    cache.set('a', b'x' * 10)
+    cache.set('b', b'y' * 10)
+    assert cache.get('a') == b'x' * 10  # a is now the most recently used
+    cache.set('c', b'z' * 10)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == b'x' * 10
+    assert cache.get('c') == b'z' * 10
+    # no temporary files are left behind
+    assert len(list(tmp_path.iterdir())) == 2
+    # the contents survive a restart
+    assert DiskCache(str(tmp_path), max_bytes=25).get('c') == b'z' * 10
+
+
+def test_file_cache_single_download(tmp_path):
+    cache = FileCache(str(tmp_path), max_bytes=1024)
+    downloads = []
+    started = threading.Event()
+
+    def download(out):
+        downloads.append(True)
+        started.set()
+        time.sleep(0.05)
+        out.write(b'netcdf')
+
+    paths = []
+    threads = [threading.Thread(target=lambda: paths.append(cache.fetch('f.cdf', download)))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(downloads) == 1
+    assert len(set(paths)) == 1
+    with open(paths[0], 'rb') as f:
+        assert f.read() == b'netcdf'
+    assert cache.get_file('f.cdf') == paths[0]
+    assert cache.get_file('other.cdf') is None
+    # no temporary files are left behind
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_file_cache_open_evicted(tmp_path):
+    cache = FileCache(str(tmp_path), max_bytes=1024)
+    downloads = []
+
+    def download(out):
+        downloads.append(True)
+        out.write(b'netcdf')
+
+    with cache.fetch_open('f.cdf', download) as f:
+        assert f.read() == b'netcdf'
+    f = cache.open_file('f.cdf')
+    # another process evicts the file while it's open
+    os.remove(cache.path('f.cdf'))
+    with f:
+        assert f.read() == b'netcdf'
+    assert cache.open_file('f.cdf') is None
+    with cache.fetch_open('f.cdf', download) as f:
+        assert f.read() == b'netcdf'
+    assert len(downloads) == 2
+
+
+def test_file_cache_failed_download(tmp_path):
+    cache = FileCache(str(tmp_path), max_bytes=1024)
+
+    def download(out):
+        out.write(b'part')
+        raise ValueError('connection reset')
+
+    try:
+        cache.fetch('f.cdf', download)
+    except ValueError:
+        pass
+    assert cache.get_file('f.cdf') is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_file_cache_keeps_new_file(tmp_path):
+    cache = FileCache(str(tmp_path), max_bytes=100)
+    old = cache.fetch('old.cdf', lambda out: out.write(b'x' * 60))
+    # larger than the cache, but the caller still needs to read it
+    new = cache.fetch('new.cdf', lambda out: out.write(b'y' * 120))
+
+    assert cache.get_file('old.cdf') is None
+    assert cache.get_file('new.cdf') == new != old
+
+
+def test_sqlite_cache_shared(tmp_path):
+    path = str(tmp_path / 'shared.db')
+    cache = SQLiteCache(path, 'things', maxsize=10)
+    # another worker with the same database
+    other = SQLiteCache(path, 'things', maxsize=10)
+
+    cache.set(('ws', 1), {'a': [1, 2]})
+    cache.set('short', 1, ttl=0.05)
+    assert other.get(('ws', 1)) == {'a': [1, 2]}
+    assert other.get('short') == 1
+    time.sleep(0.1)
+    assert other.get('short') is None
+    assert SQLiteCache(path, 'others').get(('ws', 1)) is None
+    other.delete(('ws', 1))
+    assert cache.get(('ws', 1)) is None
+
+
+def test_sqlite_cache_eviction(tmp_path):
+    cache = SQLiteCache(str(tmp_path / 'shared.db'), maxsize=10)
+    for i in range(11):
+        cache.set(f'k{i}', i)
+
+    # evicted down to 90% of the limit, oldest first
+    assert len(cache) == 9
+    assert cache.get('k1') is None
+    assert cache.get('k10') == 10
+
+
+def test_tiered_cache(tmp_path):
+    shared = SQLiteCache(str(tmp_path / 'shared.db'))
+    cache = TieredCache(TTLCache(), shared)
+    cache.set('a', 1, ttl=60)
+
+    # a new worker finds the value in the shared cache, and keeps it locally
+    other = TieredCache(TTLCache(), SQLiteCache(str(tmp_path / 'shared.db')))
+    assert other.get('a') == 1
+    shared.clear()
+    assert other.get('a') == 1
+    assert other.get('b', 'default') == 'default'
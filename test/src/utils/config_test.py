@@ -13,3 +13,20 @@ def test_config_minimal():
 
     assert cfg.service_root_path is None
     assert cfg.kbase_workspace_url == "whee"
+
+
+def test_config_pool_settings():
+    cfg = DataverseServiceConfig(
+        BytesIO("\n".join([
+            "[Service]",
+            "[Service_Dependencies]",
+            'kbase_workspace_url="whee"',
+            'kbase_pool_maxsize=25',
+            'kbase_max_retries=0',
+            'kbase_keep_alive=false'
+        ]).encode('utf-8')))
+
+    assert cfg.kbase_pool_connections == 10
+    assert cfg.kbase_pool_maxsize == 25
+    assert cfg.kbase_max_retries == 0
+    assert cfg.kbase_keep_alive is False
@@ -0,0 +1,52 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils import data_formats
+
+
+def _frame():
+    times = np.array(['2017-01-14T00:00', '2017-01-14T00:01', '2017-01-14T00:02'], dtype='datetime64[ns]')
+    index = pd.DatetimeIndex(times, name='time')
+    return pd.DataFrame({
+        'temp_mean': np.array([1.5, np.nan, -2.25], dtype='float32'),
+        'qc_temp_mean': np.array([0, 1, 0], dtype='int32'),
+        'lat': [36.6, 36.6, 36.6]
+    }, index=index)
+
+
+def test_arrow_ipc():
+    pa = pytest.importorskip('pyarrow')
+    table = pa.ipc.open_stream(data_formats.to_arrow_ipc(_frame())).read_all()
+
+    assert table.column_names == ['time', 'temp_mean', 'qc_temp_mean', 'lat']
+    assert table.schema.field('temp_mean').type == pa.float32()
+    assert table.schema.field('qc_temp_mean').type == pa.int32()
+    pd.testing.assert_frame_equal(table.to_pandas().set_index('time'), _frame())
+
+
+def test_parquet():
+    pa = pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+    table = pq.read_table(io.BytesIO(data_formats.to_parquet(_frame())))
+
+    assert table.schema.field('time').type == pa.timestamp('ns')
+    pd.testing.assert_frame_equal(table.to_pandas().set_index('time'), _frame())
+
+
+def test_columnar_json():
+    data = json.loads(data_formats.to_columnar_json(_frame()))
+
+    assert data == {
+        'columns': {
+            'time': {'dtype': 'datetime64[ns]', 'values': [
+                '2017-01-14T00:00:00.000', '2017-01-14T00:01:00.000', '2017-01-14T00:02:00.000']},
+            'temp_mean': {'dtype': 'float32', 'values': [1.5, None, -2.25]},
+            'qc_temp_mean': {'dtype': 'int32', 'values': [0, 1, 0]},
+            'lat': {'dtype': 'float64', 'values': [36.6, 36.6, 36.6]}
+        },
+        'length': 3
+    }
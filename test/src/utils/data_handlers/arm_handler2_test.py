@@ -0,0 +1,180 @@
+import io
+import os
+import tarfile
+import threading
+import time
+
+import pytest
+
+from src.utils.arm_helpers.arm_helper import configure_query_cache
+from src.utils.cache import FileCache
+from src.utils.data_handlers.arm_handler2 import ARMHandler2
+
+_FILE = 'sgpmetE13.b1.20170114.000000.cdf'
+_BODY = bytes(range(256)) * 10
+
+
+@pytest.fixture(autouse=True)
+def query_cache():
+    configure_query_cache()
+
+
+class _FakeResponse:
+
+    def __init__(self, status_code, body, headers):
+        self.status_code, self.content, self.headers = status_code, body, headers
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def json(self):
+        return self.content
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class _FakeSession:
+
+    def __init__(self, files=(_FILE,), delay=0):
+        self.requests = []
+        self.responses = []
+        self.files = list(files)
+        self.delay = delay
+        self.downloading, self.max_downloading = 0, 0
+        self._lock = threading.Lock()
+
+    def get(self, url, headers=None, stream=False):
+        self.requests.append((url, headers))
+        if '/query?' in url:
+            files = self.files if 'user=u:t&' in url else []
+            return _FakeResponse(200, {'files': files}, {})
+        fname = url.split('&file=')[1]
+        if fname != _FILE:
+            with self._lock:
+                self.downloading += 1
+                self.max_downloading = max(self.max_downloading, self.downloading)
+            time.sleep(self.delay)
+            with self._lock:
+                self.downloading -= 1
+            return _FakeResponse(200, fname.encode() * 100, {})
+        byte_range = (headers or {}).get('Range')
+        if byte_range:
+            start, end = (int(b) for b in byte_range.removeprefix('bytes=').split('-'))
+            response = _FakeResponse(206, _BODY[start:end + 1], {
+                'Content-Length': str(end + 1 - start),
+                'Content-Range': f'bytes {start}-{end}/{len(_BODY)}',
+                'Accept-Ranges': 'bytes'
+            })
+        else:
+            response = _FakeResponse(200, _BODY, {'Content-Length': str(len(_BODY)), 'Accept-Ranges': 'bytes'})
+        self.responses.append(response)
+        return response
+
+    def close(self):
+        pass
+
+
+def _handler(**kwargs):
+    handler = ARMHandler2(**kwargs)
+    handler._session = _FakeSession()
+    return handler
+
+
+def test_open_file():
+    handler = _handler()
+    file_stream = handler.open_file(user='u', token='t', path='sgpmetE13.b1', object_id=_FILE)
+
+    assert file_stream.status_code == 200
+    assert file_stream.headers == {
+        'Content-Length': '2560',
+        'Content-Type': 'application/octet-stream',
+        'Accept-Ranges': 'bytes',
+        'Content-Disposition': f'attachment; filename="{_FILE}"'
+    }
+    assert b''.join(file_stream.chunks) == _BODY
+    url, headers = handler._session.requests[0]
+    assert url == f'https://adc.arm.gov/armlive/livedata/saveData?user=u:t&file={_FILE}'
+    assert headers == {'Accept-Encoding': 'identity'}
+
+    file_stream.close()
+    assert handler._session.responses[0].closed
+
+
+def test_open_file_range():
+    handler = _handler()
+    file_stream = handler.open_file(user='u', token='t', object_id=_FILE, range='bytes=100-299')
+
+    assert file_stream.status_code == 206
+    assert file_stream.headers['Content-Range'] == 'bytes 100-299/2560'
+    assert b''.join(file_stream.chunks) == _BODY[100:300]
+
+
+def test_open_file_fail():
+    handler = _handler()
+    handler._session.get = lambda url, **kwargs: _FakeResponse(401, b'', {})
+
+    with pytest.raises(ValueError, match='status 401'):
+        handler.open_file(user='u', token='bad', object_id=_FILE)
+    with pytest.raises(ValueError, match='datastream'):
+        handler.open_file(user='u', token='t')
+
+
+def test_fetch_file_cached(tmp_path):
+    handler = _handler(file_cache=FileCache(str(tmp_path), 1024 * 1024))
+    session = handler._session
+
+    data = handler.fetch_data(user='u', token='t', path='sgpmetE13.b1', object_id=_FILE)
+    assert data == [{'id': _FILE, 'type': 'data', 'data': _BODY.hex(), 'd': 'cdf hex string'}]
+    assert len(session.requests) == 1
+
+    # served from the cache once the user's access has been checked with the ADC
+    assert handler.fetch_data(user='u', token='t', object_id=_FILE) == data
+    assert len(session.requests) == 2
+    assert session.requests[1][0] == ('https://adc.arm.gov/armlive/livedata/query?user=u:t&ds=sgpmetE13.b1'
+                                      '&start=2017-01-14T00:00:00.000Z&end=2017-01-14T23:59:59.000Z&wt=json')
+
+    with pytest.raises(ValueError, match='not available'):
+        handler.fetch_data(user='other', token='t', object_id=_FILE)
+
+
+def test_fetch_file_cached_evicted(tmp_path):
+    cache = FileCache(str(tmp_path), 1024 * 1024)
+    handler = _handler(file_cache=cache)
+    data = handler.fetch_data(user='u', token='t', object_id=_FILE)
+    check_file_access = handler._check_file_access
+
+    def evict_then_check(*args):
+        # another worker evicts the file while the access check runs
+        os.remove(cache.path(_FILE))
+        check_file_access(*args)
+
+    handler._check_file_access = evict_then_check
+    assert handler.fetch_data(user='u', token='t', object_id=_FILE) == data
+
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_open_archive(tmp_path, cached):
+    fnames = [f'sgpmetE13.b1.201701{d}.000000.cdf' for d in range(15, 21)]
+    handler = ARMHandler2(
+        download_parallelism=3, file_cache=FileCache(str(tmp_path), 1024 * 1024) if cached else None)
+    handler._session = _FakeSession(files=fnames, delay=0.05)
+
+    file_stream = handler.open_file(
+        user='u', token='t', path='sgpmetE13.b1', date_start='2017-01-15', date_end='2017-01-20')
+    assert file_stream.headers['Content-Type'] == 'application/x-tar'
+    archive = b''.join(file_stream.chunks)
+
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        assert tar.getnames() == fnames
+        for fname in fnames:
+            assert tar.extractfile(fname).read() == fname.encode() * 100
+    assert handler._session.max_downloading == 3
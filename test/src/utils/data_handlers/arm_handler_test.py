@@ -1,8 +1,12 @@
 import os
 import sys
+import threading
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
 import pytest
+import xarray as xr
 
 from src.utils.data_handlers.arm_handler import ARMHandler
 from test.config_loader import Config
@@ -42,3 +46,61 @@ async def test_fetch_data(setup_and_teardown):
 
     assert 'base_time' in arm_data[0]
     assert date in arm_data[0]['base_time']
+
+
+@pytest.mark.asyncio
+async def test_fetch_data_subset(tmp_path):
+    time = pd.date_range('2017-01-14', periods=1440, freq='min')
+    path = tmp_path / 'sgpmetE13.b1.20170114.000000.cdf'
+    xr.Dataset({
+        'temp_mean': ('time', np.arange(1440, dtype='float32')),
+        'rh_mean': ('time', np.full(1440, 50.0))
+    }, coords={'time': time}).to_netcdf(path)
+    arm_handler = ARMHandler('u', 't')
+    arm_handler._download_files = lambda datastream, date_start, date_end, directory: [path]
+
+    arm_data = await arm_handler.fetch_data(
+        'sgpmetE13.b1', '2017-01-14', variables=['temp_mean'], time_start='2017-01-14T12:00',
+        time_end='2017-01-14T13:59', resample_minutes=30, aggregate='mean')
+
+    assert arm_data == [{'temp_mean': str(v)} for v in [734.5, 764.5, 794.5, 824.5]]
+
+    df = await arm_handler.fetch_frame('sgpmetE13.b1', '2017-01-14', resample_minutes=720, aggregate='min')
+    assert list(df.columns) == ['temp_mean', 'rh_mean']
+    assert list(df['temp_mean']) == [0, 720]
+
+
+@pytest.mark.asyncio
+async def test_fetch_off_event_loop(tmp_path):
+    path = tmp_path / 'sgpmetE13.b1.20170114.000000.cdf'
+    xr.Dataset({'temp_mean': ('time', np.arange(10, dtype='float32'))},
+               coords={'time': pd.date_range('2017-01-14', periods=10, freq='min')}).to_netcdf(path)
+    threads = []
+
+    def download_files(datastream, date_start, date_end, directory):
+        threads.append(threading.current_thread())
+        return [path]
+
+    arm_handler = ARMHandler('u', 't')
+    arm_handler._download_files = download_files
+    assert len(await arm_handler.fetch_data('sgpmetE13.b1', '2017-01-14')) == 10
+    # the download ran on the thread pool rather than on the event loop
+    assert threads and threads[0] is not threading.current_thread()
+
+
+@pytest.mark.asyncio
+async def test_fetch_cached_file_evicted(tmp_path):
+    path = tmp_path / 'sgpmetE13.b1.20170114.000000.cdf'
+    xr.Dataset({'temp_mean': ('time', np.arange(10, dtype='float32'))},
+               coords={'time': pd.date_range('2017-01-14', periods=10, freq='min')}).to_netcdf(path)
+    downloads = []
+
+    def download_files(datastream, date_start, date_end, directory):
+        downloads.append(date_start)
+        # the first time, another worker evicts the cached file before it's read
+        return [path if len(downloads) > 1 else tmp_path / 'evicted.cdf']
+
+    arm_handler = ARMHandler('u', 't', file_cache=object())
+    arm_handler._download_files = download_files
+    assert len(await arm_handler.fetch_data('sgpmetE13.b1', '2017-01-14')) == 10
+    assert len(downloads) == 2
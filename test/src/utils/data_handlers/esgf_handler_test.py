@@ -1,6 +1,156 @@
+import asyncio
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from aiohttp import web
+
+from src.utils.data_handlers import esgf_handler
 from src.utils.data_handlers.esgf_handler import ESGFHandler
+from src.utils.esgf_helpers import esgf_helper
+
+_DATASET = 'CMIP6.CMIP.NCAR.CESM2.historical.r10i1p1f1.Amon.tas.gn.v20190313|esgf.test'
+
+
+@pytest.fixture(autouse=True)
+def search_cache():
+    esgf_helper.configure_search_cache()
 
 
 def test_init():
     esgf_handler = ESGFHandler()
     assert esgf_handler.provider == 'ESGF'
+
+
+@pytest.fixture
+def model_files(tmp_path):
+    # two files of monthly data on a coarse global grid, like a CMIP6 dataset
+    paths = []
+    for year in [2000, 2001]:
+        time = pd.date_range(f'{year}-01-01', periods=12, freq='MS').astype('datetime64[ns]')
+        lat, lon = np.arange(-90.0, 91.0, 30.0), np.arange(0.0, 360.0, 60.0)
+        tas = np.arange(12 * len(lat) * len(lon), dtype='float32').reshape(12, len(lat), len(lon))
+        ds = xr.Dataset({'tas': (('time', 'lat', 'lon'), tas)},
+                        coords={'time': time, 'lat': lat, 'lon': lon})
+        path = tmp_path / f'tas_Amon_CESM2_historical_r10i1p1f1_gn_{year}01-{year}12.nc'
+        ds.to_netcdf(path)
+        paths.append(path)
+    return paths
+
+
+def _doc(path):
+    return {
+        'id': f'{_DATASET.split("|")[0]}.{path.name}|esgf.test',
+        'title': path.name,
+        'dataset_id': _DATASET,
+        'data_node': 'esgf.test',
+        'version': '20190313',
+        'size': path.stat().st_size,
+        'variable_id': ['tas'],
+        # local paths stand in for the OPENDAP endpoints of the data node
+        'url': [f'{path}.html|application/opendap-html|OPENDAP']
+    }
+
+
+async def _start_fake_index(docs):
+    requests = []
+
+    async def handle(request):
+        requests.append(request.query)
+        if 'facets' in request.query:
+            fields = {f: ['historical', len(docs)] for f in request.query['facets'].split(',')}
+            return web.json_response({'response': {'numFound': 1, 'docs': []},
+                                      'facet_counts': {'facet_fields': fields}})
+        matched = [d for d in docs
+                   if request.query.get('dataset_id', d['dataset_id']) == d['dataset_id']]
+        offset, limit = int(request.query['offset']), int(request.query['limit'])
+        return web.json_response({'response': {'numFound': len(matched), 'docs': matched[offset:offset + limit]}})
+
+    app = web.Application()
+    app.router.add_get('/esg-search/search/', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}/esg-search/search', requests
+
+
+async def _run_handler(docs, call):
+    runner, server, requests = await _start_fake_index(docs)
+    handler = ESGFHandler(index_url=server)
+    await handler.startup()
+    try:
+        # handler methods run on a thread pool in the service
+        result = await asyncio.get_running_loop().run_in_executor(None, call, handler)
+    finally:
+        await esgf_helper.close_sessions()
+        await runner.cleanup()
+    return result, requests
+
+
+@pytest.mark.asyncio
+async def test_list_files(model_files):
+    docs = [_doc(p) for p in model_files]
+    page, requests = await _run_handler(docs, lambda h: h.fetch_data(
+        path='CMIP6', facets={'source_id': 'CESM2', 'variable_id': ['tas', 'pr']}, limit=1))
+
+    assert [i['d'] for i in page['items']] == [model_files[0].name]
+    assert page['items'][0]['dataset_id'] == _DATASET
+    assert page['next'] == 1
+    assert requests[0]['project'] == 'CMIP6' and requests[0]['source_id'] == 'CESM2'
+    assert requests[0].getall('variable_id') == ['tas', 'pr']
+
+
+@pytest.mark.asyncio
+async def test_fetch_subset(model_files):
+    docs = [_doc(p) for p in model_files]
+    rows, requests = await _run_handler(docs, lambda h: h.fetch_data(
+        path='CMIP6', object_id=_DATASET, time_start='2000-12-01', time_end='2001-01-31',
+        bbox=[-40.0, 40.0, 50.0, 130.0]))
+
+    assert requests[0]['dataset_id'] == _DATASET
+    # two months, the lat -30, 0, 30 by lon 60, 120 cells
+    assert len(rows) == 2 * 3 * 2
+    assert set(rows[0]) == {'time', 'lat', 'lon', 'tas'}
+    assert {r['lat'] for r in rows} == {-30.0, 0.0, 30.0}
+    assert {r['lon'] for r in rows} == {60.0, 120.0}
+    assert str(rows[0]['time']) == '2000-12-01 00:00:00'
+    assert isinstance(rows[0]['tas'], float)
+
+
+@pytest.mark.asyncio
+async def test_iter_data_limit(model_files):
+    docs = [_doc(p) for p in model_files]
+    rows, _ = await _run_handler(docs, lambda h: list(h.iter_data(
+        path='CMIP6', object_id=_DATASET, variables=['tas'], limit=5)))
+
+    assert len(rows) == 5
+
+
+@pytest.mark.asyncio
+async def test_reserved_facets(model_files):
+    with pytest.raises(ValueError, match='search parameters'):
+        await _run_handler([], lambda h: h.fetch_data(path='CMIP6', facets={'type': 'Dataset'}))
+
+
+@pytest.mark.asyncio
+async def test_fetch_facets(model_files):
+    docs = [_doc(p) for p in model_files]
+    counts, requests = await _run_handler(docs, lambda h: h.fetch_facets(
+        path='CMIP6', names=['experiment_id'], facets={'source_id': ['CESM2']}))
+
+    assert counts == {'experiment_id': {'historical': 2}}
+    assert requests[0]['facets'] == 'experiment_id' and requests[0]['source_id'] == 'CESM2'
+
+
+@pytest.mark.asyncio
+async def test_fetch_too_many_rows(model_files, monkeypatch):
+    monkeypatch.setattr(esgf_handler, '_MAX_ROWS', 10)
+    docs = [_doc(p) for p in model_files]
+
+    with pytest.raises(ValueError, match='more than 10 rows'):
+        await _run_handler(docs, lambda h: h.fetch_data(path='CMIP6', object_id=_DATASET))
+    rows, _ = await _run_handler(docs, lambda h: h.fetch_data(path='CMIP6', object_id=_DATASET, limit=10))
+    assert len(rows) == 10
@@ -0,0 +1,228 @@
+import threading
+
+from src.utils.cache import DiskCache
+from src.utils.kbase_helpers.baseclient import ServerError
+from src.utils.data_handlers.kbase_handler2 import KBaseHandler2
+
+
+class _FakeWorkspace:
+    """ Serves objects 1-9 of workspace 35084, anything else is inaccessible. """
+
+    def __init__(self):
+        self.calls = []
+        self.error = None
+
+    @staticmethod
+    def _objid(spec):
+        if 'ref' in spec:
+            if not spec['ref'].startswith('35084/'):
+                raise ValueError(f"Illegal reference {spec['ref']}")
+            return int(spec['ref'].split('/')[1])
+        return spec.get('objid')
+
+    def list_workspace_info(self, params):
+        self.calls.append(params)
+        return [[wsid, f'user:narrative_{wsid}', 'user', 'date', 10, 'a', 'n', 'unlocked',
+                 {'narrative_nice_name': f'Narrative {wsid}'} if wsid != 5 else {}]
+                for wsid in range(9, 0, -1)]
+
+    def list_objects(self, params):
+        self.calls.append(params)
+        objids = range(params['minObjectID'], min(params['minObjectID'] + params['limit'], 10))
+        return [[o, f'obj{o}', 'KBaseNarrative.Narrative-4.0' if o == 1 else 'Empty.AType-1.0',
+                 'date', 1, 'user', 35084, 'ws', 'chsum', 10, {}] for o in objids]
+
+    def get_object_info3(self, params):
+        self.calls.append(params)
+        return {'infos': [[self._objid(s)] for s in params['objects']]}
+
+    def get_objects2(self, params):
+        self.calls.append(params)
+        specs = params['objects']
+        if self.error:
+            raise self.error
+        objids = []
+        for i, spec in enumerate(specs):
+            try:
+                objids.append(self._objid(spec))
+            except ValueError as e:
+                # malformed refs fail the whole call, naming the spec
+                raise ServerError('JSONRPCError', -32500, f'Error on ObjectSpecification #{i + 1}: {e}')
+        data = []
+        for objid in objids:
+            if objid is not None and 0 < objid < 10:
+                ver = specs[len(data)].get('ver', 1)
+                info = [objid, f'obj{objid}', 'Empty.AType', 'date', ver, 'user', 35084]
+                data.append({'info': info, 'data': {'foo': objid}})
+            elif params.get('ignoreErrors'):
+                data.append(None)
+            else:
+                raise ValueError('No object')
+        return {'data': data}
+
+
+def _handler(ws):
+    handler = KBaseHandler2(batch_chunk_size=2)
+    handler._get_ws = lambda token: ws
+    return handler
+
+
+def test_init():
+    handler = KBaseHandler2()
+    assert handler.provider == 'KBase'
+    assert handler.batch_chunk_size == 100
+
+
+def test_fetch_batch():
+    ws = _FakeWorkspace()
+    objects = [
+        {'object_id': '35084/1'},
+        {'object_id': 2, 'workspace': 35084},
+        {'object_id': 'obj3', 'workspace': 'myws', 'version': 1},
+        {'object_id': 4, 'workspace': 35084},
+        {'object_id': 'bad/1'},
+    ]
+    batch = _handler(ws).fetch_batch(token='t', objects=objects, chunk_size=50)
+
+    assert [b['type'] for b in batch] == ['data', 'data', 'error', 'data', 'error']
+    assert [b['id'] for b in batch] == ['35084/1', 2, 'obj3', 4, 'bad/1']
+    assert batch[0]['data'][1] == {'foo': 1}
+    assert 'inaccessible' in batch[2]['error']
+    assert 'Illegal reference' in batch[4]['error']
+    # chunks of 2, capped by the handler, with the last chunk failing as a whole
+    assert [len(c['objects']) for c in ws.calls] == [2, 2, 1]
+    assert ws.calls[1]['objects'][0] == {'workspace': 'myws', 'name': 'obj3', 'ver': 1}
+
+
+def test_fetch_batch_bad_specs():
+    ws = _FakeWorkspace()
+    objects = [{'object_id': '35084/1'}, {'object_id': 'bad/1'}, {'object_id': '35084/12'},
+               {'object_id': 'bad/2'}, {'object_id': '35084/2'}]
+    handler = _handler(ws)
+    handler.batch_chunk_size = 50
+    batch = handler.fetch_batch(token='t', objects=objects, chunk_size=50)
+
+    assert [b['type'] for b in batch] == ['data', 'error', 'error', 'error', 'data']
+    assert 'Illegal reference bad/1' in batch[1]['error'] and 'Illegal reference bad/2' in batch[3]['error']
+    # each malformed spec is dropped and the rest fetched together, rather than one by one
+    assert [len(c['objects']) for c in ws.calls] == [5, 4, 3]
+
+
+def test_fetch_batch_upstream_failure():
+    ws = _FakeWorkspace()
+    ws.error = ServerError('JSONRPCError', -32400, 'Token validation failed')
+    objects = [{'object_id': f'35084/{i}'} for i in range(1, 6)]
+    handler = _handler(ws)
+    handler.batch_chunk_size = 50
+    batch = handler.fetch_batch(token='t', objects=objects, chunk_size=50)
+
+    assert all('Token validation failed' in b['error'] for b in batch)
+    # the failure isn't retried object by object
+    assert len(ws.calls) == 1
+
+
+def test_fetch_data_projection():
+    ws = _FakeWorkspace()
+    res = _handler(ws)._fetch_obj_from_ws(ws, '35084/2', included=['/foo'], no_data=True)
+    assert res[1] == {'foo': 2}
+    assert ws.calls[-1] == {'objects': [{'ref': '35084/2', 'included': ['/foo']}], 'no_data': 1}
+
+
+def test_fetch_version_cached(tmp_path):
+    ws = _FakeWorkspace()
+    handler = _handler(ws)
+    handler._object_disk_cache = DiskCache(str(tmp_path), 1024 * 1024)
+    args = {'path': '35084', 'object_id': '3', 'version': 2}
+
+    assert handler.is_immutable(**args)
+    assert not handler.is_immutable(path='myws', object_id='3', version=2)
+    res = handler.fetch_data(token='t1', **args)
+    assert res[0]['data'][0][4] == 2
+    assert ws.calls[-1]['objects'] == [{'wsid': 35084, 'objid': 3, 'ver': 2}]
+
+    # served from the cache without calling the workspace
+    assert handler.fetch_data(token='t1', **args) == res
+    assert len(ws.calls) == 1
+    # a new user's read access is checked before serving from the cache
+    assert handler.fetch_data(token='t2', **args) == res
+    assert ws.calls[-1] == {'objects': [{'ref': '35084/3/2'}]}
+    # and the disk cache survives the memory cache
+    handler._object_cache.clear()
+    assert handler.fetch_data(token='t1', **args) == res
+    assert len(ws.calls) == 2
+
+
+def test_list_pagination():
+    ws = _FakeWorkspace()
+    handler = _handler(ws)
+
+    page = handler.fetch_data(token='t', limit=3)
+    assert [i['id'] for i in page['items']] == ['user:narrative_1', 'user:narrative_2', 'user:narrative_3']
+    page = handler.fetch_data(token='t', limit=3, after=page['next'])
+    # workspace 5 isn't a narrative
+    assert [i['d'] for i in page['items']] == ['Narrative 4', 'Narrative 6', 'Narrative 7']
+    page = handler.fetch_data(token='t', limit=3, after=page['next'])
+    assert page == {'items': page['items'], 'next': None}
+    assert len(page['items']) == 2
+
+    page = handler.fetch_data(token='t', path='35084', limit=4)
+    # the narrative object 1 is skipped
+    assert [i['id'] for i in page['items']] == ['obj2', 'obj3', 'obj4', 'obj5']
+    assert page['next'] == 5
+    assert {'ids': [35084], 'minObjectID': 1, 'limit': 5} in ws.calls
+    page = handler.fetch_data(token='t', path='35084', limit=4, after=5)
+    assert [i['id'] for i in page['items']] == ['obj6', 'obj7', 'obj8', 'obj9']
+    assert page['next'] is None
+
+
+def test_iter_data():
+    ws = _FakeWorkspace()
+    handler = _handler(ws)
+
+    assert len(list(handler.iter_data(token='t'))) == 8
+    rows = list(handler.iter_data(token='t', path='myws', after=3, limit=2))
+    assert [r['id'] for r in rows] == ['obj4', 'obj5']
+    assert ws.calls[-1] == {'workspaces': ['myws'], 'minObjectID': 4, 'limit': 1000}
+
+
+def test_fetch_version_cached_per_user():
+    ws = _FakeWorkspace()
+    handler = _handler(ws)
+    args = {'path': '35084', 'object_id': '3', 'version': 2}
+
+    res = handler.fetch_data(token='t1', auth_user='user1', **args)
+    # another token of the same user is served from the cache without an access check
+    assert handler.fetch_data(token='t2', auth_user='user1', **args) == res
+    assert len(ws.calls) == 1
+    assert handler.fetch_data(token='t3', auth_user='user2', **args) == res
+    assert ws.calls[-1] == {'objects': [{'ref': '35084/3/2'}]}
+
+
+def test_fetch_concurrent_batched():
+    ws = _FakeWorkspace()
+    handler = _handler(ws)
+    handler.batch_chunk_size = 10
+    handler._read_batcher._window = 0.5
+    refs = ['35084/1', '35084/2', '35084/12']
+    results = [None] * len(refs)
+    barrier = threading.Barrier(len(refs))
+
+    def fetch(i):
+        barrier.wait()
+        try:
+            results[i] = handler._fetch_obj_from_ws(ws, refs[i])
+        except ValueError as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=fetch, args=(i,)) for i in range(len(refs))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results[0][1] == {'foo': 1}
+    assert results[1][1] == {'foo': 2}
+    assert 'inaccessible' in str(results[2])
+    # one call for the batch, where the inaccessible object doesn't fail the others
+    assert len(ws.calls) == 1
+    assert ws.calls[0]['ignoreErrors'] == 1 and len(ws.calls[0]['objects']) == 3
@@ -64,4 +64,55 @@ async def test_save_data(setup_and_teardown):
     assert obj_ref.split('/')[0] == str(wsid)
 
     print(obj_info)
-    print(obj_data)
\ No newline at end of file
+    print(obj_data)
+
+
+class _FakeAsyncWorkspace:
+
+    def __init__(self):
+        self.calls = []
+        self.active = self.max_active = 0
+
+    async def save_objects(self, params):
+        self.calls.append(params)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+        if params['id'] == 1:
+            raise ValueError('Workspace 1 is deleted')
+        return [[i + 1, o['name'], o['type'], 'date', 1, 'user', params['id'], 'ws', 'chsum', 10, {}]
+                for i, o in enumerate(params['objects'])]
+
+
+@pytest.mark.asyncio
+async def test_save_batch():
+    kbase_handler = KBaseHandler('token', ws_url='https://ci.kbase.us/services/ws')
+    kbase_handler.ws = _FakeAsyncWorkspace()
+
+    objs = [(wsid, {'type': 'Empty.AType', 'name': f'obj{i}', 'data': {'b': 1, 'a': 2}}, [])
+            for i, wsid in enumerate([10, 20, 10, 1, 10])]
+    results = await kbase_handler.save_batch(objs, chunk_size=2)
+
+    assert [r[0] for r in results if not isinstance(r, Exception)] == ['10/1/1', '20/1/1', '10/2/1', '10/1/1']
+    assert isinstance(results[3], ValueError)
+    assert [r[1][1] for r in results if not isinstance(r, Exception)] == ['obj0', 'obj1', 'obj2', 'obj4']
+    # one call per workspace and chunk of objects
+    assert sorted((c['id'], len(c['objects'])) for c in kbase_handler.ws.calls) == [
+        (1, 1), (10, 1), (10, 2), (20, 1)]
+    assert list(kbase_handler.ws.calls[0]['objects'][0]['data']) == ['a', 'b']
+
+
+@pytest.mark.asyncio
+async def test_save_batch_partial_failure():
+    kbase_handler = KBaseHandler('token', ws_url='https://ci.kbase.us/services/ws')
+    kbase_handler.ws = _FakeAsyncWorkspace()
+
+    objs = [(wsid, {'type': 'Empty.AType', 'name': f'obj{i}'}, []) for i, wsid in enumerate(range(10, 16))]
+    # extra provenance refs without provenance can't be prepared for saving
+    objs[2] = (12, {'type': 'Empty.AType', 'name': 'obj2', 'extra_provenance_input_refs': ['1/2/3']}, None)
+    results = await kbase_handler.save_batch(objs, max_concurrency=2)
+
+    assert isinstance(results[2], ValueError)
+    assert [r[0] for r in results if not isinstance(r, Exception)] == ['10/1/1', '11/1/1', '13/1/1', '14/1/1', '15/1/1']
+    assert kbase_handler.ws.max_active == 2
@@ -0,0 +1,170 @@
+import asyncio
+import threading
+
+import pytest
+from aiohttp import web
+
+from src.utils.esgf_helpers import esgf_helper
+
+_NUM_FOUND = 23
+
+
+@pytest.fixture(autouse=True)
+def search_cache():
+    esgf_helper.configure_search_cache()
+
+
+def _doc(i):
+    return {
+        'id': f'file{i}',
+        'variable_id': ['tas'],
+        'url': [f'http://esgf.test/thredds/dodsC/file{i}.nc.html|application/opendap-html|OPENDAP',
+                f'http://esgf.test/thredds/fileServer/file{i}.nc|application/netcdf|HTTPServer']
+    }
+
+
+async def _start_fake_index(max_page_size=None):
+    requests = []
+    state = {'active': 0, 'max_active': 0}
+
+    async def handle(request):
+        requests.append(request.query)
+        if 'facets' in request.query:
+            fields = {f: ['CESM2', 3, 'E3SM-1-0', 1] for f in request.query['facets'].split(',')}
+            return web.json_response({'response': {'numFound': 4, 'docs': []},
+                                      'facet_counts': {'facet_fields': fields}})
+        state['active'] += 1
+        state['max_active'] = max(state['max_active'], state['active'])
+        await asyncio.sleep(0.02)
+        state['active'] -= 1
+        offset, limit = int(request.query['offset']), int(request.query['limit'])
+        if max_page_size:
+            limit = min(limit, max_page_size)
+        docs = [_doc(i) for i in range(offset, min(offset + limit, _NUM_FOUND))]
+        if 'fields' in request.query:
+            fields = request.query['fields'].split(',')
+            docs = [{k: v for k, v in d.items() if k in fields} for d in docs]
+        return web.json_response({'response': {'numFound': _NUM_FOUND, 'docs': docs}})
+
+    app = web.Application()
+    app.router.add_get('/esg-search/search/', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}/esg-search/search', requests, state
+
+
+@pytest.mark.asyncio
+async def test_search_async():
+    runner, server, requests, state = await _start_fake_index()
+    try:
+        docs = [d async for d in esgf_helper.esgf_search_async(
+            server=server, page_size=5, max_concurrency=2, variable_id='tas', source_id=['CESM2', 'E3SM'])]
+    finally:
+        await esgf_helper.close_sessions()
+        await runner.cleanup()
+
+    assert [d['id'] for d in docs] == [f'file{i}' for i in range(_NUM_FOUND)]
+    assert esgf_helper.file_url(docs[0]) == 'http://esgf.test/thredds/dodsC/file0.nc'
+    assert esgf_helper.file_url(docs[0], 'HTTPServer') == 'http://esgf.test/thredds/fileServer/file0.nc'
+    assert len(requests) == 5
+    assert state['max_active'] == 2
+    assert requests[0].getall('source_id') == ['CESM2', 'E3SM']
+    assert requests[0]['type'] == 'File' and requests[0]['distrib'] == 'false'
+    assert requests[-1]['offset'] == '20' and requests[-1]['limit'] == '3'
+
+
+@pytest.mark.asyncio
+async def test_search_async_limit_fields():
+    runner, server, requests, _ = await _start_fake_index(max_page_size=4)
+    try:
+        docs = [d async for d in esgf_helper.esgf_search_async(
+            server=server, limit=10, fields=['id', 'url'], page_size=8, variable_id='tas')]
+    finally:
+        await esgf_helper.close_sessions()
+        await runner.cleanup()
+
+    assert [d['id'] for d in docs] == [f'file{i}' for i in range(10)]
+    assert set(docs[0]) == {'id', 'url'}
+    # the node capped the pages at 4 records, so no records were skipped
+    assert [(r['offset'], r['limit']) for r in requests] == [('0', '8'), ('4', '4'), ('8', '2')]
+
+
+@pytest.mark.asyncio
+async def test_search_cached(tmp_path):
+    runner, server, requests, _ = await _start_fake_index()
+    try:
+        esgf_helper.configure_search_cache(directory=str(tmp_path))
+        docs = await esgf_helper.esgf_search_cached(
+            server=server, limit=3, variable_id='tas', source_id=['CESM2', 'E3SM'])
+        # the same search with the facets and values in another order
+        again = await esgf_helper.esgf_search_cached(
+            server=server, limit=3, source_id=['E3SM', 'CESM2'], variable_id='tas')
+        assert len(requests) == 1
+        # a new process finds the results on disk
+        esgf_helper.configure_search_cache(directory=str(tmp_path))
+        from_disk = await esgf_helper.esgf_search_cached(
+            server=server, limit=3, variable_id='tas', source_id=['CESM2', 'E3SM'])
+        assert len(requests) == 1
+        await esgf_helper.esgf_search_cached(server=server, limit=3, offset=3, variable_id='tas')
+        assert len(requests) == 2
+    finally:
+        await esgf_helper.close_sessions()
+        await runner.cleanup()
+
+    assert [d['id'] for d in docs] == ['file0', 'file1', 'file2']
+    assert again == docs and from_disk == docs
+    assert esgf_helper.search_cache_stats()['hits'] == 0
+
+
+@pytest.mark.asyncio
+async def test_search_cache_expiry():
+    runner, server, requests, _ = await _start_fake_index()
+    try:
+        esgf_helper.configure_search_cache(ttl=0)
+        for _ in range(2):
+            await esgf_helper.esgf_search_cached(server=server, limit=3, variable_id='tas')
+    finally:
+        await esgf_helper.close_sessions()
+        await runner.cleanup()
+
+    assert len(requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_facets():
+    runner, server, requests, _ = await _start_fake_index()
+    try:
+        counts = await esgf_helper.esgf_facets(
+            server=server, facets=['source_id', 'experiment_id'], variable_id='tas')
+        await esgf_helper.esgf_facets(server=server, facets=['experiment_id', 'source_id'], variable_id='tas')
+    finally:
+        await esgf_helper.close_sessions()
+        await runner.cleanup()
+
+    assert counts['source_id'] == {'CESM2': 3, 'E3SM-1-0': 1}
+    assert set(counts) == {'source_id', 'experiment_id'}
+    assert len(requests) == 1
+    assert requests[0]['type'] == 'Dataset' and requests[0]['limit'] == '0'
+    assert requests[0]['variable_id'] == 'tas'
+
+
+@pytest.mark.asyncio
+async def test_search_cache_disk_off_loop(tmp_path):
+    runner, server, _, _ = await _start_fake_index()
+    threads = []
+    try:
+        esgf_helper.configure_search_cache(directory=str(tmp_path))
+        disk_cache = esgf_helper._SEARCH_DISK_CACHE
+        get, set_ = disk_cache.get, disk_cache.set
+        disk_cache.get = lambda *a: threads.append(threading.current_thread()) or get(*a)
+        disk_cache.set = lambda *a: threads.append(threading.current_thread()) or set_(*a)
+        await esgf_helper.esgf_search_cached(server=server, limit=3, variable_id='tas')
+    finally:
+        await esgf_helper.close_sessions()
+        await runner.cleanup()
+
+    # the disk cache was read and written on the thread pool, never on the event loop
+    assert len(threads) == 2 and threading.current_thread() not in threads
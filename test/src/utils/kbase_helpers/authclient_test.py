@@ -0,0 +1,131 @@
+import time
+
+import pytest
+
+from src.utils.cache import SQLiteCache
+from src.utils.kbase_helpers import authclient
+from src.utils.kbase_helpers.authclient import AuthServiceError, InvalidToken, KBaseAuth, TokenCache
+
+
+class _FakeResponse:
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.reason = 'reason'
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+@pytest.fixture
+def auth_service(monkeypatch):
+    # token -> (status code, body)
+    tokens = {}
+    calls = []
+
+    def get(url, headers=None, timeout=None):
+        assert timeout
+        calls.append(headers['Authorization'])
+        return _FakeResponse(*tokens.get(headers['Authorization'], (401, {'error': {'message': 'Invalid token'}})))
+
+    monkeypatch.setattr(authclient._requests, 'get', get)
+    return tokens, calls
+
+
+def test_token_cache_expiry():
+    cache = TokenCache()
+    cache.add_valid_token('t1', 'user1', time.time() + 60)
+    cache.add_valid_token('t2', 'user2', time.time() - 1)
+
+    assert cache.get_user('t1') == 'user1'
+    assert cache.get_user('t2') is None
+    assert cache.get_user('t3') is None
+
+
+def test_token_cache_lru():
+    cache = TokenCache(maxsize=2, stripes=1)
+    cache.add_valid_token('t1', 'user1')
+    cache.add_valid_token('t2', 'user2')
+    cache.get_user('t1')
+    cache.add_valid_token('t3', 'user3')
+
+    assert cache.get_user('t1') == 'user1'
+    assert cache.get_user('t2') is None
+    assert cache.get_user('t3') == 'user3'
+
+
+def test_token_cache_invalid():
+    cache = TokenCache(invalid_token_ttl=0)
+    cache.add_invalid_token('bad')
+    assert cache.get_user('bad') is None
+
+    cache = TokenCache(invalid_token_ttl=60)
+    cache.add_invalid_token('bad')
+    with pytest.raises(InvalidToken):
+        cache.get_user('bad')
+
+
+def test_get_user(auth_service):
+    tokens, calls = auth_service
+    now_ms = time.time() * 1000
+    tokens['good'] = (200, {'user': 'user1', 'expires': now_ms + 3600 * 1000, 'cachefor': 300000})
+    tokens['expiring'] = (200, {'user': 'user2', 'expires': now_ms - 1000, 'cachefor': 300000})
+    auth = KBaseAuth('http://auth.test/api/V2/token')
+
+    assert auth.get_user('good') == 'user1'
+    assert auth.get_user('good') == 'user1'
+    # cached until it expires, which has already happened
+    assert auth.get_user('expiring') == 'user2'
+    assert auth.get_user('expiring') == 'user2'
+    assert calls == ['good', 'expiring', 'expiring']
+
+
+def test_get_user_invalid(auth_service):
+    _, calls = auth_service
+    auth = KBaseAuth('http://auth.test/api/V2/token')
+
+    for _ in range(3):
+        with pytest.raises(InvalidToken):
+            auth.get_user('bad')
+    assert calls == ['bad']
+
+
+def test_get_user_service_error(auth_service):
+    tokens, calls = auth_service
+    tokens['t1'] = (500, {'error': {'message': 'Oops'}})
+    auth = KBaseAuth('http://auth.test/api/V2/token')
+
+    # failures of the auth service aren't cached as invalid tokens
+    for _ in range(2):
+        with pytest.raises(AuthServiceError, match='500 reason\nOops'):
+            auth.get_user('t1')
+    assert calls == ['t1', 't1']
+
+
+def test_token_cache_shared(tmp_path):
+    path = str(tmp_path / 'shared.db')
+    cache = TokenCache(shared=SQLiteCache(path, 'tokens'))
+    cache.add_valid_token('t1', 'user1', time.time() + 60)
+    cache.add_invalid_token('bad')
+
+    # another worker sees the tokens the first one validated
+    other = TokenCache(shared=SQLiteCache(path, 'tokens'))
+    assert other.get_user('t1') == 'user1'
+    with pytest.raises(InvalidToken):
+        other.get_user('bad')
+    assert other.get_user('t2') is None
+
+
+def test_get_cached_user_local_only(tmp_path, auth_service):
+    _, calls = auth_service
+    path = str(tmp_path / 'shared.db')
+    TokenCache(shared=SQLiteCache(path, 'tokens')).add_valid_token('t1', 'user1', time.time() + 60)
+    auth = KBaseAuth('http://auth.test/api/V2/token', shared_cache=SQLiteCache(path, 'tokens'))
+
+    # the shared cache is only checked off the event loop, with the auth service call
+    assert auth.get_cached_user('t1') is None
+    assert auth.get_user('t1') == 'user1'
+    assert auth.get_cached_user('t1') == 'user1'
+    assert calls == []
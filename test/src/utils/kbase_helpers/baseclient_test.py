@@ -0,0 +1,26 @@
+from src.utils.kbase_helpers.baseclient import BaseClient, get_pool_stats
+
+
+def test_clients_share_session():
+    c1 = BaseClient('https://ci.kbase.us/services/ws', token='foo', ignore_authrc=True)
+    c2 = BaseClient('https://ci.kbase.us/services/ws', token='bar', ignore_authrc=True)
+    c3 = BaseClient('https://kbase.us/services/ws', token='foo', ignore_authrc=True)
+
+    assert c1._session is c2._session
+    assert c1._session is not c3._session
+    assert c1._headers['AUTHORIZATION'] == 'foo'
+    assert c2._headers['AUTHORIZATION'] == 'bar'
+
+
+def test_pool_settings():
+    c = BaseClient('https://ci.kbase.us/services/ws', token='foo', ignore_authrc=True,
+                   pool_maxsize=3, max_retries=1, keep_alive=False)
+
+    assert c._session.session.headers['Connection'] == 'close'
+
+    stats = [s for s in get_pool_stats() if s['pool_maxsize'] == 3]
+    assert len(stats) == 1
+    assert stats[0]['url'] == 'https://ci.kbase.us/services/ws'
+    assert stats[0]['max_retries'] == 1
+    assert stats[0]['keep_alive'] is False
+    assert stats[0]['calls'] == 0
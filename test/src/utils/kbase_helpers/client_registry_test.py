@@ -0,0 +1,23 @@
+from src.utils.kbase_helpers.client_registry import configure_workspace_clients, get_workspace_client
+from src.utils.kbase_helpers.workspaceClient import AsyncWorkspace, Workspace
+
+WS_URL = 'https://ci.kbase.us/services/ws'
+
+
+def test_clients_reused_per_token():
+    configure_workspace_clients(maxsize=10, ttl=60)
+    ws = get_workspace_client(WS_URL, 'token1')
+
+    assert isinstance(ws, Workspace)
+    assert get_workspace_client(WS_URL, 'token1') is ws
+    assert get_workspace_client(WS_URL, 'token2') is not ws
+    assert get_workspace_client(WS_URL, None) is not ws
+    assert isinstance(get_workspace_client(WS_URL, 'token1', async_client=True), AsyncWorkspace)
+
+
+def test_clients_evicted():
+    configure_workspace_clients(maxsize=1, ttl=60)
+    ws = get_workspace_client(WS_URL, 'token1')
+    get_workspace_client(WS_URL, 'token2')
+
+    assert get_workspace_client(WS_URL, 'token1') is not ws
@@ -1,9 +1,12 @@
+import json
 import os
 from pathlib import Path
 
 import pytest
+from aiohttp import web
 
-from src.utils.kbase_helpers.workspaceClient import Workspace
+from src.utils.kbase_helpers.baseclient import ServerError
+from src.utils.kbase_helpers.workspaceClient import AsyncWorkspace, Workspace
 from test.config_loader import Config
 
 
@@ -19,8 +22,41 @@ def setup_and_teardown():
     yield cfg.kbase_workspace_url, cfg.kbase_auth_token
 
 
+async def _start_fake_ws():
+    # a minimal JSON-RPC server standing in for the workspace
+    async def handle(request):
+        body = json.loads(await request.text())
+        if body['method'] == 'Workspace.ver':
+            return web.json_response({'version': '1.1', 'result': ['0.14.2']})
+        error = {'name': 'JSONRPCError', 'code': -32500, 'message': 'No such method'}
+        return web.json_response({'version': '1.1', 'error': error}, status=500)
+
+    app = web.Application()
+    app.router.add_post('/services/ws', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}/services/ws'
+
+
 def test_init(setup_and_teardown):
     ws_url, auth_token = setup_and_teardown
     ws = Workspace(url=ws_url, token=auth_token)
 
     assert ws.ver()
+
+
+@pytest.mark.asyncio
+async def test_async_workspace():
+    runner, url = await _start_fake_ws()
+    try:
+        ws = AsyncWorkspace(url=url, token='foo')
+
+        assert await ws.ver() == '0.14.2'
+        with pytest.raises(ServerError, match='No such method'):
+            await ws.status()
+        await ws._client._session.close()
+    finally:
+        await runner.cleanup()
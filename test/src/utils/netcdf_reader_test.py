@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from src.utils import netcdf_reader
+
+
+@pytest.fixture
+def cdf_files(tmp_path):
+    # two days of minute data, one file per day like an ARM datastream
+    paths = []
+    for day in ['2017-01-14', '2017-01-15']:
+        time = pd.date_range(day, periods=1440, freq='min')
+        ds = xr.Dataset({
+            'temp_mean': ('time', np.arange(1440, dtype='float32')),
+            'rh_mean': ('time', np.full(1440, 50.0)),
+            'qc_temp_mean': ('time', np.zeros(1440, dtype='int32')),
+            'lat': ((), 36.6)
+        }, coords={'time': time})
+        path = tmp_path / f'sgpmetE13.b1.{day.replace("-", "")}.000000.cdf'
+        ds.to_netcdf(path)
+        paths.append(path)
+    return paths
+
+
+def test_open_datasets_lazy(cdf_files):
+    with netcdf_reader.open_datasets(cdf_files, variables=['temp_mean']) as ds:
+        assert list(ds.data_vars) == ['temp_mean']
+        assert ds.sizes['time'] == 2880
+        # nothing has been loaded yet
+        assert ds['temp_mean'].chunks is not None
+
+
+def test_read_frame_time_window(cdf_files):
+    df = netcdf_reader.read_frame(
+        cdf_files, variables=['temp_mean', 'rh_mean'],
+        time_start='2017-01-14T23:58', time_end='2017-01-15T00:01')
+
+    assert list(df.columns) == ['temp_mean', 'rh_mean']
+    assert df['temp_mean'].dtype == np.float32
+    assert list(df['temp_mean']) == [1438, 1439, 0, 1]
+    assert str(df.index[0]) == '2017-01-14 23:58:00'
+
+
+def test_read_frame_max_rows(cdf_files):
+    with pytest.raises(ValueError, match='2880 rows, more than the 2000 allowed'):
+        netcdf_reader.read_frame(cdf_files, max_rows=2000)
+    # resampling happens before the rows are counted
+    df = netcdf_reader.read_frame(cdf_files, resample_minutes=60, max_rows=2000)
+    assert len(df) == 48
+
+
+def test_iter_frames(cdf_files):
+    with netcdf_reader.open_datasets(cdf_files, variables=['qc_temp_mean'], time_chunk=1000) as ds:
+        frames = list(netcdf_reader.iter_frames(ds, time_chunk=1000))
+
+    assert [len(f) for f in frames] == [1000, 1000, 880]
+
+
+def test_unknown_variable(cdf_files):
+    with pytest.raises(ValueError, match='Unknown variables'):
+        netcdf_reader.read_frame(cdf_files, variables=['nope'])
+
+
+def test_read_frame_resample(cdf_files):
+    df = netcdf_reader.read_frame(
+        cdf_files, variables=['temp_mean'], time_start='2017-01-14T00:00', time_end='2017-01-14T02:59',
+        resample_minutes=60, aggregate='max')
+
+    assert list(df['temp_mean']) == [59, 119, 179]
+    assert df['temp_mean'].dtype == np.float32
+    assert [str(t) for t in df.index] == ['2017-01-14 00:00:00', '2017-01-14 01:00:00', '2017-01-14 02:00:00']
+
+    with pytest.raises(ValueError, match='Unknown aggregate'):
+        netcdf_reader.read_frame(cdf_files, resample_minutes=60, aggregate='median')
+
+
+def test_open_datasets_bounds(tmp_path):
+    # latitude stored from north to south
+    path = tmp_path / 'grid.nc'
+    xr.Dataset({'tas': (('lat', 'lon'), np.zeros((5, 4)))},
+               coords={'lat': [60.0, 30.0, 0.0, -30.0, -60.0], 'lon': [0.0, 90.0, 180.0, 270.0]}).to_netcdf(path)
+
+    with netcdf_reader.open_datasets(path, bounds={'lat': (-30, 30), 'lon': (90, None)}) as ds:
+        assert list(ds['lat'].values) == [30.0, 0.0, -30.0]
+        assert list(ds['lon'].values) == [90.0, 180.0, 270.0]
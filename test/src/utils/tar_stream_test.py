@@ -0,0 +1,18 @@
+import io
+import tarfile
+
+from src.utils.tar_stream import iter_tar
+
+
+def test_iter_tar(tmp_path):
+    files = {'a.cdf': b'a' * 1000, 'b.cdf': b'', 'c.cdf': b'c' * 512}
+    for name, data in files.items():
+        (tmp_path / name).write_bytes(data)
+
+    chunks = list(iter_tar(((name, tmp_path / name) for name in files), chunk_size=100))
+
+    assert max(len(c) for c in chunks) <= 1024
+    with tarfile.open(fileobj=io.BytesIO(b''.join(chunks))) as tar:
+        assert tar.getnames() == list(files)
+        for name, data in files.items():
+            assert tar.extractfile(name).read() == data